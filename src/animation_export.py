@@ -0,0 +1,278 @@
+import argparse
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from PySide6 import QtGui
+
+from document_renderer import DocumentRenderer
+from pixel_array import image_array
+import palette_ops
+
+
+def animation_frames(document, animation, scale=1):
+    """Composite the frames of an animation one at a time.
+
+    Yields (pixels, duration_ms) with pixels as a (height, width) uint32 ARGB array.
+    """
+    renderer = DocumentRenderer(document)
+    for frame in range(animation.length):
+        image = renderer.render(document.tile_rect(animation.frame_tile(frame)))
+        image.convertTo(QtGui.QImage.Format_ARGB32)
+        pixels = image_array(image).copy()
+        if scale > 1:
+            pixels = pixels.repeat(scale, axis=0).repeat(scale, axis=1)
+        yield pixels, animation.frame_duration_ms(frame)
+
+
+def lzw_encode(indices, min_code_size):
+    """GIF flavored variable-width LZW, returns the packed code stream"""
+    clear_code = 1 << min_code_size
+    end_code = clear_code + 1
+
+    output = bytearray()
+    bit_buffer = 0
+    bit_count = 0
+
+    def reset():
+        return {}, end_code + 1, min_code_size + 1
+
+    table, next_code, code_size = reset()
+
+    def emit(code, size):
+        nonlocal bit_buffer, bit_count
+        bit_buffer |= code << bit_count
+        bit_count += size
+        while bit_count >= 8:
+            output.append(bit_buffer & 0xff)
+            bit_buffer >>= 8
+            bit_count -= 8
+
+    emit(clear_code, code_size)
+
+    data = indices.tobytes()
+    prefix = data[0] if data else None
+    for value in data[1:]:
+        key = (prefix << 8) | value
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+
+        emit(prefix, code_size)
+        if next_code < 4096:
+            table[key] = next_code
+            if next_code == (1 << code_size) and code_size < 12:
+                code_size += 1
+            next_code += 1
+        else:
+            emit(clear_code, code_size)
+            table, next_code, code_size = reset()
+        prefix = value
+
+    if prefix is not None:
+        emit(prefix, code_size)
+    emit(end_code, code_size)
+    if bit_count:
+        output.append(bit_buffer & 0xff)
+
+    return bytes(output)
+
+
+class GifWriter:
+    """Streams frames into an animated GIF that uses the document palette.
+
+    Palette art needs no quantization: pixels are looked up in the palette directly.
+    Colors created by blending (layer alpha, blend modes) get a local color table
+    when they fit, otherwise they fall back to the nearest palette color. A
+    palette too big for one table leaves the global table empty; frames then
+    get a local table of their 255 most common colors instead.
+    """
+
+    def __init__(self, file, size, palette, loop=0):
+        self.file = file
+        self.width, self.height = size
+
+        colors = [palette_ops.color_value(color) | 0xff000000 for color in palette if color]
+        colors = np.unique(np.array(colors, dtype=np.uint32))
+        self.colors = colors if len(colors) <= 255 else np.zeros(0, dtype=np.uint32)
+
+        self.file.write(b'GIF89a')
+        self.file.write(struct.pack('<HHBBB', self.width, self.height, 0xf7, 0, 0))
+        self.file.write(self.color_table(self.colors))
+        self.file.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+    @staticmethod
+    def color_table(colors):
+        table = np.zeros((256, 3), dtype=np.uint8)
+        table[:len(colors), 0] = (colors >> 16) & 0xff
+        table[:len(colors), 1] = (colors >> 8) & 0xff
+        table[:len(colors), 2] = colors & 0xff
+        return table.tobytes()
+
+    def add_frame(self, pixels, duration_ms):
+        opaque = (pixels >> 24) >= 128
+        rgb = pixels | np.uint32(0xff000000)
+        colors = self.colors
+
+        index = np.searchsorted(colors, rgb) if len(colors) else np.zeros(rgb.shape, dtype=np.intp)
+        np.minimum(index, max(len(colors) - 1, 0), out=index)
+        found = colors[index] == rgb if len(colors) else np.zeros(rgb.shape, dtype=bool)
+        missing = opaque & ~found
+
+        local_table = None
+        if missing.any():
+            frame_colors, counts = np.unique(rgb[opaque], return_counts=True)
+            if len(frame_colors) <= 255:
+                colors = local_table = frame_colors
+                index = np.searchsorted(colors, rgb)
+                np.minimum(index, len(colors) - 1, out=index)
+            else:
+                if not len(colors):
+                    colors = local_table = np.sort(frame_colors[np.argsort(counts, kind='stable')[-255:]])
+                    index = np.searchsorted(colors, rgb)
+                    np.minimum(index, len(colors) - 1, out=index)
+                    missing = opaque & (colors[index] != rgb)
+                index[missing] = self.nearest(colors, rgb[missing])
+
+        transparent = 255
+        indices = np.where(opaque, index, transparent).astype(np.uint8)
+
+        delay = int(round(duration_ms / 10))
+        self.file.write(b'\x21\xf9\x04' + struct.pack('<BHB', 0x09, delay, transparent) + b'\x00')
+
+        flags = 0x87 if local_table is not None else 0
+        self.file.write(b'\x2c' + struct.pack('<HHHHB', 0, 0, self.width, self.height, flags))
+        if local_table is not None:
+            self.file.write(self.color_table(local_table))
+
+        self.file.write(b'\x08')
+        data = lzw_encode(indices, 8)
+        for start in range(0, len(data), 255):
+            block = data[start:start + 255]
+            self.file.write(bytes((len(block),)) + block)
+        self.file.write(b'\x00')
+
+    NEAREST_CHUNK = 4096
+
+    @classmethod
+    def nearest(cls, colors, values):
+        """Index of the closest of `colors` to each of `values`, measuring every distinct value once"""
+        channels = lambda v: np.stack([(v >> s) & 0xff for s in (16, 8, 0)], axis=-1).astype(np.int32)
+        unique, inverse = np.unique(values, return_inverse=True)
+        palette = channels(colors)[None, :, :]
+        closest = np.empty(len(unique), dtype=np.intp)
+        for start in range(0, len(unique), cls.NEAREST_CHUNK):
+            chunk = channels(unique[start:start + cls.NEAREST_CHUNK])
+            closest[start:start + len(chunk)] = ((chunk[:, None, :] - palette) ** 2).sum(axis=-1).argmin(axis=1)
+        return closest[inverse.reshape(-1)]
+
+    def close(self):
+        self.file.write(b'\x3b')
+
+
+class ApngWriter:
+    """Streams frames into an animated PNG.
+
+    Every frame after the first is cropped to the rect that differs from the
+    previous frame and replaces it with the SOURCE blend op, so unchanged
+    regions are never re-encoded.
+    """
+
+    SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+    def __init__(self, file, size, frame_count, loop=0):
+        self.file = file
+        self.width, self.height = size
+        self.sequence = 0
+        self.previous = None
+
+        self.file.write(self.SIGNATURE)
+        self.chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 6, 0, 0, 0))
+        self.chunk(b'acTL', struct.pack('>II', frame_count, loop))
+
+    def chunk(self, kind, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(kind + data)
+        self.file.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    @staticmethod
+    def encode(pixels):
+        height, width = pixels.shape
+        rows = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+        rgba = rows[:, 1:].reshape(height, width, 4)
+        for channel, shift in enumerate((16, 8, 0, 24)):
+            rgba[..., channel] = (pixels >> shift) & 0xff
+        return zlib.compress(rows.tobytes(), 9)
+
+    def add_frame(self, pixels, duration_ms):
+        if self.previous is None:
+            x, y, crop = 0, 0, pixels
+        else:
+            changed = pixels != self.previous
+            if changed.any():
+                rows = np.flatnonzero(changed.any(axis=1))
+                columns = np.flatnonzero(changed.any(axis=0))
+                y, x = rows[0], columns[0]
+                crop = pixels[y:rows[-1] + 1, x:columns[-1] + 1]
+            else:
+                x, y, crop = 0, 0, pixels[:1, :1]
+        self.previous = pixels
+
+        height, width = crop.shape
+        self.chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', self.sequence, width, height, int(x), int(y), int(round(duration_ms)), 1000, 0, 0
+        ))
+        self.sequence += 1
+
+        data = self.encode(crop)
+        if self.sequence == 1:
+            self.chunk(b'IDAT', data)
+        else:
+            self.chunk(b'fdAT', struct.pack('>I', self.sequence) + data)
+            self.sequence += 1
+
+    def close(self):
+        self.chunk(b'IEND', b'')
+
+
+def export_animation(document, animation, path, scale=1):
+    """Write `animation` as a GIF or APNG, depending on the extension of `path`"""
+    size = (document.tile_size.width() * scale, document.tile_size.height() * scale)
+
+    with open(path, 'wb') as file:
+        if os.path.splitext(path)[1].lower() == '.gif':
+            writer = GifWriter(file, size, document.palette)
+        else:
+            writer = ApngWriter(file, size, animation.length)
+
+        for pixels, duration_ms in animation_frames(document, animation, scale):
+            writer.add_frame(pixels, duration_ms)
+        writer.close()
+
+
+def main():
+    from draw_document import DrawDocument
+
+    parser = argparse.ArgumentParser(description='Export the animations of a .pyxel file as GIF or APNG')
+    parser.add_argument('file')
+    parser.add_argument('output', help='.gif or .png file name')
+    parser.add_argument('--animation', help='animation name, defaults to the first one')
+    parser.add_argument('--scale', type=int, default=1)
+    args = parser.parse_args()
+
+    document = DrawDocument(args.file)
+    animations = [
+        animation for animation in document.animations
+        if args.animation is None or animation.name == args.animation
+    ]
+    if not animations:
+        parser.error('no matching animation in {}'.format(args.file))
+
+    export_animation(document, animations[0], args.output, args.scale)
+
+
+if __name__ == '__main__':
+    main()
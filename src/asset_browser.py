@@ -0,0 +1,196 @@
+import os
+import threading
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+from PySide6 import QtWidgets
+
+from thumbnail_cache import ThumbnailCache
+
+
+class AssetLoader(QtCore.QObject):
+    """Scans folders and renders thumbnails on a background thread.
+
+    Folder scans run before thumbnails, and the most recently requested
+    thumbnail is produced first, so scrolling loads what is in view.
+    """
+    scanned = QtCore.Signal(str, list)
+    thumbnail_ready = QtCore.Signal(str, QtGui.QImage)
+
+    def __init__(self, cache):
+        super().__init__()
+        self.cache = cache
+        self._scans = []
+        self._requests = []
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='asset-loader', daemon=True)
+        self._thread.start()
+
+    def scan(self, directory):
+        with self._condition:
+            self._scans.append(directory)
+            self._requests.clear()
+            self._condition.notify()
+
+    def request(self, path):
+        with self._condition:
+            if path in self._requests:
+                self._requests.remove(path)
+            self._requests.append(path)
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not (self._stopped or self._scans or self._requests):
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                if self._scans:
+                    directory = self._scans.pop()
+                    self._scans.clear()
+                    path = None
+                else:
+                    path = self._requests.pop()
+
+            if path is None:
+                self.scanned.emit(directory, self.pyxel_files(directory))
+                continue
+
+            try:
+                image = self.cache.thumbnail(path)
+            except Exception as error:
+                print('thumbnail failed for {}: {}'.format(path, error))
+                image = QtGui.QImage()
+            self.thumbnail_ready.emit(path, image)
+
+    @staticmethod
+    def pyxel_files(directory):
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name.lower())
+        except OSError:
+            return []
+        return [entry.path for entry in entries if entry.is_file() and entry.name.endswith('.pyxel')]
+
+
+class AssetModel(QtCore.QAbstractListModel):
+    PathRole = QtCore.Qt.UserRole
+
+    def __init__(self, loader, thumbnail_size, *args):
+        super().__init__(*args)
+        self.loader = loader
+        self.thumbnail_size = thumbnail_size
+        self._paths = []
+        self._rows = {}
+        self._thumbnails = {}
+
+        self._placeholder = QtGui.QPixmap(thumbnail_size)
+        self._placeholder.fill(QtGui.QColor('#555'))
+
+        loader.thumbnail_ready.connect(self.set_thumbnail)
+
+    def set_paths(self, paths):
+        self.beginResetModel()
+        self._paths = paths
+        self._rows = {path: row for row, path in enumerate(paths)}
+        self._thumbnails = {}
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._paths)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self._paths[index.row()]
+
+        if role == QtCore.Qt.DisplayRole:
+            return os.path.splitext(os.path.basename(path))[0]
+        if role == QtCore.Qt.ToolTipRole or role == self.PathRole:
+            return path
+        if role == QtCore.Qt.DecorationRole:
+            # the view only asks for rows in sight, so thumbnails load as they scroll in
+            if path not in self._thumbnails:
+                self._thumbnails[path] = None
+                self.loader.request(path)
+            return self._thumbnails[path] or self._placeholder
+        return None
+
+    def set_thumbnail(self, path, image):
+        row = self._rows.get(path)
+        if row is None:
+            return
+        self._thumbnails[path] = QtGui.QPixmap.fromImage(image) if not image.isNull() else self._placeholder
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+
+class AssetBrowser(QtWidgets.QWidget):
+    open_requested = QtCore.Signal(str)
+
+    def __init__(self, *args, thumbnail_size=QtCore.QSize(96, 96)):
+        super().__init__(*args)
+
+        self.directory = None
+        self.loader = AssetLoader(ThumbnailCache(size=thumbnail_size))
+        self.loader.scanned.connect(self.on_scanned)
+        self.model = AssetModel(self.loader, thumbnail_size)
+
+        self.setLayout(QtWidgets.QVBoxLayout())
+        self.layout().setContentsMargins(0, 0, 0, 0)
+
+        self.toolbar = QtWidgets.QToolBar(self)
+        self.toolbar.addAction('folder', self.handle_choose_directory)
+        self.toolbar.addAction('refresh', self.refresh)
+        self.layout().addWidget(self.toolbar)
+
+        self.view = QtWidgets.QListView()
+        self.view.setViewMode(QtWidgets.QListView.IconMode)
+        self.view.setResizeMode(QtWidgets.QListView.Adjust)
+        self.view.setMovement(QtWidgets.QListView.Static)
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QtWidgets.QListView.Batched)
+        self.view.setBatchSize(64)
+        self.view.setIconSize(thumbnail_size)
+        self.view.setGridSize(thumbnail_size + QtCore.QSize(16, 24))
+        self.view.setModel(self.model)
+        self.view.doubleClicked.connect(self.on_double_clicked)
+        self.layout().addWidget(self.view)
+
+        directory = QtCore.QSettings().value('editor/asset_browser/directory')
+        if directory and os.path.isdir(directory):
+            self.set_directory(directory)
+
+    def set_directory(self, directory):
+        self.directory = directory
+        self.setToolTip(directory)
+        QtCore.QSettings().setValue('editor/asset_browser/directory', directory)
+        self.loader.scan(directory)
+
+    def refresh(self):
+        if self.directory:
+            self.loader.scan(self.directory)
+
+    def handle_choose_directory(self):
+        directory = QtWidgets.QFileDialog.getExistingDirectory(
+            self, 'Browse Folder', self.directory or os.path.expanduser('~')
+        )
+        if directory:
+            self.set_directory(directory)
+
+    def on_scanned(self, directory, paths):
+        if directory == self.directory:
+            self.model.set_paths(paths)
+
+    def on_double_clicked(self, index):
+        self.open_requested.emit(index.data(AssetModel.PathRole))
+
+    def shut_down(self):
+        self.loader.stop()
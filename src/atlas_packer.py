@@ -0,0 +1,290 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+from PySide6 import QtGui
+
+from document_renderer import DocumentRenderer
+from pixel_array import image_array, array_image
+
+
+class Sprite:
+    def __init__(self, name, pixels):
+        self.name = name
+        self.source_width = pixels.shape[1]
+        self.source_height = pixels.shape[0]
+        self.pixels, self.offset_x, self.offset_y = trim(pixels)
+        self.digest = hashlib.sha1(
+            np.array(self.pixels.shape, dtype=np.uint32).tobytes() + self.pixels.tobytes()
+        ).hexdigest()
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+    @property
+    def trimmed(self):
+        return self.width != self.source_width or self.height != self.source_height
+
+
+def trim(pixels):
+    """Crop fully transparent borders, returns (pixels, x offset, y offset)"""
+    opaque = (pixels >> 24) != 0
+    rows = np.flatnonzero(opaque.any(axis=1))
+    if len(rows) == 0:
+        return pixels[:0, :0], 0, 0
+    columns = np.flatnonzero(opaque.any(axis=0))
+    y0, y1, x0, x1 = rows[0], rows[-1] + 1, columns[0], columns[-1] + 1
+    return pixels[y0:y1, x0:x1], int(x0), int(y0)
+
+
+def composite_pixels(document, rect=None):
+    image = DocumentRenderer(document).render(rect)
+    image.convertTo(QtGui.QImage.Format_ARGB32)
+    return image_array(image).copy()
+
+
+def document_sprites(path, mode, base_name=None):
+    """Sprites of one .pyxel file: its composite, each layer, or each animation frame.
+
+    Sprite names start with `base_name`, the file name without extension by default.
+    """
+    from draw_document import DrawDocument
+
+    document = DrawDocument(path)
+    if base_name is None:
+        base_name = os.path.splitext(os.path.basename(path))[0]
+
+    if mode == 'documents':
+        yield Sprite(base_name, composite_pixels(document))
+    elif mode == 'layers':
+        for index, layer in enumerate(document.layers):
+            yield Sprite('{}/{}:{}'.format(base_name, index, layer.name), layer.read_pixels())
+    elif mode == 'frames':
+        for animation in document.animations:
+            for frame in range(animation.length):
+                rect = document.tile_rect(animation.frame_tile(frame))
+                yield Sprite('{}/{}/{}'.format(base_name, animation.name, frame), composite_pixels(document, rect))
+    else:
+        raise Exception('unknown atlas mode \'%s\'' % mode)
+
+
+class MaxRectsBin:
+    """MaxRects bin packer using the best short side fit heuristic"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.free = [(0, 0, width, height)]
+        self.used_width = 0
+        self.used_height = 0
+
+    def insert(self, width, height):
+        best = None
+        best_score = None
+        for x, y, w, h in self.free:
+            if width <= w and height <= h:
+                score = (min(w - width, h - height), max(w - width, h - height))
+                if best_score is None or score < best_score:
+                    best, best_score = (x, y), score
+
+        if best is None:
+            return None
+
+        placed = (best[0], best[1], width, height)
+        self._split(placed)
+        self.used_width = max(self.used_width, best[0] + width)
+        self.used_height = max(self.used_height, best[1] + height)
+        return best
+
+    def _split(self, placed):
+        px, py, pw, ph = placed
+        kept = []
+        created = []
+        for free in self.free:
+            fx, fy, fw, fh = free
+            if px >= fx + fw or px + pw <= fx or py >= fy + fh or py + ph <= fy:
+                kept.append(free)
+                continue
+            if px > fx:
+                created.append((fx, fy, px - fx, fh))
+            if px + pw < fx + fw:
+                created.append((px + pw, fy, fx + fw - px - pw, fh))
+            if py > fy:
+                created.append((fx, fy, fw, py - fy))
+            if py + ph < fy + fh:
+                created.append((fx, py + ph, fw, fy + fh - py - ph))
+
+        # only rects created by this split can be contained in, or contain, others
+        created = [
+            rect for i, rect in enumerate(created)
+            if not any(contains(other, rect) and (other != rect or j < i) for j, other in enumerate(created) if j != i)
+        ]
+        created = [rect for rect in created if not any(contains(other, rect) for other in kept)]
+        kept = [rect for rect in kept if not any(contains(other, rect) for other in created)]
+        self.free = kept + created
+
+
+def contains(outer, inner):
+    return (
+        inner[0] >= outer[0] and inner[1] >= outer[1]
+        and inner[0] + inner[2] <= outer[0] + outer[2]
+        and inner[1] + inner[3] <= outer[1] + outer[3]
+    )
+
+
+def next_power_of_two(value):
+    return 1 << max(value - 1, 0).bit_length()
+
+
+def pack_sprites(sprites, max_size=2048, padding=1):
+    """Place unique sprites into power-of-two sheets.
+
+    Returns (sheets, placements) where sheets are (width, height) and placements map
+    sprite digests to (sheet index, x, y). Sheets start at the smallest power of two
+    that could hold every sprite and grow until everything fits in one, or max_size
+    is reached and the rest spills into more sheets.
+    """
+    unique = {}
+    for sprite in sprites:
+        unique.setdefault(sprite.digest, sprite)
+
+    order = sorted(
+        unique.values(),
+        key=lambda sprite: (max(sprite.width, sprite.height), sprite.width * sprite.height),
+        reverse=True,
+    )
+    for sprite in order:
+        if sprite.width + padding > max_size or sprite.height + padding > max_size:
+            raise Exception('sprite \'{}\' does not fit in a {}px sheet'.format(sprite.name, max_size))
+
+    area = sum((sprite.width + padding) * (sprite.height + padding) for sprite in order)
+    size = min(next_power_of_two(int(math.sqrt(area))), max_size)
+    if order:
+        size = max(size, next_power_of_two(max(max(sprite.width, sprite.height) + padding for sprite in order)))
+
+    while True:
+        bins, placements = _pack_bins(order, size, padding, None if size >= max_size else 1)
+        if bins is not None:
+            break
+        size *= 2
+
+    sheets = [
+        (next_power_of_two(max(packer.used_width, 1)), next_power_of_two(max(packer.used_height, 1)))
+        for packer in bins
+    ]
+    return sheets, placements
+
+
+def _pack_bins(order, size, padding, max_bins):
+    bins = []
+    placements = {}
+
+    for sprite in order:
+        width, height = sprite.width + padding, sprite.height + padding
+
+        for index, packer in enumerate(bins):
+            position = packer.insert(width, height)
+            if position:
+                break
+        else:
+            if max_bins is not None and len(bins) == max_bins:
+                return None, None
+            bins.append(MaxRectsBin(size, size))
+            index = len(bins) - 1
+            position = bins[index].insert(width, height)
+
+        placements[sprite.digest] = (index, position[0], position[1])
+
+    return bins, placements
+
+
+def write_atlas(sprites, output, max_size=2048, padding=1):
+    """Pack sprites into <output>_N.png sheets plus a <output>.json manifest"""
+    sprites = list(sprites)
+    sheets, placements = pack_sprites(sprites, max_size, padding)
+
+    sheet_pixels = [np.zeros((height, width), dtype=np.uint32) for width, height in sheets]
+    sheet_files = ['{}_{}.png'.format(output, index) for index in range(len(sheets))]
+    written = set()
+    manifest_sprites = {}
+
+    for sprite in sprites:
+        if sprite.name in manifest_sprites:
+            raise Exception('two sprites are called {}'.format(sprite.name))
+        index, x, y = placements[sprite.digest]
+        if sprite.digest not in written:
+            sheet_pixels[index][y:y + sprite.height, x:x + sprite.width] = sprite.pixels
+            written.add(sprite.digest)
+
+        manifest_sprites[sprite.name] = {
+            'sheet': index,
+            'frame': {'x': x, 'y': y, 'w': sprite.width, 'h': sprite.height},
+            'trimmed': sprite.trimmed,
+            'spriteSourceSize': {'x': sprite.offset_x, 'y': sprite.offset_y, 'w': sprite.width, 'h': sprite.height},
+            'sourceSize': {'w': sprite.source_width, 'h': sprite.source_height},
+        }
+
+    for pixels, file_name in zip(sheet_pixels, sheet_files):
+        array_image(pixels).save(file_name)
+
+    manifest = {
+        'sheets': [
+            {'image': os.path.basename(file_name), 'size': {'w': width, 'h': height}}
+            for file_name, (width, height) in zip(sheet_files, sheets)
+        ],
+        'sprites': manifest_sprites,
+    }
+    with open(output + '.json', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    return manifest
+
+
+def pyxel_paths(paths):
+    """(path, name) of every .pyxel file in `paths`, named relative to the directory all of them share"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.pyxel'):
+                    files.append(os.path.join(path, name))
+        else:
+            files.append(path)
+    if not files:
+        return
+
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in files])
+    for path in files:
+        name = os.path.splitext(os.path.relpath(os.path.abspath(path), root))[0]
+        yield path, name.replace(os.sep, '/')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack .pyxel documents, layers or animation frames into atlases')
+    parser.add_argument('inputs', nargs='+', help='.pyxel files or directories')
+    parser.add_argument('-o', '--output', default='atlas', help='output path without extension')
+    parser.add_argument('--mode', choices=['documents', 'layers', 'frames'], default='documents')
+    parser.add_argument('--max-size', type=int, default=2048)
+    parser.add_argument('--padding', type=int, default=1)
+    args = parser.parse_args()
+
+    sprites = (
+        sprite
+        for path, name in pyxel_paths(args.inputs)
+        for sprite in document_sprites(path, args.mode, name)
+    )
+    manifest = write_atlas(sprites, args.output, args.max_size, args.padding)
+    print('packed {} sprites into {} sheets'.format(len(manifest['sprites']), len(manifest['sheets'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+from PySide6 import QtCore
+from PySide6 import QtWidgets
+
+
+class ShiftDialog(QtWidgets.QDialog):
+    """Asks for the offset of a wrapping shift"""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.setWindowTitle('Shift')
+
+        self.dx = QtWidgets.QSpinBox()
+        self.dy = QtWidgets.QSpinBox()
+        for spin_box in (self.dx, self.dy):
+            spin_box.setRange(-65536, 65536)
+
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        layout = QtWidgets.QFormLayout(self)
+        layout.addRow('Horizontal', self.dx)
+        layout.addRow('Vertical', self.dy)
+        layout.addRow(buttons)
+
+    def offset(self):
+        return self.dx.value(), self.dy.value()
+
+
+class CanvasSizeDialog(QtWidgets.QDialog):
+    """Asks for a new canvas size and the side or corner that stays in place"""
+
+    ANCHOR_GRID = [
+        ['top_left', 'top', 'top_right'],
+        ['left', 'center', 'right'],
+        ['bottom_left', 'bottom', 'bottom_right'],
+    ]
+
+    def __init__(self, size, *args):
+        super().__init__(*args)
+        self.setWindowTitle('Canvas Size')
+
+        self.width_box = QtWidgets.QSpinBox()
+        self.height_box = QtWidgets.QSpinBox()
+        for spin_box, value in ((self.width_box, size.width()), (self.height_box, size.height())):
+            spin_box.setRange(1, 16384)
+            spin_box.setValue(value)
+
+        anchors = QtWidgets.QGridLayout()
+        anchors.setSpacing(0)
+        self.anchor_buttons = QtWidgets.QButtonGroup(self)
+        for row, names in enumerate(self.ANCHOR_GRID):
+            for column, name in enumerate(names):
+                button = QtWidgets.QToolButton()
+                button.setCheckable(True)
+                button.setFixedSize(QtCore.QSize(24, 24))
+                button.setChecked(name == 'center')
+                button.setToolTip(name.replace('_', ' '))
+                button.setObjectName(name)
+                self.anchor_buttons.addButton(button)
+                anchors.addWidget(button, row, column)
+
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        layout = QtWidgets.QFormLayout(self)
+        layout.addRow('Width', self.width_box)
+        layout.addRow('Height', self.height_box)
+        layout.addRow('Anchor', anchors)
+        layout.addRow(buttons)
+
+    def canvas_size(self):
+        return QtCore.QSize(self.width_box.value(), self.height_box.value())
+
+    def anchor(self):
+        return self.anchor_buttons.checkedButton().objectName()
@@ -0,0 +1,191 @@
+import numpy as np
+
+from PySide6 import QtCore
+
+from pixel_array import image_array
+import palette_ops
+
+
+class LayerColorUsage:
+    """Color histograms of the allocated tiles of one layer.
+
+    Bins are palette colors in sorted value order, followed by a bin for transparent
+    pixels and one for opaque pixels that are not in the palette.
+    """
+
+    def __init__(self, colors, area):
+        self.colors = colors
+        self.area = area
+        self.bins = len(colors) + 2
+        self.tile_counts = {}
+        self.totals = np.zeros(self.bins, dtype=np.int64)
+
+    @property
+    def transparent_bin(self):
+        return len(self.colors)
+
+    @property
+    def other_bin(self):
+        return len(self.colors) + 1
+
+    def codes(self, pixels):
+        if len(self.colors):
+            index = np.searchsorted(self.colors, pixels)
+            np.minimum(index, len(self.colors) - 1, out=index)
+            codes = np.where(self.colors[index] == pixels, index, self.other_bin)
+        else:
+            codes = np.full(pixels.shape, self.other_bin, dtype=np.intp)
+        codes[(pixels >> 24) == 0] = self.transparent_bin
+        return codes
+
+    def histogram(self, pixels):
+        return np.bincount(self.codes(pixels).ravel(), minlength=self.bins)
+
+    def build(self, tiles):
+        self.tile_counts = {
+            key: self.histogram(image_array(tile))
+            for key, tile in tiles.tiles.items()
+        }
+        self.totals = np.zeros(self.bins, dtype=np.int64)
+        for counts in self.tile_counts.values():
+            self.totals += counts
+
+    def update(self, tiles, rect):
+        for key in tiles.tile_keys(rect):
+            old = self.tile_counts.pop(key, None)
+            if old is not None:
+                self.totals -= old
+
+            tile = tiles.tiles.get(key)
+            if tile is not None:
+                counts = self.histogram(image_array(tile))
+                self.tile_counts[key] = counts
+                self.totals += counts
+
+    def count(self, color_index):
+        if color_index == self.transparent_bin:
+            # unallocated tiles are transparent too
+            return self.area - int(self.totals.sum() - self.totals[self.transparent_bin])
+        return int(self.totals[color_index])
+
+
+class ColorUsageIndex(QtCore.QObject):
+    """Pixel counts of palette colors per layer and per document.
+
+    Histograms are built once per layer storage tile and then updated tile by tile
+    from the rects reported by the document's pixels_changed signal. A canvas
+    change moves every tile, so it rebuilds them all.
+    """
+
+    usage_changed = QtCore.Signal((QtCore.QObject,))
+
+    def __init__(self, document):
+        super().__init__()
+        self.document = document
+        self._palette = None
+        self._colors = np.zeros(0, dtype=np.uint32)
+        self._layers = {}
+
+        document.pixels_changed.connect(self.update_rect)
+        document.canvas_changed.connect(self.canvas_changed)
+
+    def rebuild(self):
+        self._palette = tuple(self.document.palette)
+        self._colors = np.unique(np.array(
+            [palette_ops.color_value(color) for color in self._palette if color is not None],
+            dtype=np.uint32,
+        ))
+        self._layers = {}
+        self._sync_layers()
+        self.usage_changed.emit(self)
+
+    def canvas_changed(self, document, rect):
+        self.rebuild()
+
+    def update_rect(self, layer, rect):
+        if self._palette != tuple(self.document.palette):
+            self.rebuild()
+            return
+
+        usage = self._layers.get(layer)
+        if usage is None:
+            return
+
+        usage.update(layer.tiles, rect)
+        self.usage_changed.emit(self)
+
+    def _sync(self):
+        if self._palette != tuple(self.document.palette):
+            self.rebuild()
+        else:
+            self._sync_layers()
+
+    def _sync_layers(self):
+        layers = set(self.document.layers)
+        for layer in list(self._layers):
+            if layer not in layers:
+                del self._layers[layer]
+
+        for layer in self.document.layers:
+            if layer not in self._layers:
+                usage = LayerColorUsage(self._colors, layer.size.width() * layer.size.height())
+                usage.build(layer.tiles)
+                self._layers[layer] = usage
+
+    def _color_index(self, color):
+        value = palette_ops.color_value(palette_ops.normalize_color(color))
+        index = int(np.searchsorted(self._colors, value))
+        if index < len(self._colors) and self._colors[index] == value:
+            return index
+        return None
+
+    def count(self, color, layer=None):
+        """Number of pixels of `color` in `layer`, or in the whole document"""
+        self._sync()
+        index = self._color_index(color)
+        if index is None:
+            return 0
+        if layer is not None:
+            return self._layers[layer].count(index)
+        return sum(usage.count(index) for usage in self._layers.values())
+
+    def counts(self):
+        """Document-wide pixel count for every palette color"""
+        self._sync()
+        totals = np.zeros(len(self._colors) + 2, dtype=np.int64)
+        for usage in self._layers.values():
+            totals += usage.totals
+        return {
+            palette_ops.color_name(value): int(total)
+            for value, total in zip(self._colors, totals)
+        }
+
+    def layer_counts(self, color):
+        """Pixel count of `color` in each layer that uses it"""
+        self._sync()
+        index = self._color_index(color)
+        if index is None:
+            return {}
+        return {
+            layer: usage.count(index)
+            for layer, usage in self._layers.items()
+            if usage.count(index)
+        }
+
+    def layers_using(self, color):
+        counts = self.layer_counts(color)
+        return [layer for layer in self.document.layers if layer in counts]
+
+    def unused_colors(self):
+        return [color for color, total in self.counts().items() if total == 0]
+
+    def unpaletted_count(self, layer=None):
+        """Number of opaque pixels whose color is not in the palette"""
+        self._sync()
+        usages = [self._layers[layer]] if layer is not None else self._layers.values()
+        return sum(usage.count(usage.other_bin) for usage in usages)
+
+    def color_mask(self, layer, color):
+        """Boolean mask of the pixels of `layer` painted with `color`"""
+        value = palette_ops.color_value(palette_ops.normalize_color(color))
+        return layer.read_pixels() == value
@@ -0,0 +1,46 @@
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from draw_document import DrawDocument
+from document_renderer import DocumentRenderer
+from draw_window import DrawWindow
+import pyxel_diff
+
+
+class DiffWindow(DrawWindow):
+    """The newer revision of a DocumentDiff, with the changed pixels highlighted or both revisions side by side"""
+
+    def __init__(self, diff, side_by_side=False):
+        self.diff = diff
+        self.side_by_side = side_by_side
+        self.boxes = [layer.bounds for layer in diff.changed_layers()]
+        self.old_composite = DocumentRenderer(DrawDocument(diff.old_path)).render(parallel=True)
+        super().__init__(DrawDocument(diff.new_path))
+
+    def update_title_bar_text(self):
+        self.setWindowTitle('{} vs {} ({:.2f}x)'.format(
+            self.document.name, self.diff.old_file.name, self.canvas_scale()*self.devicePixelRatioF()
+        ))
+
+    def render_document(self, dirty_rect=QtCore.QRect()):
+        self.document.wake()
+        new_composite = self.renderer.render(parallel=True)
+        if self.side_by_side:
+            self.composite = pyxel_diff.side_by_side_image(self.old_composite, new_composite, self.diff.size, self.boxes)
+        else:
+            self.composite = pyxel_diff.highlight_image(new_composite, self.diff.mask(), self.boxes)
+
+        if self.composite.size() != self.canvas_size:
+            self.canvas_size = self.composite.size()
+            self.update_canvas()
+        self._pixmap = QtGui.QPixmap.fromImage(self.composite)
+        self.mips.rebuild(self.composite)
+        self.composite_changed.emit(self, self.composite.rect())
+        self.canvas.setPixmap(self._pixmap)
+
+    def render_rect(self, rect):
+        self.render_document()
+
+    def toggle_side_by_side(self, checked=False):
+        self.side_by_side = not self.side_by_side
+        self.render_document()
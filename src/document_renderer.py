@@ -0,0 +1,315 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from pixel_array import image_array
+
+
+class LayerStackCache:
+    """Composites of layer runs and groups, kept across renders.
+
+    Entries are keyed by the layers they contain, their versions and the band
+    of the canvas they cover. Runs are cut at fixed positions in the layer
+    stack, so toggling one layer only rebuilds the run and the groups it sits in
+    while everything else is reused.
+    """
+    RUN_LENGTH = 8
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, rect, image):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (rect, image)
+            self._nbytes += image.sizeInBytes()
+            while self._nbytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._nbytes -= evicted.sizeInBytes()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+
+class DocumentRenderer:
+    """Composites a document's visible layers.
+
+    The canvas is cut into horizontal bands of BAND_HEIGHT rows. Every band is
+    composited on its own, so bands can be blended concurrently and come out
+    byte-identical to blending them one after the other.
+    """
+    BAND_HEIGHT = 128
+
+    def __init__(self, document, cache=None):
+        self.document = document
+        self.cache = cache
+        self._visible = set()
+
+    @staticmethod
+    def composition_key(document):
+        """Everything besides pixels that affects the composite"""
+        renderer = DocumentRenderer(document)
+        renderer._visible = set(map(id, document.visible_layers()))
+        return (document.size.width(), document.size.height()) + tuple(
+            renderer.node_key(node, pixels=False)
+            for node in renderer.visible_nodes(document.layer_tree())
+        )
+
+    def visible_nodes(self, nodes):
+        for node in nodes:
+            if isinstance(node, tuple):
+                if not node[0].hidden:
+                    yield node
+            elif id(node) in self._visible:
+                yield node
+
+    def node_key(self, node, pixels=True):
+        if isinstance(node, tuple):
+            group, children = node
+            return (id(group), group.blend_mode, group.alpha) + tuple(
+                self.node_key(child, pixels) for child in self.visible_nodes(children)
+            )
+        key = (id(node), node.blend_mode, node.alpha)
+        return key + (node.version,) if pixels else key
+
+    def node_bounds(self, node):
+        if not isinstance(node, tuple):
+            return node.content_rect()
+        bounds = QtCore.QRect()
+        for child in self.visible_nodes(node[1]):
+            bounds = bounds.united(self.node_bounds(child))
+        return bounds
+
+    def node_runs(self, nodes):
+        """Visible nodes bottom to top, normal blended neighbouring layers grouped into runs"""
+        runs = []
+        run_start = None
+        for position, node in enumerate(reversed(nodes)):
+            if isinstance(node, tuple) or id(node) not in self._visible:
+                if isinstance(node, tuple) and not node[0].hidden:
+                    runs.append(node)
+                    run_start = None
+                continue
+            start = position - position % LayerStackCache.RUN_LENGTH
+            if self.is_normal(node) and runs and run_start == start:
+                runs[-1].append(node)
+            else:
+                runs.append([node])
+                run_start = start if self.is_normal(node) else None
+        return runs
+
+    def render(self, rect=None, parallel=False):
+        """Composite the visible layers, optionally only the part inside `rect`"""
+        canvas_rect = QtCore.QRect(QtCore.QPoint(0, 0), self.document.size)
+        rect = canvas_rect if rect is None else rect
+        layers = self.document.visible_layers()
+        tree = self.document.layer_tree()
+
+        bands = self.bands(rect)
+        if not parallel or len(bands) < 2:
+            return self.composite(tree, rect, layers)
+
+        self._visible = set(map(id, layers))
+        image = QtGui.QImage(rect.size(), QtGui.QImage.Format_ARGB32_Premultiplied)
+        with ThreadPoolExecutor() as executor:
+            band_images = list(executor.map(lambda band: self.render_band(tree, rect, band), bands))
+        pixels = image_array(image)
+        for band, band_image in zip(bands, band_images):
+            area = rect.intersected(band)
+            top = area.top() - rect.top()
+            pixels[top:top + area.height()] = image_array(band_image)
+        return image
+
+    def composite(self, nodes, rect, layers):
+        """Flatten `nodes` over transparency inside `rect`, showing only the layers in `layers`"""
+        image = QtGui.QImage(rect.size(), QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(QtGui.QColor('transparent'))
+        self._visible = set(map(id, layers))
+
+        painter = QtGui.QPainter(image)
+        for band in self.bands(rect):
+            area = rect.intersected(band)
+            self.draw_nodes(nodes, area, painter, band, area.topLeft() - rect.topLeft())
+        painter.end()
+        return image
+
+    def bands(self, rect):
+        first = rect.top() // self.BAND_HEIGHT
+        last = rect.bottom() // self.BAND_HEIGHT
+        width = max(self.document.size.width(), rect.right() + 1)
+        return [
+            QtCore.QRect(0, index * self.BAND_HEIGHT, width, self.BAND_HEIGHT)
+            for index in range(first, last + 1)
+        ]
+
+    def render_band(self, tree, rect, band):
+        area = rect.intersected(band)
+        image = QtGui.QImage(area.size(), QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(QtGui.QColor('transparent'))
+        painter = QtGui.QPainter(image)
+        self.draw_nodes(tree, area, painter, band)
+        painter.end()
+        return image
+
+    def draw_nodes(self, nodes, rect, painter, band, offset=QtCore.QPoint(0, 0)):
+        """Draw `nodes` inside `rect` of the canvas, at `offset` on the painter"""
+        painter.save()
+        painter.translate(offset)
+        for run in self.node_runs(nodes):
+            if isinstance(run, tuple):
+                self.draw_group(run, rect, painter, band)
+            elif len(run) == 1:
+                self.draw_layer(run[0], rect, painter)
+            else:
+                self.draw_run(run, rect, painter, band)
+        painter.restore()
+
+    def draw_layer(self, layer, rect, painter):
+        # transparent pixels leave the destination alone in every blend mode
+        source = rect.intersected(layer.content_rect())
+        if source.isEmpty():
+            return
+        self.set_blend_mode(layer, painter)
+        self.set_opacity(layer, painter)
+        if layer.blend_mode == 'invert':
+            painter.drawImage(source.topLeft() - rect.topLeft(), self.inverting_image(layer.to_image(source)))
+        else:
+            layer.tiles.draw(painter, source.topLeft() - rect.topLeft(), source)
+
+    def draw_run(self, layers, rect, painter, band):
+        """Composite a run of normal layers on its own, then draw it over what is below"""
+        key = ('run',) + tuple(self.node_key(layer) for layer in layers)
+        bounds = QtCore.QRect()
+        for layer in layers:
+            bounds = bounds.united(layer.content_rect())
+
+        def draw(target, area):
+            for layer in layers:
+                self.draw_layer(layer, area, target)
+
+        entry = self.isolated(key, bounds, rect, band, draw)
+        if entry is None:
+            return
+        painter.setCompositionMode(QtGui.QPainter.CompositionMode_SourceOver)
+        painter.setOpacity(1)
+        self.draw_entry(entry, rect, painter)
+
+    def draw_group(self, node, rect, painter, band):
+        """Flatten a group's children, then blend the result with the group's mode and opacity"""
+        group, children = node
+
+        def draw(target, area):
+            self.draw_nodes(children, area, target, band)
+
+        entry = self.isolated(('group',) + self.node_key(node), self.node_bounds(node), rect, band, draw)
+        if entry is None:
+            return
+        self.set_blend_mode(group, painter)
+        self.set_opacity(group, painter)
+        if group.blend_mode == 'invert':
+            entry = (entry[0], self.inverting_image(entry[1]))
+        self.draw_entry(entry, rect, painter)
+
+    def isolated(self, key, bounds, rect, band, draw):
+        """Cached or freshly drawn (rect, image) for content composited over transparency.
+
+        Entries cover the content inside one band; they are stored whenever the
+        area being drawn covers all of that.
+        """
+        key = (band.top(), band.height()) + key
+        entry = self.cache.get(key) if self.cache is not None else None
+        if entry is not None:
+            return entry
+
+        bounds = bounds.intersected(band)
+        cacheable = self.cache is not None and rect.contains(bounds)
+        if not cacheable:
+            bounds = bounds.intersected(rect)
+        if bounds.isEmpty():
+            return None
+        image = QtGui.QImage(bounds.size(), QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(QtGui.QColor('transparent'))
+        painter = QtGui.QPainter(image)
+        draw(painter, bounds)
+        painter.end()
+        if cacheable:
+            self.cache.put(key, bounds, image)
+        return bounds, image
+
+    @staticmethod
+    def inverting_image(image):
+        """White with the alpha of `image`; drawn in difference mode it inverts what is below"""
+        image = image.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+        painter = QtGui.QPainter(image)
+        painter.setCompositionMode(QtGui.QPainter.CompositionMode_SourceIn)
+        painter.fillRect(image.rect(), QtGui.QColor('white'))
+        painter.end()
+        return image
+
+    @staticmethod
+    def draw_entry(entry, rect, painter):
+        bounds, image = entry
+        source = rect.intersected(bounds)
+        if not source.isEmpty():
+            painter.drawImage(source.topLeft() - rect.topLeft(), image, source.translated(-bounds.topLeft()))
+
+    @staticmethod
+    def is_normal(layer):
+        return not layer.blend_mode or layer.blend_mode == 'normal'
+
+    def set_opacity(self, layer, painter):
+        painter.setOpacity(layer.alpha/255)
+
+    def set_blend_mode(self, layer, painter):
+        if self.is_normal(layer):
+            painter.setCompositionMode(QtGui.QPainter.CompositionMode_SourceOver)
+        else:
+            painter.setCompositionMode(self.composition_mode_for_name(layer.blend_mode))
+
+    def composition_mode_for_name(self, name):
+        if name == 'darken':
+            return QtGui.QPainter.CompositionMode_Darken
+        if name == 'lighten':
+            return QtGui.QPainter.CompositionMode_Lighten
+        if name == 'add':
+            return QtGui.QPainter.CompositionMode_Plus
+        if name == 'difference':
+            return QtGui.QPainter.CompositionMode_Difference
+        if name == 'multiply':
+            return QtGui.QPainter.CompositionMode_Multiply
+        if name == 'screen':
+            return QtGui.QPainter.CompositionMode_Screen
+        if name == 'invert':
+            return QtGui.QPainter.CompositionMode_Difference
+        if name == 'overlay':
+            return QtGui.QPainter.CompositionMode_Overlay
+        if name == 'hardlight':
+            return QtGui.QPainter.CompositionMode_HardLight
+        if name == 'softlight':
+            return QtGui.QPainter.CompositionMode_SoftLight
+        if name == 'dodge':
+            return QtGui.QPainter.CompositionMode_ColorDodge
+        if name == 'burn':
+            return QtGui.QPainter.CompositionMode_ColorBurn
+
+        raise Exception('Unsupported composition mode \'%s\'' % name)
@@ -1,6 +1,19 @@
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from zipfile import BadZipFile
+
+import numpy as np
+
 from PySide6 import QtCore
 from PySide6 import QtGui
 from draw_file import DrawFile
+from document_renderer import DocumentRenderer
+from pixel_array import image_array
+from tiled_image import TiledImage
+from color_usage import ColorUsageIndex
+import palette_ops
 
 # from dataclasses import dataclass
 
@@ -8,35 +21,231 @@ from draw_file import DrawFile
 # @dataclass
 class DrawLayer(QtCore.QObject):
     updated = QtCore.Signal((QtCore.QObject,))
+    pixels_changed = QtCore.Signal(QtCore.QObject, QtCore.QRect)
+
+    # versions are never reused, not even by another layer, so caches can key on them
+    _versions = itertools.count()
 
-    def __init__(self, size=QtCore.QSize(128, 128)):
+    def __init__(self, size=QtCore.QSize(128, 128), tile_size=TiledImage.TILE_SIZE):
         super().__init__()
         self.name = ""
         self.size = size
-        self.image = QtGui.QImage(self.size, QtGui.QImage.Format_ARGB32)
-        self.image.size = self.size
-        self.image.fill(QtCore.Qt.transparent)
+        self.tiles = TiledImage(self.size, tile_size)
+        self.hidden = False
+        self.soloed = False
+        self.muted = False
+        self.blend_mode = "normal"
+        self.alpha = 255
+        self.group = None
+        self.version = next(self._versions)
+        self._content_rect = QtCore.QRect()
+        self._thumbnail = None
+        self._thumbnail_key = None
+
+        self.pixels_changed.connect(self._on_pixels_changed)
+
+    def rect(self):
+        return self.tiles.rect()
+
+    def groups(self):
+        """Enclosing groups, outermost first"""
+        groups = []
+        group = self.group
+        while group is not None:
+            groups.insert(0, group)
+            group = group.group
+        return groups
+
+    def read_pixels(self, rect=None):
+        """Copy of the pixels inside `rect` as a (height, width) uint32 ARGB array"""
+        return self.tiles.read(rect)
+
+    def write_pixels(self, pixels, point=QtCore.QPoint(0, 0)):
+        """Overwrite pixels without notifying, follow up with mark_dirty"""
+        self.tiles.write(pixels, point)
+
+    def to_image(self, rect=None):
+        return self.tiles.to_image(rect)
+
+    def load_image(self, image):
+        self.tiles.load_image(image)
+        self._content_rect = None
+        self.version = next(self._versions)
+
+    def load_tiles(self, tiles):
+        """Take over already decoded {key: QImage} tiles, e.g. from a LayerCache"""
+        self.tiles.tiles = tiles
+        self._content_rect = None
+        self.version = next(self._versions)
+
+    def content_rect(self):
+        """Bounding rect of the layer's non-transparent pixels"""
+        if self._content_rect is None:
+            self._content_rect = self.tiles.content_rect()
+        return self._content_rect
+
+    def set_canvas_rect(self, rect):
+        """Crop or extend the layer to `rect`, given in current layer coordinates"""
+        self.replace_tiles(self.tiles.cropped(rect))
+
+    def replace_tiles(self, tiles):
+        """Swap in a whole new TiledImage, which may have a different size"""
+        self.tiles = tiles
+        self.size = tiles.size
+        self._content_rect = None
+        self.version = next(self._versions)
+
+    def thumbnail(self, size):
+        key = (size.width(), size.height(), self.version)
+        if key != self._thumbnail_key:
+            self._thumbnail = self.tiles.thumbnail(size, self.content_rect())
+            self._thumbnail_key = key
+        return self._thumbnail
+
+    def propagate_changes(self):
+        self.updated.emit(self)
+
+    def mark_dirty(self, rect=None):
+        """Report that the pixels inside `rect` (default: the whole layer) were edited"""
+        rect = self.rect() if rect is None else rect.intersected(self.rect())
+        self.pixels_changed.emit(self, rect)
+
+    def _on_pixels_changed(self, layer, rect):
+        self.version = next(self._versions)
+
+        if self._content_rect is None:
+            return
+        if not self._content_rect.intersects(rect):
+            self._content_rect = self._content_rect.united(self.tiles.content_rect(rect))
+        elif not self._content_rect.adjusted(1, 1, -1, -1).contains(rect):
+            # an edit on the edge of the content may have shrunk it
+            self._content_rect = None
+
+
+class LayerGroup(QtCore.QObject):
+    """Folder of consecutive layers, blended onto the layers below as one image"""
+    updated = QtCore.Signal((QtCore.QObject,))
+
+    def __init__(self, name=""):
+        super().__init__()
+        self.name = name
         self.hidden = False
+        self.collapsed = False
         self.blend_mode = "normal"
         self.alpha = 255
+        self.group = None
 
     def propagate_changes(self):
         self.updated.emit(self)
 
 
+class Animation:
+    def __init__(self, name='', base_tile=0, length=1, frame_duration=100, frame_duration_multipliers=None):
+        self.name = name
+        self.base_tile = base_tile
+        self.length = length
+        self.frame_duration = frame_duration
+        self.frame_duration_multipliers = frame_duration_multipliers or [100] * length
+
+    @staticmethod
+    def from_data(data):
+        return Animation(
+            name=data.get('name', ''),
+            base_tile=data.get('baseTile', 0),
+            length=data.get('length', 1),
+            frame_duration=data.get('frameDuration', 100),
+            frame_duration_multipliers=data.get('frameDurationMultipliers'),
+        )
+
+    def frame_tile(self, frame):
+        return self.base_tile + frame
+
+    def frame_duration_ms(self, frame):
+        return self.frame_duration * self.frame_duration_multipliers[frame] / 100
+
+
+class ChangeSet:
+    """Everything that changed in a document between two notifications"""
+
+    def __init__(self):
+        self.pixels = {}
+        self.metadata = set()
+        self.structure = False
+        self.palette = False
+        self.canvas = False
+
+    def add_pixels(self, layer, rect):
+        self.pixels[layer] = self.pixels.get(layer, QtCore.QRect()).united(rect)
+
+    def layers(self):
+        """Layers whose pixels or properties changed"""
+        return set(self.pixels) | {item for item in self.metadata if isinstance(item, DrawLayer)}
+
+    def rect(self):
+        """Canvas area covered by pixel changes"""
+        rect = QtCore.QRect()
+        for layer_rect in self.pixels.values():
+            rect = rect.united(layer_rect)
+        return rect
+
+    def pixels_only(self):
+        return not (self.metadata or self.structure or self.palette or self.canvas)
+
+
 class DrawDocument(QtCore.QObject):
+    """Layered image document.
+
+    Edits are collected into a ChangeSet and announced once through `changed`
+    and `document_changed`, either when the outermost `transaction()` block ends
+    or, outside of one, on the next turn of the event loop. `pixels_changed`
+    still fires right away for listeners that track individual rects.
+    """
+    changed = QtCore.Signal(QtCore.QObject, object)
     document_changed = QtCore.Signal((QtCore.QObject,))
     layer_order_changed = QtCore.Signal((QtCore.QObject,))
+    pixels_changed = QtCore.Signal(QtCore.QObject, QtCore.QRect)
+    canvas_changed = QtCore.Signal(QtCore.QObject, QtCore.QRect)
+    reloaded = QtCore.Signal((QtCore.QObject,))
+    reload_failed = QtCore.Signal(QtCore.QObject, str)
+
+    # a file that still cannot be read after this many tries, 250ms apart, is left alone
+    RELOAD_ATTEMPTS = 10
+    # per channel, merging rounds premultiplied pixels once more than compositing does
+    MERGE_TOLERANCE = 2
 
-    def __init__(self, file_path=None, size=QtCore.QSize(32, 32)):
+    ANCHORS = {
+        'top_left': (0, 0), 'top': (1, 0), 'top_right': (2, 0),
+        'left': (0, 1), 'center': (1, 1), 'right': (2, 1),
+        'bottom_left': (0, 2), 'bottom': (1, 2), 'bottom_right': (2, 2),
+    }
+
+    def __init__(self, file_path=None, size=QtCore.QSize(32, 32), storage_tile_size=TiledImage.TILE_SIZE,
+                 layer_cache=None):
         super().__init__()
 
         self.file_path = file_path
         self.size = size
+        self.storage_tile_size = storage_tile_size
         self.layers = []
         self.name = None
         self.palette = []
         self.palette_width = 12
+        self.tile_size = QtCore.QSize(size)
+        self.animations = []
+        self.color_usage = ColorUsageIndex(self)
+        self._visible_layers = None
+        self._layer_tree = None
+        self._pending_changes = None
+        self._transaction_depth = 0
+        self._flush_scheduled = False
+        self.layer_cache = layer_cache
+        self._source_crcs = {}
+        self._file_layers = []
+        self._watcher = None
+        self._reload_timer = None
+        self._reload_attempts = 0
+        self.undo_stack = QtGui.QUndoStack(self)
+        self._hibernated = None
 
         if file_path:
             self.load_file(self.file_path)
@@ -49,22 +258,554 @@ class DrawDocument(QtCore.QObject):
         self.size = canvas_size
         self.palette = draw_file.palette
         self.palette_width = draw_file.palette_width
+        self.tile_size = QtCore.QSize(draw_file.tile_width, draw_file.tile_height)
+        self.animations = [Animation.from_data(data) for data in draw_file.animations]
 
         self.layers.clear()
 
+        cached_tiles = self.layer_cache.load(draw_file, self.storage_tile_size) if self.layer_cache else None
+
         for i in range(draw_file.layer_count):
             info = draw_file.get_layer_data(i)
             print(info)
-            with draw_file.get_layer_image_stream(i) as stream:
-                buffer = QtCore.QByteArray(stream.read())
-                layer = DrawLayer(canvas_size)
-                layer.image.loadFromData(buffer)
-                layer.hidden = info["hidden"]
-                layer.blend_mode = info["blendMode"]
-                layer.alpha = info["alpha"]
-                layer.name = info["name"]
-                self.layers.append(layer)
-                layer.updated.connect(self.layer_updated)
+            layer = self.create_layer()
+            if cached_tiles:
+                layer.load_tiles(cached_tiles[i])
+            else:
+                with draw_file.get_layer_image_stream(i) as stream:
+                    layer.load_image(QtGui.QImage.fromData(QtCore.QByteArray(stream.read())))
+            layer.hidden = info["hidden"]
+            layer.soloed = info.get("soloed", False)
+            layer.muted = info.get("muted", False)
+            layer.blend_mode = info["blendMode"]
+            layer.alpha = info["alpha"]
+            layer.name = info["name"]
+            self.add_layer(layer)
+
+        self._source_crcs = draw_file.crcs()
+        self._file_layers = list(self.layers)
+        if cached_tiles is None:
+            self._store_layer_cache(draw_file)
+
+        self.color_usage.rebuild()
+        self.note_changes(structure=True, palette=True, canvas=True)
+
+    def _store_layer_cache(self, draw_file):
+        if self.layer_cache:
+            try:
+                self.layer_cache.store(draw_file, self.storage_tile_size, [layer.tiles for layer in self._file_layers])
+            except OSError as error:
+                print('could not cache layers of {}: {}'.format(draw_file.file_path, error))
+
+    def watch(self):
+        """Pick up changes other programs make to the file, see reload_changes"""
+        if self._watcher is None and self.file_path:
+            self._watcher = QtCore.QFileSystemWatcher([self.file_path], self)
+            self._watcher.fileChanged.connect(self._on_file_changed)
+            # writers touch the file several times, wait until they are done
+            self._reload_timer = QtCore.QTimer(self)
+            self._reload_timer.setSingleShot(True)
+            self._reload_timer.setInterval(250)
+            self._reload_timer.timeout.connect(self._reload_watched_file)
+
+    def _on_file_changed(self, path):
+        self._reload_attempts = 0
+        self._reload_timer.start()
+
+    def _reload_watched_file(self):
+        if not os.path.isfile(self.file_path):
+            return
+        # saving by renaming a new file over the old one drops it from the watcher
+        if self.file_path not in self._watcher.files():
+            self._watcher.addPath(self.file_path)
+        try:
+            self.reload_changes()
+        except (OSError, BadZipFile, KeyError, ValueError) as error:
+            self._reload_attempts += 1
+            if self._reload_attempts < self.RELOAD_ATTEMPTS:
+                self._reload_timer.start()
+            else:
+                self._reload_attempts = 0
+                self.reload_failed.emit(self, str(error))
+        else:
+            self._reload_attempts = 0
+
+    def reload_changes(self):
+        """Bring the document up to date with its file, decoding only the entries that changed.
+
+        Zip entry CRCs are compared with the ones seen at the last load. Changed
+        layer PNGs are decoded and their layers marked dirty where the pixels differ,
+        a changed docData.json updates palette, animations and layer properties.
+        When the canvas size or the layers themselves changed, the file is loaded again
+        from scratch. Returns the names of the changed entries.
+        """
+        self.wake()
+        draw_file = DrawFile.from_path(self.file_path)
+        crcs = draw_file.crcs()
+        changed = sorted(name for name, crc in crcs.items() if self._source_crcs.get(name) != crc)
+        if not changed:
+            return changed
+
+        size = QtCore.QSize(draw_file.width, draw_file.height)
+        if size != self.size or draw_file.layer_count != len(self._file_layers) \
+                or any(layer not in self.layers for layer in self._file_layers):
+            self.load_file(self.file_path)
+            self.reloaded.emit(self)
+            return changed
+
+        with self.transaction():
+            if 'docData.json' in changed:
+                self.name = draw_file.name
+                self.tile_size = QtCore.QSize(draw_file.tile_width, draw_file.tile_height)
+                self.animations = [Animation.from_data(data) for data in draw_file.animations]
+                if draw_file.palette != self.palette or draw_file.palette_width != self.palette_width:
+                    self.palette = draw_file.palette
+                    self.palette_width = draw_file.palette_width
+                    self.note_changes(palette=True)
+                for index, layer in enumerate(self._file_layers):
+                    info = draw_file.get_layer_data(index)
+                    state = (info["name"], info["hidden"], info.get("soloed", False), info.get("muted", False),
+                             info["blendMode"], info["alpha"])
+                    if state != (layer.name, layer.hidden, layer.soloed, layer.muted, layer.blend_mode, layer.alpha):
+                        layer.name, layer.hidden, layer.soloed, layer.muted, layer.blend_mode, layer.alpha = state
+                        self.note_changes(metadata=(layer,))
+
+            for index, layer in enumerate(self._file_layers):
+                if 'layer{}.png'.format(index) not in changed:
+                    continue
+                with draw_file.get_layer_image_stream(index) as stream:
+                    image = QtGui.QImage.fromData(QtCore.QByteArray(stream.read()))
+                before = layer.read_pixels()
+                layer.load_image(image)
+                differs = layer.read_pixels() != before
+                rows = np.flatnonzero(differs.any(axis=1))
+                if len(rows):
+                    columns = np.flatnonzero(differs.any(axis=0))
+                    layer.mark_dirty(QtCore.QRect(
+                        int(columns[0]), int(rows[0]), int(columns[-1] - columns[0]) + 1, int(rows[-1] - rows[0]) + 1
+                    ))
+
+        self._source_crcs = crcs
+        self._store_layer_cache(draw_file)
+        self.reloaded.emit(self)
+        return changed
+
+    @property
+    def hibernated(self):
+        return self._hibernated is not None
+
+    def hibernate(self):
+        """Compress the tiles of every layer until wake() is called.
+
+        Meant for documents nobody looks at; the pixels are the same as far as
+        anyone is concerned, so nothing is announced and layer versions stay.
+        """
+        if self._hibernated is None:
+            with ThreadPoolExecutor() as executor:
+                compressed = list(executor.map(lambda layer: layer.tiles.compressed_tiles(), self.layers))
+            self._hibernated = dict(zip(self.layers, compressed))
+            for layer in self.layers:
+                layer.tiles.tiles = {}
+
+    def wake(self):
+        """Decode the tiles compressed by hibernate()"""
+        if self._hibernated is not None:
+            hibernated, self._hibernated = self._hibernated, None
+            with ThreadPoolExecutor() as executor:
+                list(executor.map(lambda item: item[0].tiles.load_compressed_tiles(item[1]), hibernated.items()))
+
+    def nbytes(self):
+        """Bytes of decoded layer tiles"""
+        return sum(layer.tiles.nbytes for layer in self.layers)
+
+    def compressed_nbytes(self):
+        if self._hibernated is None:
+            return 0
+        return sum(len(data) for tiles in self._hibernated.values() for width, height, data in tiles.values())
+
+    def visible_layers(self):
+        """Layers that make it into the composite, top to bottom.
+
+        Muted and hidden layers never show; once any layer is soloed only the
+        soloed ones do. The result is cached until the document changes.
+        """
+        if self._visible_layers is None:
+            soloing = any(layer.soloed for layer in self.layers)
+            self._visible_layers = [
+                layer for layer in self.layers
+                if not layer.hidden and not layer.muted and (layer.soloed or not soloing)
+                and not any(group.hidden for group in layer.groups())
+            ]
+        return self._visible_layers
+
+    def layer_tree(self):
+        """Layers nested in their groups, top to bottom.
+
+        Each node is either a DrawLayer or a (LayerGroup, children) pair.
+        """
+        if self._layer_tree is None:
+            root = []
+            open_groups = []
+            for layer in self.layers:
+                groups = layer.groups()
+                depth = 0
+                while depth < min(len(groups), len(open_groups)) and open_groups[depth][0] is groups[depth]:
+                    depth += 1
+                del open_groups[depth:]
+                for group in groups[depth:]:
+                    node = (group, [])
+                    (open_groups[-1][1] if open_groups else root).append(node)
+                    open_groups.append(node)
+                (open_groups[-1][1] if open_groups else root).append(layer)
+            self._layer_tree = root
+        return self._layer_tree
+
+    def invalidate_visibility(self):
+        self._visible_layers = None
+        self._layer_tree = None
+
+    @contextmanager
+    def transaction(self):
+        """Announce every change made inside the block as a single notification"""
+        self._transaction_depth += 1
+        try:
+            yield self
+        finally:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.flush_changes()
+
+    def note_changes(self, metadata=(), structure=False, palette=False, canvas=False):
+        """Record a change for the next notification"""
+        changes = self._pending()
+        changes.metadata.update(metadata)
+        changes.structure |= structure
+        changes.palette |= palette
+        changes.canvas |= canvas
+        if metadata or structure or canvas:
+            self.invalidate_visibility()
+        self._schedule_flush()
+
+    def flush_changes(self):
+        """Emit the pending change notification now"""
+        self._flush_scheduled = False
+        changes, self._pending_changes = self._pending_changes, None
+        if changes is None:
+            return
+        self.changed.emit(self, changes)
+        self.document_changed.emit(self)
+
+    def _pending(self):
+        if self._pending_changes is None:
+            self._pending_changes = ChangeSet()
+        return self._pending_changes
+
+    def _schedule_flush(self):
+        if self._transaction_depth or self._flush_scheduled:
+            return
+        application = QtCore.QCoreApplication.instance()
+        if application is None or QtCore.QThread.currentThread() is not application.thread():
+            self.flush_changes()
+        else:
+            self._flush_scheduled = True
+            QtCore.QTimer.singleShot(0, self.flush_changes)
+
+    def _on_layer_pixels_changed(self, layer, rect):
+        self._pending().add_pixels(layer, rect)
+        self.pixels_changed.emit(layer, rect)
+        self._schedule_flush()
+
+    def group_layers(self, layers, name="Group"):
+        """Put `layers` in a new group placed where the topmost of them is"""
+        layers = sorted(layers, key=self.layers.index)
+        if not layers:
+            return None
+
+        group = LayerGroup(name)
+        group.group = layers[0].group
+        group.updated.connect(self.layer_updated)
+        index = self.layers.index(layers[0])
+        for layer in layers:
+            self.layers.remove(layer)
+        for offset, layer in enumerate(layers):
+            self.layers.insert(index + offset, layer)
+            layer.group = group
+
+        self.layer_order_changed.emit(self)
+        self.note_changes(structure=True)
+        return group
+
+    def ungroup(self, group):
+        """Move the contents of `group` up into its parent"""
+        for layer in self.layers:
+            if layer.group is group:
+                layer.group = group.group
+            for parent in layer.groups():
+                if parent.group is group:
+                    parent.group = group.group
+        group.updated.disconnect(self.layer_updated)
+
+        self.layer_order_changed.emit(self)
+        self.note_changes(structure=True)
+
+    def merge_down(self, layer):
+        """Blend `layer` into the pixels of the layer below it in the same group.
+
+        The layer below keeps its blend mode. A normal layer below gets its alpha
+        baked into its pixels and ends up opaque; any other mode keeps its alpha
+        too. A hidden or muted `layer` contributes nothing. When the layer below
+        cannot reproduce the composite, e.g. a normal layer over a multiply
+        layer, this raises and leaves the document alone.
+        """
+        index = self.layers.index(layer)
+        below = self.layers[index + 1] if index + 1 < len(self.layers) else None
+        if below is None or below.group is not layer.group:
+            raise Exception('no layer below {} to merge into'.format(layer.name))
+
+        visible = self.visible_layers()
+        bounds = layer.content_rect() if layer in visible else QtCore.QRect()
+        tiles = None
+        alpha = below.alpha
+        if not bounds.isEmpty():
+            renderer = DocumentRenderer(self)
+            raw = self.create_layer()
+            raw.replace_tiles(below.tiles)
+            if below.blend_mode == 'normal' and below.alpha != 255:
+                raw.alpha, alpha = below.alpha, 255
+                bounds = bounds.united(below.content_rect())
+            merged = renderer.composite([layer, raw], bounds, [layer, raw])
+
+            candidate = self.create_layer()
+            candidate.replace_tiles(below.tiles.copy())
+            candidate.write_pixels(image_array(merged.convertToFormat(TiledImage.FORMAT)), bounds.topLeft())
+            candidate.replace_tiles(candidate.tiles)
+            candidate.blend_mode, candidate.alpha, candidate.group = below.blend_mode, alpha, below.group
+            candidate.hidden, candidate.muted, candidate.soloed = below.hidden, below.muted, below.soloed
+
+            def replaced(nodes):
+                return [
+                    (node[0], replaced(node[1])) if isinstance(node, tuple) else candidate if node is below else node
+                    for node in nodes if node is not layer
+                ]
+
+            before = image_array(renderer.composite(self.layer_tree(), bounds, visible))
+            after = image_array(renderer.composite(
+                replaced(self.layer_tree()), bounds,
+                [candidate if node is below else node for node in visible if node is not layer],
+            ))
+            difference = np.abs(before.view(np.uint8).astype(np.int16) - after.view(np.uint8).astype(np.int16))
+            if difference.size and difference.max() > self.MERGE_TOLERANCE:
+                raise Exception('merging {} into {} would change the image, {} blending at alpha {} '
+                                'cannot hold the result'.format(layer.name, below.name, below.blend_mode, below.alpha))
+            tiles = candidate.tiles
+
+        with self.transaction():
+            self.remove_layer(layer)
+            layer.load_tiles({})
+            self.layer_order_changed.emit(self)
+            if tiles is not None:
+                below.alpha = alpha
+                below.replace_tiles(tiles)
+                below.mark_dirty(bounds)
+            self.note_changes(metadata=(below,), structure=True)
+
+    def merge_visible(self):
+        """Replace the visible layers with one ungrouped layer holding their composite"""
+        layers = self.visible_layers()
+        if len(layers) > 1:
+            self._merge(self.layer_tree(), layers, layers[-1])
+
+    def flatten(self):
+        """Reduce the document to a single layer holding its composite"""
+        layers = self.visible_layers()
+        target = layers[-1] if layers else self.layers[-1] if self.layers else None
+        if target is not None:
+            self._merge(self.layer_tree(), layers, target, discard=self.layers)
+
+    def _merge(self, nodes, layers, target, discard=None):
+        """Composite `layers` as drawn by `nodes` into `target`, then remove the `discard`ed layers.
+
+        Only the union of the merged layers' content is composited, and the removed
+        layers' tiles are released right away.
+        """
+        bounds = QtCore.QRect()
+        for layer in layers:
+            bounds = bounds.united(layer.content_rect())
+        dirty = bounds.united(target.content_rect())
+        merged = DocumentRenderer(self).composite(nodes, bounds, layers) if not bounds.isEmpty() else None
+
+        with self.transaction():
+            removed = [layer for layer in (layers if discard is None else discard) if layer is not target]
+            for layer in removed:
+                self.remove_layer(layer)
+                layer.load_tiles({})
+            groups = target.groups()
+            if groups:
+                # the groups are baked into the pixels; leave them below the group so it stays in one piece
+                members = [index for index, layer in enumerate(self.layers) if groups[0] in layer.groups()]
+                self.layers.remove(target)
+                self.layers.insert(members[-1], target)
+            target.group = None
+            target.blend_mode = 'normal'
+            target.alpha = 255
+            target.hidden = target.muted = target.soloed = False
+            self.invalidate_visibility()
+            self.layer_order_changed.emit(self)
+
+            target.load_tiles({})
+            if merged is not None:
+                target.write_pixels(
+                    image_array(merged.convertToFormat(TiledImage.FORMAT)), bounds.topLeft()
+                )
+            target.mark_dirty(dirty)
+            self.note_changes(metadata=(target,), structure=True)
+
+    def tile_rect(self, tile):
+        """Canvas rect of a tile, counting tiles left to right, top to bottom"""
+        columns = max(self.size.width() // self.tile_size.width(), 1)
+        return QtCore.QRect(
+            (tile % columns) * self.tile_size.width(),
+            (tile // columns) * self.tile_size.height(),
+            self.tile_size.width(),
+            self.tile_size.height(),
+        )
+
+    def content_rect(self):
+        """Bounding rect of the non-transparent pixels of all layers"""
+        bounds = QtCore.QRect()
+        for layer in self.layers:
+            bounds = bounds.united(layer.content_rect())
+        return bounds
+
+    def resize_canvas(self, rect):
+        """Crop or extend the canvas to `rect`, given in current canvas coordinates"""
+        if rect.isEmpty() or rect == QtCore.QRect(QtCore.QPoint(0, 0), self.size):
+            return
+
+        with ThreadPoolExecutor() as executor:
+            cropped = list(executor.map(lambda layer: layer.tiles.cropped(rect), self.layers))
+        for layer, tiles in zip(self.layers, cropped):
+            layer.replace_tiles(tiles)
+        self.size = rect.size()
+
+        self.canvas_changed.emit(self, rect)
+        self.note_changes(canvas=True)
+
+    def crop_to_content(self):
+        self.resize_canvas(self.content_rect())
+
+    def resize_canvas_anchored(self, size, anchor='center'):
+        """Crop or extend the canvas to `size`, keeping the `anchor` side or corner in place"""
+        column, row = self.ANCHORS[anchor]
+        x = (self.size.width() - size.width()) * column // 2
+        y = (self.size.height() - size.height()) * row // 2
+        self.resize_canvas(QtCore.QRect(x, y, size.width(), size.height()))
+
+    def flip(self, horizontal=True, layers=None):
+        """Mirror all or the given layers left to right, or top to bottom"""
+        width, height = self.size.width(), self.size.height()
+        columns, rows = self.tile_grid()
+
+        def transform(rect, pixels):
+            if horizontal:
+                return QtCore.QPoint(width - rect.right() - 1, rect.top()), pixels[:, ::-1]
+            return QtCore.QPoint(rect.left(), height - rect.bottom() - 1), pixels[::-1]
+
+        if horizontal:
+            tiled = (lambda key: (columns - 1 - key[0], key[1])), (lambda pixels: pixels[:, ::-1])
+        else:
+            tiled = (lambda key: (key[0], rows - 1 - key[1])), (lambda pixels: pixels[::-1])
+        self._transform_layers(transform, self.size, layers, tiled=tiled)
+
+    def rotate(self, quarter_turns, layers=None):
+        """Rotate clockwise by 90 degree steps.
+
+        Quarter turns of a non-square canvas swap its width and height, so they
+        have to include every layer.
+        """
+        quarter_turns %= 4
+        if quarter_turns == 0:
+            return
+        width, height = self.size.width(), self.size.height()
+        size = QtCore.QSize(height, width) if quarter_turns % 2 else QtCore.QSize(self.size)
+        if size != self.size and layers is not None and set(layers) != set(self.layers):
+            raise Exception('rotating a non-square canvas by 90 degrees has to include every layer')
+
+        columns, rows = self.tile_grid()
+
+        def transform(rect, pixels):
+            if quarter_turns == 1:
+                point = QtCore.QPoint(height - rect.bottom() - 1, rect.left())
+            elif quarter_turns == 2:
+                point = QtCore.QPoint(width - rect.right() - 1, height - rect.bottom() - 1)
+            else:
+                point = QtCore.QPoint(rect.top(), width - rect.right() - 1)
+            return point, np.rot90(pixels, -quarter_turns)
+
+        def tile_key(key):
+            if quarter_turns == 1:
+                return rows - 1 - key[1], key[0]
+            if quarter_turns == 2:
+                return columns - 1 - key[0], rows - 1 - key[1]
+            return key[1], columns - 1 - key[0]
+
+        self._transform_layers(transform, size, layers, tiled=(tile_key, lambda pixels: np.rot90(pixels, -quarter_turns)))
+
+    def shift(self, dx, dy, layers=None):
+        """Move pixels by (dx, dy), wrapping them around the canvas edges"""
+        if dx % self.size.width() == 0 and dy % self.size.height() == 0:
+            return
+
+        def transform(rect, pixels):
+            return rect.topLeft(), np.roll(pixels, (dy, dx), axis=(0, 1))
+
+        ts = self.storage_tile_size
+        columns, rows = self.tile_grid()
+        tiled = None
+        if dx % ts == 0 and dy % ts == 0:
+            tiled = (lambda key: ((key[0] + dx // ts) % columns, (key[1] + dy // ts) % rows)), (lambda pixels: pixels)
+        self._transform_layers(transform, self.size, layers, bounded=False, tiled=tiled)
+
+    def tile_grid(self):
+        """Columns and rows of storage tiles covering the canvas"""
+        ts = self.storage_tile_size
+        return -(-self.size.width() // ts), -(-self.size.height() // ts)
+
+    def _transform_layers(self, transform, size, layers=None, bounded=True, tiled=None):
+        """Replace layers with transform(rect, pixels) -> (point, pixels) of their content, in parallel.
+
+        With `bounded` only the layer's content rect is read, otherwise the whole layer.
+        When the canvas is made of whole storage tiles, `tiled`, a pair of functions
+        mapping tile keys and tile pixels, moves tiles instead of reading the layer.
+        Everything is announced as one change, a canvas change if `size` differs.
+        """
+        layers = self.layers if layers is None else layers
+        ts = self.storage_tile_size
+        whole_tiles = self.size.width() % ts == 0 and self.size.height() % ts == 0
+
+        def apply(layer):
+            if tiled and whole_tiles:
+                return layer.tiles.remapped(size, *tiled)
+            rect = layer.content_rect() if bounded else layer.rect()
+            tiles = TiledImage(size, layer.tiles.tile_size)
+            if not rect.isEmpty():
+                point, pixels = transform(rect, layer.read_pixels(rect))
+                tiles.write(pixels, point)
+            return tiles
+
+        with ThreadPoolExecutor() as executor:
+            transformed = list(executor.map(apply, layers))
+
+        with self.transaction():
+            for layer, tiles in zip(layers, transformed):
+                layer.replace_tiles(tiles)
+            if size != self.size:
+                self.size = QtCore.QSize(size)
+                self.tile_size = self.tile_size.transposed()
+                self.canvas_changed.emit(self, QtCore.QRect(QtCore.QPoint(0, 0), size))
+                self.note_changes(canvas=True)
+            for layer in layers:
+                layer.mark_dirty()
 
     def move_layer(self, layer, index):
         current_index = self.layers.index(layer)
@@ -72,13 +813,97 @@ class DrawDocument(QtCore.QObject):
             self.layers.pop(current_index)
             self.layers.insert(index, layer)
             self.layer_order_changed.emit(self)
+            self.note_changes(structure=True)
 
     def add_blank_layer(self):
         print(self.__class__.__name__ + ".add_blank_layer")
-        new_layer = DrawLayer(self.size)
-        self.layers.append(new_layer)
-        new_layer.updated.connect(self.layer_updated)
-        self.document_changed.emit(self)
+        new_layer = self.create_layer()
+        self.add_layer(new_layer)
+        self.note_changes(structure=True)
+
+    def create_layer(self):
+        return DrawLayer(self.size, self.storage_tile_size)
+
+    def add_layer(self, layer, index=None):
+        if index is None:
+            self.layers.append(layer)
+        else:
+            self.layers.insert(index, layer)
+        self.invalidate_visibility()
+        layer.updated.connect(self.layer_updated)
+        layer.pixels_changed.connect(self._on_layer_pixels_changed)
+
+    def remove_layer(self, layer):
+        """Take `layer` out of the document, without announcing it"""
+        self.layers.remove(layer)
+        self.invalidate_visibility()
+        layer.updated.disconnect(self.layer_updated)
+        layer.pixels_changed.disconnect(self._on_layer_pixels_changed)
 
     def layer_updated(self, layer):
-        self.document_changed.emit(self)
+        self.note_changes(metadata=(layer,))
+
+    def replace_colors(self, mapping, layers=None, parallel=False):
+        """Replace colors across layers and the palette, e.g. {'ff000000': 'ff1a1c2c'}.
+
+        Each layer is remapped in a single vectorized pass, and the document emits
+        one change notification when every layer is done.
+        """
+        with self.transaction():
+            if self._replace_colors(mapping, layers, parallel):
+                self.note_changes(palette=True)
+
+    def swap_colors(self, first, second, layers=None, parallel=False):
+        self.replace_colors({first: second, second: first}, layers, parallel)
+
+    def merge_colors(self, colors, target, parallel=False):
+        """Repaint every pixel of `colors` with `target` and drop the merged palette entries"""
+        target = palette_ops.normalize_color(target)
+        colors = {palette_ops.normalize_color(color) for color in colors} - {target, None}
+
+        with self.transaction():
+            self._replace_colors({color: target for color in colors}, parallel=parallel)
+
+            if target not in self.palette:
+                self.palette.append(target)
+            self.palette = palette_ops.deduplicated_palette(self.palette)
+            self.note_changes(palette=True)
+
+    def sort_palette(self, key=palette_ops.hue_sort_key):
+        self.palette = palette_ops.sorted_palette(self.palette, key)
+        self.note_changes(palette=True)
+
+    def deduplicate_palette(self):
+        self.palette = palette_ops.deduplicated_palette(self.palette)
+        self.note_changes(palette=True)
+
+    def _replace_colors(self, mapping, layers=None, parallel=False):
+        mapping = {
+            palette_ops.normalize_color(source): palette_ops.normalize_color(target)
+            for source, target in mapping.items()
+            if source is not None and target is not None
+        }
+        mapping = {source: target for source, target in mapping.items() if source != target}
+        if not mapping:
+            return False
+
+        source = [palette_ops.color_value(color) for color in mapping.keys()]
+        target = [palette_ops.color_value(color) for color in mapping.values()]
+        layers = self.layers if layers is None else layers
+
+        def remap(layer):
+            return sum(palette_ops.remap_colors(pixels, source, target) for rect, pixels in layer.tiles.chunks())
+
+        if parallel and len(layers) > 1:
+            with ThreadPoolExecutor() as executor:
+                changed = list(executor.map(remap, layers))
+        else:
+            changed = [remap(layer) for layer in layers]
+
+        self.palette = [mapping.get(color, color) for color in self.palette]
+
+        for layer, count in zip(layers, changed):
+            if count:
+                layer.tiles.compact()
+                layer.pixels_changed.emit(layer, layer.rect())
+        return True
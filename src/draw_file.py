@@ -20,6 +20,8 @@ class DrawFile:
         canvas_data = doc_data['canvas']
         self.width = canvas_data['width']
         self.height = canvas_data['height']
+        self.tile_width = canvas_data.get('tileWidth', self.width)
+        self.tile_height = canvas_data.get('tileHeight', self.height)
         self.name = doc_data['name']
         self._layer_data = canvas_data['layers']
         self.layer_count = len(self._layer_data)
@@ -30,6 +32,9 @@ class DrawFile:
         self.palette = [palette_data['colors'][str(i)] for i in range(len(palette_data['colors']))]
         self.palette_width = palette_data['width']
 
+        animation_data = doc_data.get('animations') or {}
+        self.animations = [animation_data[str(i)] for i in range(len(animation_data))]
+
     def ensure_file(self):
         if not self.file:
             self.file = ZipFile(self.file_path)
@@ -45,6 +50,10 @@ class DrawFile:
             self._doc_data = self._get_doc_data()
         return self._doc_data
 
+    def crcs(self):
+        """CRC-32 of every zip entry, read from the central directory without inflating anything"""
+        return {info.filename: info.CRC for info in self.ensure_file().infolist()}
+
     def get_layer_data(self, layer_num):
         return self.layers[layer_num]
 
@@ -10,10 +10,23 @@ import resources
 
 from draw_document import DrawDocument
 from draw_window import DrawWindow
-
+from recovery_journal import RecoveryJournal
+from animation_export import export_animation
+from input_recording import InputRecorder
+from image_import import import_image
+from canvas_dialogs import CanvasSizeDialog, ShiftDialog
+from layer_cache import LayerCache
+from memory_budget import MemoryBudget
+from pyxel_diff import diff_files
+from diff_window import DiffWindow
+import scripting
+
+from asset_browser import AssetBrowser
 from palette_panel import PalettePanel
 from info_panel import InfoPanel
 from layer_panel import LayerPanel
+from navigator_panel import NavigatorPanel
+from script_console import ScriptConsole
 from drawing_tools_widget import DrawingToolsWidget
 from current_colors import CurrentColorsWidget
 
@@ -40,6 +53,9 @@ class DrawMainWindow(QtWidgets.QMainWindow):
         self.setWindowIcon(nearest_icon(':/icons/emblem.png'))
 
         self._info_bar = None
+        self.input_recorder = None
+        use_layer_cache = QtCore.QSettings().value('editor/layer_cache', True, type=bool)
+        self.layer_cache = LayerCache() if use_layer_cache else None
 
         self.mdi_area = QtWidgets.QMdiArea()
         self.mdi_area.setFrameStyle(0)
@@ -60,6 +76,12 @@ class DrawMainWindow(QtWidgets.QMainWindow):
 
         self.mdi_area.subWindowActivated.connect(self.handle_window_activated)
 
+        budget_mb = QtCore.QSettings().value('editor/memory_budget_mb', 1024, type=int)
+        self.memory_budget = MemoryBudget(self.mdi_area, budget_mb * 1024 * 1024)
+        self.memory_label = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.memory_label)
+        self.memory_budget.usage_changed.connect(self.update_memory_label)
+
         QtWidgets.QApplication.instance().aboutToQuit.connect(self.on_about_to_quit)
 
         self.reload_windows()
@@ -73,12 +95,85 @@ class DrawMainWindow(QtWidgets.QMainWindow):
 
         for path in file_paths:
             if os.path.isfile(path):
-                document = DrawDocument(path)
-                window = DrawWindow(document)
-                self.mdi_area.addSubWindow(window)
-                window.show()
+                self.open_document(path)
+
+    def open_document(self, path):
+        document = DrawDocument(path, layer_cache=self.layer_cache)
+        recovered = self.offer_recovery(document)
+
+        window = DrawWindow(document)
+        window.journal = RecoveryJournal(document, append=recovered)
+        window.closed.connect(self.handle_window_closed)
+        self.mdi_area.addSubWindow(window)
+        window.show()
+
+        document.reloaded.connect(self.handle_document_reloaded)
+        document.reload_failed.connect(self.handle_document_reload_failed)
+        document.watch()
+
+        return window
+
+    def update_memory_label(self, memory_budget):
+        text = '{:.0f} of {:.0f} MB'.format(
+            memory_budget.decoded_bytes() / (1024 * 1024), memory_budget.budget_bytes / (1024 * 1024)
+        )
+        hibernated = memory_budget.hibernated_windows()
+        if hibernated:
+            text += ', {} compressed ({:.1f} MB)'.format(
+                len(hibernated), memory_budget.compressed_bytes() / (1024 * 1024)
+            )
+        self.memory_label.setText(text)
+
+    def handle_document_reloaded(self, document):
+        # edits recorded so far were made to the old contents of the file
+        for window in self.mdi_area.subWindowList():
+            if window.document is document and window.journal:
+                window.journal.discard()
+                window.journal = RecoveryJournal(document)
+        self.statusBar().showMessage('{} was changed by another program and reloaded'.format(document.name), 5000)
+
+    def handle_document_reload_failed(self, document, error):
+        self.statusBar().showMessage('{} was changed by another program but could not be read: {}'.format(
+            document.name, error
+        ))
+
+    def offer_recovery(self, document):
+        path = document.file_path
+        if not RecoveryJournal.exists_for(path):
+            return False
+
+        if not RecoveryJournal.matches_source(path):
+            QtWidgets.QMessageBox.warning(
+                self, 'Recover Changes',
+                '{} was modified since its unsaved changes were recorded. '
+                'The recovered changes will be discarded.'.format(os.path.basename(path))
+            )
+            return False
+
+        answer = QtWidgets.QMessageBox.question(
+            self, 'Recover Changes',
+            '{} has unsaved changes from a previous session. Recover them?'.format(os.path.basename(path))
+        )
+        if answer != QtWidgets.QMessageBox.Yes:
+            return False
+
+        return RecoveryJournal.replay(document) > 0
+
+    def handle_window_closed(self, window):
+        if self.input_recorder and self.input_recorder.window is window:
+            self.stop_input_recording()
+        if window.journal:
+            window.journal.discard()
 
     def on_about_to_quit(self):
+        if self.input_recorder:
+            self.stop_input_recording()
+        self.asset_browser.shut_down()
+
+        for window in self.mdi_area.subWindowList():
+            if window.journal:
+                window.journal.close()
+
         settings = QtCore.QSettings()
         open_windows = [
             window.document.file_path
@@ -103,6 +198,23 @@ class DrawMainWindow(QtWidgets.QMainWindow):
         self._actions['new_file'] = new_file
         self._actions['save_file'] = save_file
 
+        undo = QtGui.QAction('Undo')
+        undo.setShortcut(QtGui.QKeySequence.Undo)
+        self._actions['undo'] = undo
+
+        redo = QtGui.QAction('Redo')
+        redo.setShortcut(QtGui.QKeySequence.Redo)
+        self._actions['redo'] = redo
+
+        import_image = QtGui.QAction('Import Image...')
+        self._actions['import_image'] = import_image
+
+        compare_file = QtGui.QAction('Compare With...')
+        self._actions['compare_file'] = compare_file
+
+        export_animation = QtGui.QAction('Export Animation...')
+        self._actions['export_animation'] = export_animation
+
         show_all_windows = QtGui.QAction('Show All Windows')
         self._actions['show_all_windows'] = show_all_windows
 
@@ -121,6 +233,56 @@ class DrawMainWindow(QtWidgets.QMainWindow):
         view_toggle_grid.setShortcut(QtGui.QKeySequence.fromString('Ctrl+G'))
         self._actions['view_toggle_grid'] = view_toggle_grid
 
+        view_onion_skin = QtGui.QAction('Onion Skin')
+        view_onion_skin.setShortcut(QtGui.QKeySequence.fromString('Ctrl+K'))
+        self._actions['view_onion_skin'] = view_onion_skin
+
+        view_side_by_side = QtGui.QAction('Side by Side Comparison')
+        self._actions['view_side_by_side'] = view_side_by_side
+
+        view_next_frame = QtGui.QAction('Next Frame')
+        view_next_frame.setShortcut(QtGui.QKeySequence.fromString('.'))
+        self._actions['view_next_frame'] = view_next_frame
+
+        view_previous_frame = QtGui.QAction('Previous Frame')
+        view_previous_frame.setShortcut(QtGui.QKeySequence.fromString(','))
+        self._actions['view_previous_frame'] = view_previous_frame
+
+        crop_to_content = QtGui.QAction('Crop to Content')
+        self._actions['crop_to_content'] = crop_to_content
+
+        canvas_size = QtGui.QAction('Canvas Size...')
+        self._actions['canvas_size'] = canvas_size
+
+        flip_horizontal = QtGui.QAction('Flip Horizontal')
+        self._actions['flip_horizontal'] = flip_horizontal
+
+        flip_vertical = QtGui.QAction('Flip Vertical')
+        self._actions['flip_vertical'] = flip_vertical
+
+        rotate_clockwise = QtGui.QAction('Rotate 90\u00b0 Clockwise')
+        self._actions['rotate_clockwise'] = rotate_clockwise
+
+        rotate_counterclockwise = QtGui.QAction('Rotate 90\u00b0 Counterclockwise')
+        self._actions['rotate_counterclockwise'] = rotate_counterclockwise
+
+        rotate_half = QtGui.QAction('Rotate 180\u00b0')
+        self._actions['rotate_half'] = rotate_half
+
+        shift = QtGui.QAction('Shift...')
+        self._actions['shift'] = shift
+
+        merge_visible = QtGui.QAction('Merge Visible')
+        merge_visible.setShortcut(QtGui.QKeySequence.fromString('Ctrl+Shift+E'))
+        self._actions['merge_visible'] = merge_visible
+
+        flatten = QtGui.QAction('Flatten')
+        self._actions['flatten'] = flatten
+
+        record_input = QtGui.QAction('Record Input...')
+        record_input.setCheckable(True)
+        self._actions['record_input'] = record_input
+
         reset_zoom = QtGui.QAction('Reset Zoom', self)
         reset_zoom.setShortcut(QtGui.QKeySequence.fromString('Ctrl+0'))
         self._actions['reset_zoom'] = reset_zoom
@@ -135,16 +297,46 @@ class DrawMainWindow(QtWidgets.QMainWindow):
         file_menu.addAction(self._actions['open_file'])
         file_menu.addAction(self._actions['new_file'])
         file_menu.addAction(self._actions['save_file'])
+        file_menu.addSeparator()
+        file_menu.addAction(self._actions['import_image'])
+        file_menu.addAction(self._actions['export_animation'])
+        file_menu.addAction(self._actions['compare_file'])
+
+        edit_menu = self.menuBar().addMenu('Edit')
+        edit_menu.addAction(self._actions['undo'])
+        edit_menu.addAction(self._actions['redo'])
 
         view_menu = self.menuBar().addMenu('View')
         view_menu.addAction(self._actions['view_zoom_in'])
         view_menu.addAction(self._actions['view_zoom_out'])
         view_menu.addAction(self._actions['reset_zoom'])
         view_menu.addAction(self._actions['view_toggle_grid'])
+        view_menu.addSeparator()
+        view_menu.addAction(self._actions['view_onion_skin'])
+        view_menu.addAction(self._actions['view_previous_frame'])
+        view_menu.addAction(self._actions['view_next_frame'])
+        view_menu.addSeparator()
+        view_menu.addAction(self._actions['view_side_by_side'])
+
+        image_menu = self.menuBar().addMenu('Image')
+        image_menu.addAction(self._actions['crop_to_content'])
+        image_menu.addAction(self._actions['canvas_size'])
+        image_menu.addSeparator()
+        image_menu.addAction(self._actions['flip_horizontal'])
+        image_menu.addAction(self._actions['flip_vertical'])
+        image_menu.addAction(self._actions['rotate_clockwise'])
+        image_menu.addAction(self._actions['rotate_counterclockwise'])
+        image_menu.addAction(self._actions['rotate_half'])
+        image_menu.addAction(self._actions['shift'])
+        image_menu.addSeparator()
+        image_menu.addAction(self._actions['merge_visible'])
+        image_menu.addAction(self._actions['flatten'])
 
         window_menu = self.menuBar().addMenu('Window')
         window_menu.addAction(self._actions['show_all_windows'])
         window_menu.addAction(self._actions['hide_all_windows'])
+        window_menu.addSeparator()
+        window_menu.addAction(self._actions['record_input'])
 
     def create_dock_widget(self, name, dock_area=QtCore.Qt.RightDockWidgetArea):
         dock = QtWidgets.QDockWidget()
@@ -167,6 +359,10 @@ class DrawMainWindow(QtWidgets.QMainWindow):
         self.layer_dock.setWidget(layer_panel)
         layer_panel.register_window(self)
 
+        navigator_dock = self.create_dock_widget('navigator')
+        self.navigator_panel = NavigatorPanel()
+        navigator_dock.setWidget(self.navigator_panel)
+
         dock_2 = self.create_dock_widget('info')
         self.info_panel = InfoPanel()
         dock_2.setWidget(self.info_panel)
@@ -182,6 +378,16 @@ class DrawMainWindow(QtWidgets.QMainWindow):
         tool_dock = self.create_dock_widget('drawing tools', QtCore.Qt.LeftDockWidgetArea)
         tool_dock.setWidget(self.drawing_tools_widget)
 
+        asset_dock = self.create_dock_widget('assets', QtCore.Qt.LeftDockWidgetArea)
+        self.asset_browser = AssetBrowser()
+        asset_dock.setWidget(self.asset_browser)
+        self.asset_browser.open_requested.connect(self.open_document)
+
+        script_dock = self.create_dock_widget('script console', QtCore.Qt.BottomDockWidgetArea)
+        self.script_console = ScriptConsole()
+        script_dock.setWidget(self.script_console)
+        self.script_console.register_window(self)
+
     def setup_toolbars(self):
         self.top_toolbar = self.addToolBar('toolbar')
 
@@ -194,11 +400,92 @@ class DrawMainWindow(QtWidgets.QMainWindow):
         if file_name:
             settings.setValue('editor/open_file_location', os.path.dirname(file_name))
 
-            document = DrawDocument(file_name)
-            window = DrawWindow(document)
+            self.open_document(file_name)
+
+    def handle_import_image(self, checked):
+        settings = QtCore.QSettings()
+        import_dir = settings.value('editor/import_file_location') or os.path.expanduser('~')
+
+        file_name, filter = QtWidgets.QFileDialog.getOpenFileName(
+            self, 'Import Image', import_dir, 'Images (*.png *.gif)'
+        )
+
+        if file_name:
+            settings.setValue('editor/import_file_location', os.path.dirname(file_name))
+
+            window = DrawWindow(import_image(file_name))
+            window.closed.connect(self.handle_window_closed)
             self.mdi_area.addSubWindow(window)
             window.show()
 
+    def handle_compare_file(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if not w or not w.document.file_path:
+            return
+
+        settings = QtCore.QSettings()
+        compare_dir = settings.value('editor/compare_file_location') or os.path.dirname(w.document.file_path)
+
+        file_name, filter = QtWidgets.QFileDialog.getOpenFileName(
+            self, 'Compare {} With'.format(w.document.name), compare_dir, 'Pyxel files (*.pyxel)'
+        )
+
+        if file_name:
+            settings.setValue('editor/compare_file_location', os.path.dirname(file_name))
+            self.open_comparison(file_name, w.document.file_path)
+
+    def open_comparison(self, old_path, new_path):
+        window = DiffWindow(diff_files(old_path, new_path))
+        window.closed.connect(self.handle_window_closed)
+        self.mdi_area.addSubWindow(window)
+        window.show()
+        return window
+
+    def handle_export_animation(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if not w:
+            return
+        if not w.current_animation:
+            QtWidgets.QMessageBox.information(self, 'Export Animation', '{} has no animations.'.format(w.document.name))
+            return
+
+        settings = QtCore.QSettings()
+        export_dir = settings.value('editor/export_file_location') or os.path.expanduser('~')
+        default_path = os.path.join(export_dir, w.current_animation.name + '.gif')
+
+        file_name, filter = QtWidgets.QFileDialog.getSaveFileName(
+            self, 'Export Animation', default_path, 'GIF (*.gif);;Animated PNG (*.png)'
+        )
+
+        if file_name:
+            settings.setValue('editor/export_file_location', os.path.dirname(file_name))
+            export_animation(w.document, w.current_animation, file_name)
+
+    def handle_record_input(self, checked):
+        if self.input_recorder:
+            self.stop_input_recording()
+            return
+
+        w = self.mdi_area.currentSubWindow()
+        settings = QtCore.QSettings()
+        record_dir = settings.value('editor/recording_location') or os.path.expanduser('~')
+        file_name = None
+        if w:
+            file_name, filter = QtWidgets.QFileDialog.getSaveFileName(
+                self, 'Record Input', os.path.join(record_dir, 'session.drawrec'), 'Input recordings (*.drawrec)'
+            )
+
+        if file_name:
+            settings.setValue('editor/recording_location', os.path.dirname(file_name))
+            self.input_recorder = InputRecorder(w, file_name, self)
+        else:
+            self._actions['record_input'].setChecked(False)
+
+    def stop_input_recording(self):
+        self.input_recorder.stop()
+        self.input_recorder = None
+        self._actions['record_input'].setChecked(False)
+
     def handle_show_all_windows(self, checked):
         for window in self.mdi_area.subWindowList():
             window.show()
@@ -222,7 +509,98 @@ class DrawMainWindow(QtWidgets.QMainWindow):
         if w:
             w.toggle_grid()
 
+    def handle_view_onion_skin(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            w.toggle_onion_skin()
+
+    def handle_view_side_by_side(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if isinstance(w, DiffWindow):
+            w.toggle_side_by_side()
+
+    def handle_view_next_frame(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            w.next_frame()
+
+    def handle_view_previous_frame(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            w.previous_frame()
+
+    def handle_crop_to_content(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            w.document.crop_to_content()
+
+    def handle_canvas_size(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            dialog = CanvasSizeDialog(w.document.size, self)
+            if dialog.exec():
+                w.document.resize_canvas_anchored(dialog.canvas_size(), dialog.anchor())
+
+    def handle_flip_horizontal(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            w.document.flip(horizontal=True)
+
+    def handle_flip_vertical(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            w.document.flip(horizontal=False)
+
+    def handle_rotate_clockwise(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            w.document.rotate(1)
+
+    def handle_rotate_counterclockwise(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            w.document.rotate(-1)
+
+    def handle_rotate_half(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            w.document.rotate(2)
+
+    def handle_shift(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            dialog = ShiftDialog(self)
+            if dialog.exec():
+                w.document.shift(*dialog.offset())
+
+    def handle_undo(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w and w.document.undo_stack.canUndo() and not scripting.undo(w.document):
+            self.statusBar().showMessage('{} was edited after the script ran, undo history cleared'.format(
+                w.document.name
+            ), 5000)
+
+    def handle_redo(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w and w.document.undo_stack.canRedo() and not scripting.redo(w.document):
+            self.statusBar().showMessage('{} was edited after the undo, undo history cleared'.format(
+                w.document.name
+            ), 5000)
+
+    def handle_merge_visible(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            w.document.merge_visible()
+
+    def handle_flatten(self, checked):
+        w = self.mdi_area.currentSubWindow()
+        if w:
+            w.document.flatten()
+
     def handle_window_activated(self, window):
+        if window:
+            self.memory_budget.activate(window)
+        self.navigator_panel.set_window(window)
         if window:
             print('DrawMainWindow emitting document_changed')
             self.document_changed.emit(window.document)
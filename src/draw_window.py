@@ -7,10 +7,17 @@ from PySide6 import QtGui
 from PySide6.QtGui import QImage
 
 from draw_document import DrawDocument
+from document_renderer import DocumentRenderer, LayerStackCache
+from mip_pyramid import MipPyramid
+from onion_skin import OnionSkin
 from icon import nearest_icon
 
 
 class DrawWindow(QtWidgets.QMdiSubWindow):
+    closed = QtCore.Signal((QtCore.QObject,))
+    composite_changed = QtCore.Signal(QtCore.QObject, QtCore.QRect)
+    viewport_changed = QtCore.Signal((QtCore.QObject,))
+
     MAX_ZOOM_LEVEL = 12
     MIN_ZOOM_LEVEL = -3
 
@@ -32,6 +39,7 @@ class DrawWindow(QtWidgets.QMdiSubWindow):
         self.setStyleSheet(self.__style_sheet)
 
         self.document = document or DrawDocument()
+        self.journal = None
 
         self.setWindowFilePath(self.document.file_path)
 
@@ -40,6 +48,17 @@ class DrawWindow(QtWidgets.QMdiSubWindow):
         self.grid_spacing = 8
         self.show_grid = False
 
+        self.renderer = DocumentRenderer(self.document, LayerStackCache())
+        self.document.canvas_changed.connect(self.renderer.cache.clear)
+        self.composite = None
+        self._pixmap = None
+        self.mips = MipPyramid(-self.MIN_ZOOM_LEVEL)
+        self._composition_key = None
+
+        self.onion_skin = OnionSkin(self.document)
+        self.current_animation = self.document.animations[0] if self.document.animations else None
+        self.current_frame = 0
+
         self.scroll_area = QtWidgets.QScrollArea()
         self.scroll_area.setFrameStyle(QtWidgets.QFrame.NoFrame)
         self.scroll_area.setAlignment(QtCore.Qt.AlignCenter)
@@ -48,12 +67,15 @@ class DrawWindow(QtWidgets.QMdiSubWindow):
         self.scroll_area.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
         self.scroll_area.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
         self.setWidget(self.scroll_area)
+        self.scroll_area.horizontalScrollBar().valueChanged.connect(self.on_viewport_changed)
+        self.scroll_area.verticalScrollBar().valueChanged.connect(self.on_viewport_changed)
 
         self.setContentsMargins(0, 0, 0, 0)
         self.layout().setSpacing(0)
         self.layout().setContentsMargins(0, 0, 0, 0)
 
         self.canvas = CanvasLabel()
+        self.canvas.mips = self.mips
         self.canvas.redraw.connect(self.on_canvas_redraw)
         self.scroll_area.setWidget(self.canvas)
         self.update_canvas()
@@ -72,14 +94,113 @@ class DrawWindow(QtWidgets.QMdiSubWindow):
     @document.setter
     def document(self, document):
         self._document = document
-        document.document_changed.connect(self.render_document)
+        document.changed.connect(self.on_document_changed)
 
     def on_canvas_redraw(self, canvas):
         if self.show_grid:
             CanvasGrid.draw(canvas, self.canvas_size, 8, self.canvas_scale())
+        if self.onion_skin.enabled and self.current_animation:
+            frame_rect = self.document.tile_rect(self.current_animation.frame_tile(self.current_frame))
+            CanvasFrame.draw(canvas, frame_rect, self.canvas_scale())
+
+    def on_document_changed(self, document, changes):
+        if changes.canvas:
+            self.composite = None
+        self.render_document(changes.rect())
+
+    def render_document(self, dirty_rect=QtCore.QRect()):
+        """Re-composite `dirty_rect`, or everything when the composition itself changed"""
+        self.document.wake()
+        composition_key = DocumentRenderer.composition_key(self.document)
+
+        if self.composite is None or composition_key != self._composition_key:
+            self._composition_key = composition_key
+            if self.document.size != self.canvas_size:
+                self.canvas_size = self.document.size
+                self.update_canvas()
+            self.composite = self.renderer.render(parallel=True)
+            self.onion_skin.apply(self.composite, self.current_animation, self.current_frame)
+            self._pixmap = QtGui.QPixmap.fromImage(self.composite)
+            self.mips.rebuild(self.composite)
+            self.composite_changed.emit(self, self.composite.rect())
+        elif not dirty_rect.isEmpty():
+            self.render_rect(dirty_rect)
+        else:
+            return
+
+        self.canvas.setPixmap(self._pixmap)
+
+    def render_rect(self, rect):
+        """Re-composite only `rect` of the canvas"""
+        patch = self.renderer.render(rect)
+        self.onion_skin.apply(patch, self.current_animation, self.current_frame, rect)
+
+        for target in (self.composite, self._pixmap):
+            painter = QtGui.QPainter(target)
+            painter.setCompositionMode(QtGui.QPainter.CompositionMode_Source)
+            painter.drawImage(rect.topLeft(), patch)
+            painter.end()
+        self.mips.update_rect(rect)
+        self.composite_changed.emit(self, rect)
+
+    @property
+    def hibernated(self):
+        return self.composite is None and self.document.hibernated
+
+    def hibernate(self):
+        """Free the pixels of the document and everything rendered from them.
+
+        Layers are kept compressed and the smallest mip level stays on the
+        canvas as a preview until wake().
+        """
+        if self.composite is None:
+            return
+        preview = self.mips.pixmaps[-1] if len(self.mips.pixmaps) > 1 else QtGui.QPixmap()
+        self.document.hibernate()
+        self.renderer.cache.clear()
+        self.composite = None
+        self._pixmap = None
+        self.mips.images, self.mips.pixmaps = [], []
+        self.canvas.set_preview(preview, self.canvas_size)
+
+    def wake(self):
+        if self.composite is None:
+            self.render_document()
+
+    def memory_usage(self):
+        """Bytes held by decoded layers, rendered images and the render cache, and by compressed layers"""
+        images = [image for image in [self.composite] + self.mips.images[1:] if image is not None]
+        pixmaps = [pixmap for pixmap in [self.canvas.pixmap()] + self.mips.pixmaps[1:] if pixmap is not None]
+        return {
+            'layers': self.document.nbytes(),
+            'composite': sum(image.sizeInBytes() for image in images)
+                + sum(pixmap.width() * pixmap.height() * pixmap.depth() // 8 for pixmap in pixmaps),
+            'cache': self.renderer.cache.nbytes,
+            'compressed': self.document.compressed_nbytes(),
+        }
+
+    def set_current_frame(self, frame):
+        if not self.current_animation:
+            return
+        previous_rect = self.document.tile_rect(self.current_animation.frame_tile(self.current_frame))
+        self.current_frame = frame % self.current_animation.length
+        if self.onion_skin.enabled:
+            self.render_rect(previous_rect)
+            self.render_rect(self.document.tile_rect(self.current_animation.frame_tile(self.current_frame)))
+            self.canvas.setPixmap(self._pixmap)
+        self.canvas.update()
+        self.update_title_bar_text()
+
+    def next_frame(self):
+        self.set_current_frame(self.current_frame + 1)
 
-    def render_document(self):
-        self.canvas.setPixmap(QtGui.QPixmap.fromImage(DocumentRenderer(self.document).render()))
+    def previous_frame(self):
+        self.set_current_frame(self.current_frame - 1)
+
+    def toggle_onion_skin(self, checked=False):
+        self.onion_skin.enabled = not self.onion_skin.enabled
+        self.composite = None
+        self.render_document()
 
     @property
     def zoom_level(self):
@@ -91,7 +212,12 @@ class DrawWindow(QtWidgets.QMdiSubWindow):
         self.update_title_bar_text()
 
     def update_title_bar_text(self):
-        self.setWindowTitle('{} ({:.2f}x)'.format(self.document.name, self.canvas_scale()*self.devicePixelRatioF()))
+        title = '{} ({:.2f}x)'.format(self.document.name, self.canvas_scale()*self.devicePixelRatioF())
+        if self.onion_skin.enabled and self.current_animation:
+            title += ' - {} {}/{}'.format(
+                self.current_animation.name, self.current_frame + 1, self.current_animation.length
+            )
+        self.setWindowTitle(title)
 
     def canvas_scale(self):
         return math.pow(2, self.zoom_level)/self.devicePixelRatioF()
@@ -105,6 +231,7 @@ class DrawWindow(QtWidgets.QMdiSubWindow):
         self.canvas.setFixedSize(new_size)
         self.canvas.resize(new_size)
         self.canvas.canvas_scale = self.canvas_scale()
+        self.on_viewport_changed()
 
     def _zoom(self, zoom):
         cr_center = self.scroll_area.contentsRect().center()
@@ -122,6 +249,27 @@ class DrawWindow(QtWidgets.QMdiSubWindow):
     def center_canvas_at(self, point):
         self.scroll_area.ensureVisible(point.x(), point.y(), self.scroll_area.width()/2, self.scroll_area.height()/2)
 
+    def center_at_pixel(self, point):
+        """Scroll so that the canvas pixel `point` is in the middle of the view"""
+        self.center_canvas_at(self.canvas_transform().map(QtCore.QPointF(point)))
+
+    def visible_canvas_rect(self):
+        """Part of the canvas in view, in canvas pixels"""
+        viewport = self.scroll_area.viewport()
+        top_left = QtCore.QPointF(self.canvas.mapFrom(viewport, QtCore.QPoint(0, 0)))
+        scale = self.canvas_scale()
+        visible = QtCore.QRectF(
+            top_left.x()/scale, top_left.y()/scale, viewport.width()/scale, viewport.height()/scale
+        )
+        return visible.intersected(QtCore.QRectF(QtCore.QPointF(0, 0), QtCore.QSizeF(self.canvas_size)))
+
+    def on_viewport_changed(self, *args):
+        self.viewport_changed.emit(self)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.on_viewport_changed()
+
     def resize_contents(self, size):
         h = self.title_bar_height()
         w = self.frame_width()
@@ -154,6 +302,11 @@ class DrawWindow(QtWidgets.QMdiSubWindow):
     def reset_zoom(self):
         self._zoom(0)
 
+    def closeEvent(self, event):
+        super().closeEvent(event)
+        if event.isAccepted():
+            self.closed.emit(self)
+
     def toggle_grid(self, checked=False):
         self.show_grid = not self.show_grid
         self.canvas.update()
@@ -162,63 +315,6 @@ class DrawWindow(QtWidgets.QMdiSubWindow):
         pass
 
 
-class DocumentRenderer:
-    def __init__(self, document):
-        self.document = document
-        self.painter = None
-
-    def render(self):
-        image = QtGui.QImage(self.document.size, QtGui.QImage.Format_ARGB32_Premultiplied)
-        self.painter = QtGui.QPainter(image)
-
-        image.fill(QtGui.QColor('transparent'))
-
-        for layer in reversed(self.document.layers):
-            if not layer.hidden:
-                self.set_blend_mode(layer)
-                self.set_opacity(layer)
-                self.painter.drawImage(QtCore.QPoint(0, 0), layer.image)
-        self.painter.end()
-
-        return image
-
-    def set_opacity(self, layer):
-        self.painter.setOpacity(layer.alpha/255)
-
-    def set_blend_mode(self, layer):
-        if not layer.blend_mode or layer.blend_mode == 'normal':
-            self.painter.setCompositionMode(QtGui.QPainter.CompositionMode_SourceOver)
-        else:
-            self.painter.setCompositionMode(self.composition_mode_for_name(layer.blend_mode))
-
-    def composition_mode_for_name(self, name):
-        if name == 'darken':
-            return QtGui.QPainter.CompositionMode_Darken
-        if name == 'lighten':
-            return QtGui.QPainter.CompositionMode_Lighten
-        if name == 'add':
-            return QtGui.QPainter.CompositionMode_Plus
-        if name == 'difference':
-            return QtGui.QPainter.CompositionMode_Difference
-        if name == 'multiply':
-            return QtGui.QPainter.CompositionMode_Multiply
-        if name == 'screen':
-            return QtGui.QPainter.CompositionMode_Screen
-        if name == 'invert':
-            return QtGui.QPainter.CompositionMode_Invert
-        if name == 'overlay':
-            return QtGui.QPainter.CompositionMode_Overlay
-        if name == 'hardlight':
-            return QtGui.QPainter.CompositionMode_HardLight
-        if name == 'softlight':
-            return QtGui.QPainter.CompositionMode_SoftLight
-        if name == 'dodge':
-            return QtGui.QPainter.CompositionMode_ColorDodge
-        if name == 'burn':
-            return QtGui.QPainter.CompositionMode_ColorBurn
-
-        raise Exception('Unsupported composition mode \'%s\'' % name)
-
 class CanvasLabel(QtWidgets.QLabel):
     redraw = QtCore.Signal((QtCore.QObject,))
 
@@ -228,16 +324,24 @@ class CanvasLabel(QtWidgets.QLabel):
         self.setAttribute(QtCore.Qt.WA_NoSystemBackground)
 
         self.canvas_scale = QtCore.QSizeF(1, 1)
+        self.mips = None
+        self.source_size = QtCore.QSize()
 
         self.setup_overlay()
         self.setBackgroundRole(QtGui.QPalette.Light)
         self.setScaledContents(True)
 
     def setPixmap(self, pixmap):
+        self.source_size = pixmap.size()
         super().setPixmap(pixmap)
         if self.pixmap().size() != self.overlay_image.size():
             self.setup_overlay()
 
+    def set_preview(self, pixmap, size):
+        """Show a scaled down `pixmap` stretched over a canvas of `size`"""
+        self.setPixmap(pixmap)
+        self.source_size = QtCore.QSize(size)
+
     def setup_overlay(self):
         if self.pixmap():
             size = QtCore.QSize(self.pixmap().width(), self.pixmap().height())
@@ -252,7 +356,7 @@ class CanvasLabel(QtWidgets.QLabel):
         self.overlay_image.fill(QtGui.QColor(0, 0, 0, 0))
 
     def paintEvent(self, event):
-        image_rect = QtCore.QRectF(QtCore.QPointF(0, 0), QtCore.QSizeF(self.pixmap().size())*self.canvas_scale)
+        image_rect = QtCore.QRectF(QtCore.QPointF(0, 0), QtCore.QSizeF(self.source_size)*self.canvas_scale)
 
         self_rect = self.contentsRect()
 
@@ -263,12 +367,34 @@ class CanvasLabel(QtWidgets.QLabel):
         painter = QtGui.QPainter(self)
         painter.fillRect(self.contentsRect(), QtGui.QColor(0, 0, 0, 255))
         painter.fillRect(image_rect, bg_brush)
-        painter.drawPixmap(image_rect, self.pixmap(), QtCore.QRectF(self.pixmap().rect()))
+        # zoomed out, draw the closest half-size level instead of shrinking the full composite
+        level = self.mips.level_for_scale(self.canvas_scale*self.devicePixelRatioF()) if self.mips else 0
+        pixmap = self.mips.pixmaps[level] if level else self.pixmap()
+        if level and self.canvas_scale*self.devicePixelRatioF()*(1 << level) < 1:
+            painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
+        painter.drawPixmap(image_rect, pixmap, QtCore.QRectF(pixmap.rect()))
         #painter.drawImage(image_rect, self.overlay_image)
         self.redraw.emit(self)
         painter.end()
 
 
+class CanvasFrame:
+    @staticmethod
+    def draw(target, frame_rect, scale):
+        painter = QtGui.QPainter(target)
+
+        pen = QtGui.QPen()
+        pen.setWidth(0)
+        pen.setColor(QtGui.QColor(255, 255, 255, 160))
+        painter.setPen(pen)
+        painter.drawRect(QtCore.QRectF(
+            frame_rect.x()*scale, frame_rect.y()*scale,
+            frame_rect.width()*scale, frame_rect.height()*scale,
+        ))
+
+        painter.end()
+
+
 class CanvasGrid:
     @staticmethod
     def draw(target, canvas_size, spacing, scale):
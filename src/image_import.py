@@ -0,0 +1,156 @@
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from draw_document import Animation, DrawDocument
+from pixel_array import image_array, array_image
+import palette_ops
+
+
+MAX_COLORS = 256
+
+
+def unique_colors(pixels):
+    """Distinct non-transparent colors of a uint32 array and how many pixels use each.
+
+    Runs of equal pixels are collapsed first, which shrinks flat pixel art by an
+    order of magnitude before the sort.
+    """
+    flat = pixels.ravel()
+    if flat.size == 0:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    lengths = np.diff(np.append(starts, flat.size))
+    colors, inverse = np.unique(flat[starts], return_inverse=True)
+    counts = np.bincount(inverse, weights=lengths).astype(np.int64)
+    opaque = (colors >> 24) != 0
+    return colors[opaque], counts[opaque]
+
+
+def median_cut(colors, counts, max_colors):
+    """Reduce `colors` to at most `max_colors`.
+
+    Returns the palette and, for every input color, the index of its palette entry.
+    Boxes are split along their widest ARGB channel at the weighted median.
+    """
+    channels = np.stack([(colors >> shift) & 0xff for shift in (24, 16, 8, 0)], axis=1).astype(np.int64)
+    boxes = [np.arange(len(colors))]
+    spans = [np.ptp(channels, axis=0)]
+    while len(boxes) < max_colors:
+        widest = [span.max() for span in spans]
+        box_index = int(np.argmax(widest))
+        if widest[box_index] == 0:
+            break
+        box = boxes.pop(box_index)
+        channel = int(spans.pop(box_index).argmax())
+
+        box = box[np.argsort(channels[box, channel], kind='stable')]
+        cumulative = np.cumsum(counts[box])
+        split = int(np.searchsorted(cumulative, cumulative[-1] / 2)) + 1
+        split = min(max(split, 1), len(box) - 1)
+        for part in (box[:split], box[split:]):
+            boxes.append(part)
+            spans.append(np.ptp(channels[part], axis=0))
+
+    palette = np.zeros(len(boxes), dtype=np.uint32)
+    lookup = np.zeros(len(colors), dtype=np.intp)
+    for index, box in enumerate(boxes):
+        weights = counts[box].astype(np.float64)
+        mean = np.rint((channels[box] * weights[:, None]).sum(axis=0) / weights.sum()).astype(np.uint32)
+        palette[index] = mean[0] << 24 | mean[1] << 16 | mean[2] << 8 | mean[3]
+        lookup[box] = index
+    return palette, lookup
+
+
+def extract_palette(pixels, max_colors=MAX_COLORS):
+    """Palette of a uint32 ARGB array, quantizing the array in place when it has too many colors"""
+    pixels[(pixels >> 24) == 0] = 0
+    colors, counts = unique_colors(pixels)
+    if len(colors) <= max_colors:
+        return colors
+
+    palette, lookup = median_cut(colors, counts, max_colors)
+    palette_ops.remap_colors(pixels, colors, palette[lookup])
+    return np.unique(palette)
+
+
+def read_frames(path):
+    """(pixels, duration in ms) for every frame of a PNG or (animated) GIF"""
+    reader = QtGui.QImageReader(path)
+    frames = []
+    while True:
+        image = reader.read()
+        if image.isNull():
+            break
+        pixels = image_array(image.convertToFormat(QtGui.QImage.Format_ARGB32)).copy()
+        frames.append((pixels, max(reader.nextImageDelay(), 10)))
+        if not reader.supportsAnimation():
+            break
+    if not frames:
+        raise Exception('could not read {}: {}'.format(path, reader.errorString()))
+    return frames
+
+
+def import_image(path, max_colors=MAX_COLORS):
+    """Build a document from a PNG or GIF.
+
+    Animation frames are laid out as tiles of a grid and referenced by an animation.
+    """
+    frames = read_frames(path)
+    frame_height, frame_width = frames[0][0].shape
+    columns = math.ceil(math.sqrt(len(frames)))
+    rows = math.ceil(len(frames) / columns)
+
+    sheet = np.zeros((frame_height * rows, frame_width * columns), dtype=np.uint32)
+    for index, (pixels, duration) in enumerate(frames):
+        top, left = index // columns * frame_height, index % columns * frame_width
+        sheet[top:top + frame_height, left:left + frame_width] = pixels[:frame_height, :frame_width]
+    palette = extract_palette(sheet, max_colors)
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    document = DrawDocument(size=QtCore.QSize(sheet.shape[1], sheet.shape[0]))
+    document.name = name
+    document.tile_size = QtCore.QSize(frame_width, frame_height)
+    document.palette = [palette_ops.color_name(color) for color in palette]
+
+    layer = document.create_layer()
+    layer.name = 'Layer 0'
+    layer.load_image(array_image(sheet))
+    document.add_layer(layer)
+
+    if len(frames) > 1:
+        frame_duration = frames[0][1]
+        document.animations = [Animation(
+            name=name,
+            length=len(frames),
+            frame_duration=frame_duration,
+            frame_duration_multipliers=[round(duration * 100 / frame_duration) for pixels, duration in frames],
+        )]
+
+    document.color_usage.rebuild()
+    document.note_changes(structure=True, palette=True, canvas=True)
+    return document
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a PNG or GIF and report the extracted palette')
+    parser.add_argument('file')
+    parser.add_argument('--max-colors', type=int, default=MAX_COLORS)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    document = import_image(args.file, args.max_colors)
+    print('{}: {}x{}, {} colors, {} animation frames, {:.3f}s'.format(
+        args.file, document.size.width(), document.size.height(), len(document.palette),
+        document.animations[0].length if document.animations else 1, time.perf_counter() - start,
+    ))
+
+
+if __name__ == '__main__':
+    main()
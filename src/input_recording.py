@@ -0,0 +1,283 @@
+"""Record the input of an editing session and replay it for profiling.
+
+A recording is a small header followed by a zlib stream of fixed-layout
+records: mouse, wheel and key events on a DrawWindow, and triggered
+DrawMainWindow actions, each stamped with milliseconds since the start.
+
+    python src/input_recording.py session.drawrec [--realtime] [--json timings.json]
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+from PySide6 import QtWidgets
+
+
+MAGIC = b'DRAWREC1'
+
+MOUSE_PRESS = 1
+MOUSE_RELEASE = 2
+MOUSE_MOVE = 3
+MOUSE_DOUBLE_CLICK = 4
+KEY_PRESS = 5
+KEY_RELEASE = 6
+WHEEL = 7
+ACTION = 8
+
+MOUSE_EVENTS = {
+    QtCore.QEvent.MouseButtonPress: MOUSE_PRESS,
+    QtCore.QEvent.MouseButtonRelease: MOUSE_RELEASE,
+    QtCore.QEvent.MouseMove: MOUSE_MOVE,
+    QtCore.QEvent.MouseButtonDblClick: MOUSE_DOUBLE_CLICK,
+}
+KEY_EVENTS = {
+    QtCore.QEvent.KeyPress: KEY_PRESS,
+    QtCore.QEvent.KeyRelease: KEY_RELEASE,
+}
+EVENT_TYPES = {kind: event_type for event_type, kind in list(MOUSE_EVENTS.items()) + list(KEY_EVENTS.items())}
+
+_record_header = struct.Struct('<IB')
+_mouse = struct.Struct('<ffBBI')
+_wheel = struct.Struct('<ffhhI')
+_key = struct.Struct('<iIB')
+
+
+class InputRecorder(QtCore.QObject):
+    """Writes the input reaching `window` and the actions of `main_window` to `path`"""
+
+    def __init__(self, window, path, main_window=None):
+        super().__init__()
+        self.window = window
+        self.main_window = main_window
+        self._file = open(path, 'wb')
+        self._compressor = zlib.compressobj(9)
+        self._timer = QtCore.QElapsedTimer()
+        self._actions = []
+
+        header = json.dumps({
+            'document': os.path.abspath(window.document.file_path) if window.document.file_path else None,
+            'window_size': [window.width(), window.height()],
+            'zoom_level': window.zoom_level,
+        }).encode()
+        self._file.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+        self._timer.start()
+        QtWidgets.QApplication.instance().installEventFilter(self)
+        if main_window:
+            for name, action in main_window._actions.items():
+                slot = lambda checked=False, name=name: self.record_action(name)
+                action.triggered.connect(slot)
+                self._actions.append((action, slot))
+
+    def eventFilter(self, watched, event):
+        kind = MOUSE_EVENTS.get(event.type())
+        if kind and watched is self.window.canvas:
+            position = event.position()
+            self._write(kind, _mouse.pack(
+                position.x(), position.y(), event.button().value, event.buttons().value, event.modifiers().value
+            ))
+        elif event.type() == QtCore.QEvent.Wheel and watched is self.window.canvas:
+            position = event.position()
+            delta = event.angleDelta()
+            self._write(WHEEL, _wheel.pack(position.x(), position.y(), delta.x(), delta.y(), event.modifiers().value))
+        elif event.type() in KEY_EVENTS and watched is QtWidgets.QApplication.focusWidget() \
+                and self.window.isAncestorOf(watched):
+            text = event.text().encode()
+            self._write(KEY_EVENTS[event.type()], _key.pack(
+                event.key(), event.modifiers().value, event.isAutoRepeat()
+            ) + struct.pack('<B', len(text)) + text)
+        return False
+
+    def record_action(self, name):
+        data = name.encode()
+        self._write(ACTION, struct.pack('<B', len(data)) + data)
+
+    def _write(self, kind, payload):
+        self._file.write(self._compressor.compress(_record_header.pack(self._timer.elapsed(), kind) + payload))
+
+    def stop(self):
+        QtWidgets.QApplication.instance().removeEventFilter(self)
+        for action, slot in self._actions:
+            action.triggered.disconnect(slot)
+        self._actions = []
+        self._file.write(self._compressor.flush())
+        self._file.close()
+
+
+def read_recording(path):
+    """Header dict and a list of (milliseconds, kind, fields) records"""
+    with open(path, 'rb') as recording:
+        if recording.read(len(MAGIC)) != MAGIC:
+            raise Exception('{} is not an input recording'.format(path))
+        length, = struct.unpack('<I', recording.read(4))
+        header = json.loads(recording.read(length))
+        data = zlib.decompressobj().decompress(recording.read())
+
+    records = []
+    offset = 0
+    while offset + _record_header.size <= len(data):
+        milliseconds, kind = _record_header.unpack_from(data, offset)
+        offset += _record_header.size
+        if kind in (MOUSE_PRESS, MOUSE_RELEASE, MOUSE_MOVE, MOUSE_DOUBLE_CLICK):
+            fields = _mouse.unpack_from(data, offset)
+            offset += _mouse.size
+        elif kind == WHEEL:
+            fields = _wheel.unpack_from(data, offset)
+            offset += _wheel.size
+        elif kind in (KEY_PRESS, KEY_RELEASE):
+            fields = _key.unpack_from(data, offset)
+            offset += _key.size
+            length = data[offset]
+            fields += (data[offset + 1:offset + 1 + length].decode(),)
+            offset += 1 + length
+        elif kind == ACTION:
+            length = data[offset]
+            fields = (data[offset + 1:offset + 1 + length].decode(),)
+            offset += 1 + length
+        else:
+            raise Exception('unknown record kind {}'.format(kind))
+        records.append((milliseconds, kind, fields))
+    return header, records
+
+
+class InputReplayer:
+    """Feeds a recording back into a window and times every event.
+
+    Each record is one frame: the time to dispatch it, including the
+    notifications and re-compositing it causes, and the time to repaint the canvas.
+    Actions that open a modal dialog would wait for input that never comes, they
+    are skipped with a warning.
+    """
+
+    DIALOG_ACTIONS = {
+        'open_file', 'import_image', 'compare_file', 'export_animation', 'record_input', 'canvas_size', 'shift',
+    }
+
+    def __init__(self, window, main_window=None):
+        self.window = window
+        self.main_window = main_window
+        self.frames = []
+        self.skipped_actions = []
+
+    def replay(self, records, realtime=False):
+        application = QtWidgets.QApplication.instance()
+        start = time.perf_counter()
+        for milliseconds, kind, fields in records:
+            if realtime:
+                while (time.perf_counter() - start) * 1000 < milliseconds:
+                    application.processEvents(QtCore.QEventLoop.AllEvents, 5)
+
+            dispatch_start = time.perf_counter()
+            self.dispatch(kind, fields)
+            application.processEvents()
+            paint_start = time.perf_counter()
+            self.window.canvas.repaint()
+            paint_end = time.perf_counter()
+            self.frames.append((milliseconds, kind, paint_start - dispatch_start, paint_end - paint_start))
+        return self.frames
+
+    def dispatch(self, kind, fields):
+        canvas = self.window.canvas
+        if kind == ACTION:
+            name = fields[0]
+            if name in self.DIALOG_ACTIONS:
+                self.skipped_actions.append(name)
+                print('skipping {}, it opens a dialog'.format(name), file=sys.stderr)
+                return
+            action = self.main_window._actions.get(name) if self.main_window else None
+            if action:
+                action.trigger()
+        elif kind == WHEEL:
+            x, y, delta_x, delta_y, modifiers = fields
+            position = QtCore.QPointF(x, y)
+            QtWidgets.QApplication.sendEvent(canvas, QtGui.QWheelEvent(
+                position, QtCore.QPointF(canvas.mapToGlobal(position)), QtCore.QPoint(), QtCore.QPoint(delta_x, delta_y),
+                QtCore.Qt.NoButton, QtCore.Qt.KeyboardModifier(modifiers), QtCore.Qt.NoScrollPhase, False,
+            ))
+        elif kind in (KEY_PRESS, KEY_RELEASE):
+            key, modifiers, auto_repeat, text = fields
+            target = QtWidgets.QApplication.focusWidget() or canvas
+            QtWidgets.QApplication.sendEvent(target, QtGui.QKeyEvent(
+                EVENT_TYPES[kind], key, QtCore.Qt.KeyboardModifier(modifiers), text, bool(auto_repeat),
+            ))
+        else:
+            x, y, button, buttons, modifiers = fields
+            position = QtCore.QPointF(x, y)
+            QtWidgets.QApplication.sendEvent(canvas, QtGui.QMouseEvent(
+                EVENT_TYPES[kind], position, QtCore.QPointF(canvas.mapToGlobal(position)),
+                QtCore.Qt.MouseButton(button), QtCore.Qt.MouseButton(buttons), QtCore.Qt.KeyboardModifier(modifiers),
+            ))
+
+    def summary(self):
+        def percentile(values, fraction):
+            return values[min(int(len(values) * fraction), len(values) - 1)] * 1000 if values else 0
+
+        summary = {'frames': len(self.frames), 'skipped_actions': self.skipped_actions}
+        for name, column in (('dispatch', 2), ('paint', 3)):
+            values = sorted(frame[column] for frame in self.frames)
+            summary[name] = {
+                'total_ms': sum(values) * 1000,
+                'p50_ms': percentile(values, 0.5),
+                'p95_ms': percentile(values, 0.95),
+                'max_ms': percentile(values, 1),
+            }
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay an input recording headlessly and report frame timings')
+    parser.add_argument('recording')
+    parser.add_argument('--document', help='document to replay on instead of the recorded one')
+    parser.add_argument('--realtime', action='store_true', help='keep the recorded pacing instead of replaying at full speed')
+    parser.add_argument('--json', help='write every frame timing to this file')
+    args = parser.parse_args()
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    application = QtWidgets.QApplication(sys.argv[:1])
+    application.setOrganizationName('draw')
+    application.setApplicationName('draw-replay')
+
+    from draw_document import DrawDocument
+    from draw_main_window import DrawMainWindow
+    from draw_window import DrawWindow
+
+    header, records = read_recording(args.recording)
+    main_window = DrawMainWindow()
+    main_window.show()
+    for window in main_window.mdi_area.subWindowList():
+        window.close()
+
+    window = DrawWindow(DrawDocument(args.document or header['document']))
+    main_window.mdi_area.addSubWindow(window)
+    window.show()
+    window.resize(*header['window_size'])
+    window.zoom_level = header['zoom_level']
+    window.update_canvas()
+    main_window.mdi_area.setActiveSubWindow(window)
+    window.canvas.setFocus()
+    application.processEvents()
+
+    replayer = InputReplayer(window, main_window)
+    replayer.replay(records, args.realtime)
+    summary = replayer.summary()
+    print(json.dumps(summary, indent=2))
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({
+                'summary': summary,
+                'frames': [
+                    {'time_ms': milliseconds, 'kind': kind, 'dispatch_ms': dispatch * 1000, 'paint_ms': paint * 1000}
+                    for milliseconds, kind, dispatch, paint in replayer.frames
+                ],
+            }, output, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from pixel_array import image_array
+
+
+MAGIC = b'DRAWLYR1'
+# the file is always mapped from offset 0, so tiles need page alignment only,
+# not the allocation granularity that pads them to 64 KB on Windows
+PAGE_SIZE = mmap.PAGESIZE
+
+
+def page_align(offset):
+    return -(-offset // PAGE_SIZE) * PAGE_SIZE
+
+
+class LayerCache:
+    """Decoded layer tiles of .pyxel files, stored raw so reopening skips PNG decoding.
+
+    Each document gets one sidecar file: a JSON header followed by every tile's
+    ARGB32 pixels at page-aligned offsets. Entries are only used while the
+    source file's modification time, size and zip member CRCs still match,
+    and are mapped copy-on-write, so editing a layer never touches the file.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(
+                QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.CacheLocation), 'layers'
+            )
+        self.directory = directory
+
+    def entry_path(self, path):
+        key = os.path.abspath(path)
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.layers')
+
+    @staticmethod
+    def source_key(draw_file):
+        stat = os.stat(draw_file.file_path)
+        return {
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'crcs': draw_file.crcs(),
+        }
+
+    def load(self, draw_file, tile_size):
+        """Tiles of every layer of `draw_file` as {key: QImage} dicts, or None on a miss"""
+        entry = self.entry_path(draw_file.file_path)
+        try:
+            with open(entry, 'rb') as cache_file:
+                if cache_file.read(len(MAGIC)) != MAGIC:
+                    return None
+                length, = struct.unpack('<I', cache_file.read(4))
+                header = json.loads(cache_file.read(length))
+                if header['source'] != self.source_key(draw_file) or header['tile_size'] != tile_size \
+                        or len(header['layers']) != draw_file.layer_count:
+                    return None
+                mapping = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # every QImage holds a reference to its slice, which keeps the mapping alive
+        buffer = memoryview(mapping)
+        layers = []
+        for tiles in header['layers']:
+            layer_tiles = {}
+            for tx, ty, offset, width, height in tiles:
+                layer_tiles[(tx, ty)] = QtGui.QImage(
+                    buffer[offset:offset + width * height * 4], width, height, width * 4, QtGui.QImage.Format_ARGB32
+                )
+            layers.append(layer_tiles)
+        return layers
+
+    def store(self, draw_file, tile_size, layers):
+        """Write the tiles of `layers`, a list of TiledImages, for the next load of `draw_file`"""
+        tiles = []
+        offset = 0
+        for tiled in layers:
+            layer_tiles = []
+            for key, tile in sorted(tiled.tiles.items()):
+                layer_tiles.append([key[0], key[1], offset, tile.width(), tile.height()])
+                offset = page_align(offset + tile.width() * tile.height() * 4)
+            tiles.append(layer_tiles)
+
+        # tile data starts on the first page after the header, whose length depends on the offsets
+        source = self.source_key(draw_file)
+        data_start = 0
+        while True:
+            header = json.dumps({'source': source, 'tile_size': tile_size, 'layers': [
+                [[tx, ty, offset + data_start, width, height] for tx, ty, offset, width, height in layer_tiles]
+                for layer_tiles in tiles
+            ]}).encode()
+            if len(MAGIC) + 4 + len(header) <= data_start:
+                break
+            data_start = page_align(len(MAGIC) + 4 + len(header))
+
+        os.makedirs(self.directory, exist_ok=True)
+        entry = self.entry_path(draw_file.file_path)
+        partial = entry + '.part'
+        with open(partial, 'wb') as cache_file:
+            cache_file.write(MAGIC + struct.pack('<I', len(header)) + header)
+            for tiled, layer_tiles in zip(layers, tiles):
+                for tx, ty, offset, width, height in layer_tiles:
+                    cache_file.seek(data_start + offset)
+                    cache_file.write(image_array(tiled.tiles[(tx, ty)]).tobytes())
+            cache_file.truncate(page_align(cache_file.tell()))
+        os.replace(partial, entry)
@@ -51,15 +51,22 @@ class LayerPanel(QWidget):
         print("LayerPanel document_changed")
 
         if self._document:
-            self._document.document_changed.disconnect(self.document_changed)
+            self._document.changed.disconnect(self.on_document_changed)
         if document:
             self._document = document
-            self._document.document_changed.connect(self.document_changed)
-            self._layer_list.set_layers(self._document.layers)
+            self._document.changed.connect(self.on_document_changed)
+            self._layer_list.set_layers(self._document.layer_tree())
         else:
             self._document = None
             self.clean_up()
 
+    def on_document_changed(self, document, changes):
+        groups_changed = changes.metadata - changes.layers()
+        if changes.structure or groups_changed:
+            self._layer_list.set_layers(document.layer_tree())
+        else:
+            self._layer_list.update_layers(changes.layers())
+
     def clean_up(self):
         self._layer_list.set_layers([])
 
@@ -90,6 +97,9 @@ class LayerPanel(QWidget):
         delete_action = self.toolbar.addAction(
             delete_icon, "delete", self.handle_delete
         )
+        group_action = self.toolbar.addAction("group", self.handle_group)
+        ungroup_action = self.toolbar.addAction("ungroup", self.handle_ungroup)
+        merge_down_action = self.toolbar.addAction("merge down", self.handle_merge_down)
 
     def handle_add(self):
         print(self.__class__.__name__ + '.handle_add')
@@ -98,6 +108,26 @@ class LayerPanel(QWidget):
     def handle_delete(self):
         pass
 
+    def handle_group(self):
+        layer = self._layer_list.current_layer
+        if self._document and layer:
+            self._document.group_layers([layer])
+
+    def handle_ungroup(self):
+        layer = self._layer_list.current_layer
+        if self._document and layer and layer.group:
+            self._document.ungroup(layer.group)
+
+    def handle_merge_down(self):
+        layer = self._layer_list.current_layer
+        index = self._document.layers.index(layer) if self._document and layer else -1
+        below = self._document.layers[index + 1] if 0 <= index < len(self._document.layers) - 1 else None
+        if below is not None and below.group is layer.group:
+            try:
+                self._document.merge_down(layer)
+            except Exception as error:
+                QMessageBox.information(self, 'Merge Down', str(error))
+
     def handle_enlarge(self):
         print(type(self).__name__, "handle_enlarge")
         size = self._layer_list.item_size + QSize(2, 2)
@@ -143,6 +173,7 @@ class LayerList(QScrollArea):
             item.widget().set_item_size(size)
 
     def set_layers(self, layers):
+        """Show a layer tree as returned by DrawDocument.layer_tree"""
         self._layers = layers
         self.update_list()
 
@@ -156,20 +187,43 @@ class LayerList(QScrollArea):
             item.setParent(None)
             item.deleteLater()
 
-        for layer_index, layer in enumerate(self._layers):
-            item = LayerListItem()
-            self._items_layout.addWidget(item)
-            item.set_layer(layer)
-            item.set_item_size(self.item_size)
-            item.focused.connect(self.item_received_focus)
+        self.add_items(self._layers, 0)
 
         self._current_item = None
 
         self.updateGeometry()
 
+    def update_layers(self, layers):
+        """Refresh the items of `layers` without rebuilding the list"""
+        for i in range(self._items_layout.count()):
+            item = self._items_layout.itemAt(i).widget()
+            if getattr(item, "layer", None) in layers:
+                item.set_layer(item.layer)
+
+    def add_items(self, nodes, depth):
+        for node in nodes:
+            if isinstance(node, tuple):
+                group, children = node
+                item = LayerGroupItem()
+                self._items_layout.addWidget(item)
+                item.set_group(group)
+                item.set_depth(depth)
+                if not group.collapsed:
+                    self.add_items(children, depth + 1)
+                continue
+
+            item = LayerListItem()
+            self._items_layout.addWidget(item)
+            item.set_layer(node)
+            item.set_depth(depth)
+            item.set_item_size(self.item_size)
+            item.focused.connect(self.item_received_focus)
+            if node is self.current_layer:
+                item.set_current(True)
+                self._current_item = item
+
     def item_received_focus(self, item):
-        index = self._layers.index(item.layer)
-        if index != -1:
+        if item.layer is not None:
             self.current_layer = item.layer
             if self._current_item:
                 self._current_item.set_current(False)
@@ -228,20 +282,39 @@ class LayerListItem(QFrame):
         self._visibility_button.setIconSize(QSize(16, 16))
         self.layout().addWidget(self._visibility_button)
 
+        self._solo_button = QToolButton()
+        self._solo_button.setText("S")
+        self._solo_button.setToolTip("Solo")
+        self._solo_button.setCheckable(True)
+        self._solo_button.toggled.connect(self.set_soloed)
+        self.layout().addWidget(self._solo_button)
+
+        self._mute_button = QToolButton()
+        self._mute_button.setText("M")
+        self._mute_button.setToolTip("Mute")
+        self._mute_button.setCheckable(True)
+        self._mute_button.toggled.connect(self.set_muted)
+        self.layout().addWidget(self._mute_button)
+
         self._name_text = TextEdit()
         self._name_text.editingFinished.connect(self.on_edit_layer_name)
         self.layout().addWidget(self._name_text, Qt.AlignCenter)
 
     def set_layer(self, layer):
         self.layer = layer
-        self._layer_view_label.set_image(self.layer.image)
+        self._layer_view_label.set_layer(self.layer)
         self._name_text.setText(self.layer.name)
         self.update_visibility_button()
+        self._solo_button.setChecked(self.layer.soloed)
+        self._mute_button.setChecked(self.layer.muted)
         self.updateGeometry()
 
     def focusInEvent(self, event: QFocusEvent):
         self.focused.emit(self)
 
+    def set_depth(self, depth):
+        self.layout().setContentsMargins(depth * 12, 0, 0, 0)
+
     def set_item_size(self, size):
         print(type(self).__name__, "set_item_size")
         self._layer_view_label.max_size = size
@@ -260,6 +333,16 @@ class LayerListItem(QFrame):
         self.layer.propagate_changes()
         self.update_visibility_button()
 
+    def set_soloed(self, soloed):
+        if self.layer and self.layer.soloed != soloed:
+            self.layer.soloed = soloed
+            self.layer.propagate_changes()
+
+    def set_muted(self, muted):
+        if self.layer and self.layer.muted != muted:
+            self.layer.muted = muted
+            self.layer.propagate_changes()
+
     def update_visibility_button(self):
         if not self.layer.hidden:
             self._visibility_button.setIcon(nearest_icon(":/icons/layer_icons_eye_open"))
@@ -274,28 +357,87 @@ class LayerListItem(QFrame):
             self.layer.propagate_changes()
 
 
+class LayerGroupItem(QFrame):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+        self.group = None
+        self.setContentsMargins(0, 0, 0, 0)
+        self.setBackgroundRole(QPalette.Window)
+        self.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Fixed)
+
+        self.setLayout(QHBoxLayout())
+        self.layout().setContentsMargins(0, 0, 0, 0)
+
+        self._collapse_button = QToolButton()
+        self._collapse_button.setAutoRaise(True)
+        self._collapse_button.clicked.connect(self.toggle_collapsed)
+        self.layout().addWidget(self._collapse_button)
+
+        self._visibility_button = QToolButton()
+        self._visibility_button.clicked.connect(self.toggle_visible)
+        self._visibility_button.setIconSize(QSize(16, 16))
+        self.layout().addWidget(self._visibility_button)
+
+        self._name_text = TextEdit()
+        self._name_text.editingFinished.connect(self.on_edit_group_name)
+        self.layout().addWidget(self._name_text, Qt.AlignCenter)
+
+    def set_group(self, group):
+        self.group = group
+        self._name_text.setText(group.name)
+        self._collapse_button.setArrowType(Qt.RightArrow if group.collapsed else Qt.DownArrow)
+        if not group.hidden:
+            self._visibility_button.setIcon(nearest_icon(":/icons/layer_icons_eye_open"))
+        else:
+            self._visibility_button.setIcon(nearest_icon(":/icons/layer_icons_eye_closed"))
+
+    def set_depth(self, depth):
+        self.layout().setContentsMargins(depth * 12, 0, 0, 0)
+
+    def toggle_collapsed(self):
+        self.group.collapsed = not self.group.collapsed
+        self.group.propagate_changes()
+
+    def toggle_visible(self):
+        self.group.hidden = not self.group.hidden
+        self.group.propagate_changes()
+
+    def on_edit_group_name(self):
+        new_name = self._name_text.text()
+
+        if new_name != "":
+            self.group.name = new_name
+            self.group.propagate_changes()
+
+
 class LayerImageView(QWidget):
     def __init__(self, *args):
         super().__init__(*args)
 
         self.setAutoFillBackground(True)
-        self._image = QImage()
+        self._layer = None
         self.max_size = QSize(128, 128)
 
-    def set_image(self, image):
-        self._image = image
+    def set_layer(self, layer):
+        self._layer = layer
         self.update_size()
+        self.update()
 
     def update_size(self):
-        if self._image:
+        if self._layer:
             new_size = (
-                self._image.rect().size().scaled(self.max_size, Qt.KeepAspectRatio)
+                self._layer.rect().size().scaled(self.max_size, Qt.KeepAspectRatio)
             )
             self.setFixedSize(new_size)
 
     def paintEvent(self, event: QPaintEvent):
+        if not self._layer:
+            return
+        # thumbnails are sampled from the layer tiles at device resolution
+        size = self.contentsRect().size() * self.devicePixelRatioF()
         painter = QPainter(self)
-        painter.drawImage(self.contentsRect(), self._image)
+        painter.drawImage(self.contentsRect(), self._layer.thumbnail(size))
         painter.end()
 
 
@@ -0,0 +1,73 @@
+import itertools
+
+from PySide6 import QtCore
+
+
+class MemoryBudget(QtCore.QObject):
+    """Keeps the pixel memory of the windows in an MDI area under a budget.
+
+    Decoded layers, composites, mip levels, pixmaps and render caches are
+    counted per window. While they add up to more than `budget_bytes`, the
+    least recently activated windows are hibernated: their layers are kept
+    zlib compressed and everything rendered from them is dropped. Activating a
+    window decodes it again.
+    """
+    usage_changed = QtCore.Signal((QtCore.QObject,))
+
+    def __init__(self, mdi_area, budget_bytes):
+        super().__init__()
+        self.mdi_area = mdi_area
+        self.budget_bytes = budget_bytes
+        self._activations = {}
+        self._counter = itertools.count()
+        self._usage = {}
+
+        # edits grow documents a little at a time, recount once they settle
+        self._update_timer = QtCore.QTimer(self)
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(1000)
+        self._update_timer.timeout.connect(self.update)
+
+    def activate(self, window):
+        """Decode `window` if it was hibernated and count it as the most recently used"""
+        if window not in self._activations:
+            window.document.changed.connect(self.schedule_update)
+        self._activations[window] = next(self._counter)
+        window.wake()
+        self.update()
+
+    def schedule_update(self, *args):
+        self._update_timer.start()
+
+    def usage(self):
+        """{window: memory_usage()} as of the last update"""
+        return self._usage
+
+    def decoded_bytes(self):
+        return sum(usage['layers'] + usage['composite'] + usage['cache'] for usage in self._usage.values())
+
+    def compressed_bytes(self):
+        return sum(usage['compressed'] for usage in self._usage.values())
+
+    def hibernated_windows(self):
+        return [window for window in self._usage if window.hibernated]
+
+    def update(self):
+        """Hibernate windows, least recently activated first, until the rest fit the budget"""
+        windows = self.mdi_area.subWindowList()
+        self._activations = {window: order for window, order in self._activations.items() if window in windows}
+        self._usage = {window: window.memory_usage() for window in windows}
+
+        active = self.mdi_area.activeSubWindow()
+        total = self.decoded_bytes()
+        for window in sorted(windows, key=lambda window: self._activations.get(window, -1)):
+            if total <= self.budget_bytes:
+                break
+            if window is active or window.hibernated:
+                continue
+            window.hibernate()
+            usage = window.memory_usage()
+            total -= sum(self._usage[window][name] - usage[name] for name in ('layers', 'composite', 'cache'))
+            self._usage[window] = usage
+
+        self.usage_changed.emit(self)
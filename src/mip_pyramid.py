@@ -0,0 +1,72 @@
+import math
+
+import numpy as np
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from pixel_array import image_array
+
+
+def downsample(pixels):
+    """Average 2x2 blocks of a (height, width) uint32 array of premultiplied pixels"""
+    height, width = pixels.shape
+    if height % 2 or width % 2:
+        pixels = np.pad(pixels, ((0, height % 2), (0, width % 2)), mode='edge')
+    channels = pixels.view(np.uint8).reshape(pixels.shape[0], pixels.shape[1], 4)
+    blocks = channels[0::2, 0::2].astype(np.uint16)
+    blocks += channels[1::2, 0::2]
+    blocks += channels[0::2, 1::2]
+    blocks += channels[1::2, 1::2]
+    blocks += 2
+    blocks >>= 2
+    return np.ascontiguousarray(blocks.astype(np.uint8)).view(np.uint32)[..., 0]
+
+
+class MipPyramid:
+    """Successive half-size copies of the composite for zoomed-out views.
+
+    Level 0 is the composite itself, every further level is a 2x2 box filtered
+    copy of the one above, kept up to date from dirty rects.
+    """
+
+    def __init__(self, levels=3):
+        self.levels = levels
+        self.images = []
+        self.pixmaps = []
+
+    def rebuild(self, image):
+        self.images = [image]
+        self.pixmaps = [None]
+        for level in range(1, self.levels + 1):
+            pixels = downsample(image_array(self.images[-1]))
+            level_image = QtGui.QImage(pixels.shape[1], pixels.shape[0], QtGui.QImage.Format_ARGB32_Premultiplied)
+            image_array(level_image)[:] = pixels
+            self.images.append(level_image)
+            self.pixmaps.append(QtGui.QPixmap.fromImage(level_image))
+
+    def update_rect(self, rect):
+        """Refresh the part of every level covering `rect` of the composite"""
+        for level in range(1, len(self.images)):
+            source = self.images[level - 1]
+            left, top = rect.left() // 2, rect.top() // 2
+            right = min((rect.right() + 2) // 2, self.images[level].width())
+            bottom = min((rect.bottom() + 2) // 2, self.images[level].height())
+            rect = QtCore.QRect(left, top, right - left, bottom - top)
+            if rect.isEmpty():
+                return
+
+            block = image_array(source)[top * 2:bottom * 2, left * 2:right * 2]
+            pixels = downsample(block)
+            image_array(self.images[level])[top:bottom, left:right] = pixels[:bottom - top, :right - left]
+
+            painter = QtGui.QPainter(self.pixmaps[level])
+            painter.setCompositionMode(QtGui.QPainter.CompositionMode_Source)
+            painter.drawImage(rect.topLeft(), self.images[level], rect)
+            painter.end()
+
+    def level_for_scale(self, scale):
+        """Finest level that is not shrunk further than `scale` (device pixels per canvas pixel)"""
+        if scale >= 1 or not self.images:
+            return 0
+        return min(int(math.floor(-math.log2(scale) + 1e-9)), len(self.images) - 1)
@@ -0,0 +1,106 @@
+from PySide6 import QtCore
+from PySide6 import QtGui
+from PySide6 import QtWidgets
+
+
+class NavigatorPanel(QtWidgets.QWidget):
+    """Downscaled view of the active document with the visible area outlined.
+
+    The picture comes from the window's mip pyramid, and only the parts of it
+    covered by composite updates are repainted. Click or drag to pan.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+
+        self._window = None
+        self.setMinimumSize(QtCore.QSize(96, 96))
+        self.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
+        self.setCursor(QtCore.Qt.CrossCursor)
+
+    def set_window(self, window):
+        if window is self._window:
+            return
+        if self._window:
+            self._window.composite_changed.disconnect(self.on_composite_changed)
+            self._window.viewport_changed.disconnect(self.on_viewport_changed)
+            self._window.closed.disconnect(self.on_window_closed)
+        self._window = window
+        if window:
+            window.composite_changed.connect(self.on_composite_changed)
+            window.viewport_changed.connect(self.on_viewport_changed)
+            window.closed.connect(self.on_window_closed)
+        self.update()
+
+    def on_window_closed(self, window):
+        self.set_window(None)
+
+    def sizeHint(self):
+        return QtCore.QSize(160, 120)
+
+    def document_rect(self):
+        """Where the document is drawn, fitted to the panel"""
+        if not self._window or self._window.canvas_size.isEmpty():
+            return QtCore.QRectF()
+        size = QtCore.QSizeF(self._window.canvas_size).scaled(QtCore.QSizeF(self.size()), QtCore.Qt.KeepAspectRatio)
+        top_left = QtCore.QPointF((self.width() - size.width())/2, (self.height() - size.height())/2)
+        return QtCore.QRectF(top_left, size)
+
+    def map_from_canvas(self, rect):
+        target = self.document_rect()
+        scale = target.width()/self._window.canvas_size.width()
+        return QtCore.QRectF(
+            target.x() + rect.x()*scale, target.y() + rect.y()*scale, rect.width()*scale, rect.height()*scale
+        )
+
+    def map_to_canvas(self, point):
+        target = self.document_rect()
+        scale = self._window.canvas_size.width()/target.width()
+        return QtCore.QPointF((point.x() - target.x())*scale, (point.y() - target.y())*scale)
+
+    def on_composite_changed(self, window, rect):
+        self.update(self.map_from_canvas(QtCore.QRectF(rect)).toAlignedRect().adjusted(-1, -1, 1, 1))
+
+    def on_viewport_changed(self, window):
+        self.update()
+
+    def source_pixmap(self):
+        """Smallest pyramid level that still has at least one pixel per panel pixel"""
+        mips = self._window.mips
+        if not mips.images:
+            return None
+        scale = self.document_rect().width()*self.devicePixelRatioF()/self._window.canvas_size.width()
+        return mips.pixmaps[mips.level_for_scale(scale)] or self._window.canvas.pixmap()
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), self.palette().color(QtGui.QPalette.Dark))
+
+        pixmap = self.source_pixmap() if self._window else None
+        if pixmap is None or pixmap.isNull():
+            painter.end()
+            return
+
+        target = self.document_rect()
+        bg_texture = QtGui.QPixmap(':/textures/bg.png')
+        painter.fillRect(target, QtGui.QBrush(bg_texture))
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
+        painter.drawPixmap(target, pixmap, QtCore.QRectF(pixmap.rect()))
+
+        pen = QtGui.QPen(QtGui.QColor('red'))
+        pen.setWidth(0)
+        painter.setPen(pen)
+        painter.setBrush(QtCore.Qt.NoBrush)
+        painter.drawRect(self.map_from_canvas(self._window.visible_canvas_rect()))
+        painter.end()
+
+    def mousePressEvent(self, event):
+        self.pan_to(event.position())
+
+    def mouseMoveEvent(self, event):
+        if event.buttons() & QtCore.Qt.LeftButton:
+            self.pan_to(event.position())
+
+    def pan_to(self, position):
+        if self._window and not self.document_rect().isEmpty():
+            self._window.center_at_pixel(self.map_to_canvas(position))
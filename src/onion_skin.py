@@ -0,0 +1,107 @@
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from document_renderer import DocumentRenderer
+
+
+class OnionSkin:
+    """Ghosts of the frames around the current animation frame.
+
+    The tinted composite of each neighbor frame is cached until a pixel edit
+    touches that frame or the layer stack changes, so moving through frames and
+    painting the current frame never re-composites the neighbors.
+    """
+
+    PREVIOUS_TINT = QtGui.QColor(255, 48, 48)
+    NEXT_TINT = QtGui.QColor(48, 128, 255)
+    TINT_STRENGTH = 0.5
+
+    def __init__(self, document, frames=1, opacity=0.4):
+        self.document = document
+        self.frames = frames
+        self.opacity = opacity
+        self.enabled = False
+
+        self._ghosts = {}
+        self._underlay = None
+        self._underlay_key = None
+        self._composition_key = None
+
+        document.pixels_changed.connect(self.invalidate_rect)
+
+    def invalidate(self):
+        self._ghosts.clear()
+        self._underlay = None
+
+    def invalidate_rect(self, layer, rect):
+        for key in list(self._ghosts):
+            if self.document.tile_rect(key[0]).intersects(rect):
+                del self._ghosts[key]
+                self._underlay = None
+
+    def neighbors(self, animation, frame):
+        """(tile, tint, opacity) for every ghosted frame, farthest first"""
+        neighbors = []
+        for distance in reversed(range(1, self.frames + 1)):
+            opacity = self.opacity * (1 - (distance - 1) / self.frames)
+            if frame - distance >= 0:
+                neighbors.append((animation.frame_tile(frame - distance), self.PREVIOUS_TINT, opacity))
+            if frame + distance < animation.length:
+                neighbors.append((animation.frame_tile(frame + distance), self.NEXT_TINT, opacity))
+        return neighbors
+
+    def ghost(self, tile, tint):
+        key = (tile, tint.rgb())
+        ghost = self._ghosts.get(key)
+        if ghost is None:
+            ghost = DocumentRenderer(self.document).render(self.document.tile_rect(tile))
+            painter = QtGui.QPainter(ghost)
+            painter.setCompositionMode(QtGui.QPainter.CompositionMode_SourceAtop)
+            painter.setOpacity(self.TINT_STRENGTH)
+            painter.fillRect(ghost.rect(), tint)
+            painter.end()
+            self._ghosts[key] = ghost
+        return ghost
+
+    def underlay(self, animation, frame):
+        composition_key = DocumentRenderer.composition_key(self.document)
+        if composition_key != self._composition_key:
+            self._composition_key = composition_key
+            self.invalidate()
+
+        key = (id(animation), frame, self.frames, self.opacity)
+        if self._underlay is None or self._underlay_key != key:
+            underlay = QtGui.QImage(self.document.tile_size, QtGui.QImage.Format_ARGB32_Premultiplied)
+            underlay.fill(QtCore.Qt.transparent)
+            painter = QtGui.QPainter(underlay)
+            for tile, tint, opacity in self.neighbors(animation, frame):
+                painter.setOpacity(opacity)
+                painter.drawImage(QtCore.QPoint(0, 0), self.ghost(tile, tint))
+            painter.end()
+            self._underlay = underlay
+            self._underlay_key = key
+        return self._underlay
+
+    def apply(self, image, animation, frame, rect=None):
+        """Blend the ghosts under the current frame's pixels of a composite.
+
+        `image` is a composite of the canvas area `rect` (default: the whole canvas).
+        """
+        if not self.enabled or animation is None:
+            return
+
+        rect = QtCore.QRect(QtCore.QPoint(0, 0), self.document.size) if rect is None else rect
+        frame_rect = self.document.tile_rect(animation.frame_tile(frame))
+        region = frame_rect.intersected(rect)
+        if region.isEmpty():
+            return
+
+        underlay = self.underlay(animation, frame)
+        painter = QtGui.QPainter(image)
+        painter.setCompositionMode(QtGui.QPainter.CompositionMode_DestinationOver)
+        painter.drawImage(
+            region.topLeft() - rect.topLeft(),
+            underlay,
+            region.translated(-frame_rect.topLeft()),
+        )
+        painter.end()
@@ -0,0 +1,69 @@
+import numpy as np
+
+from PySide6 import QtGui
+
+
+def color_value(name):
+    """ARGB value of a palette color name such as 'ff1a1c2c'"""
+    return int(name, 16) & 0xffffffff
+
+
+def color_name(value):
+    return '{:08x}'.format(int(value) & 0xffffffff)
+
+
+def normalize_color(color):
+    if color is None:
+        return None
+    if isinstance(color, QtGui.QColor):
+        return color_name(color.rgba())
+    if isinstance(color, str):
+        return color_name(color_value(color.lstrip('#')))
+    return color_name(color)
+
+
+def remap_colors(array, source, target):
+    """Replace every pixel equal to source[i] with target[i], in place, in one pass.
+
+    The mapping is applied simultaneously, so swaps and chains (a -> b, b -> a) work.
+    """
+    if len(source) == 0 or array.size == 0:
+        return 0
+
+    source = np.asarray(source, dtype=np.uint32)
+    target = np.asarray(target, dtype=np.uint32)
+    order = np.argsort(source)
+    source = source[order]
+    target = target[order]
+
+    index = np.searchsorted(source, array)
+    np.minimum(index, len(source) - 1, out=index)
+    hit = source[index] == array
+    array[hit] = target[index[hit]]
+
+    return int(np.count_nonzero(hit))
+
+
+def hue_sort_key(name):
+    color = QtGui.QColor('#' + name)
+    hue, saturation, lightness, alpha = color.getHsl()
+    # achromatic colors report a hue of -1, keep them together in front
+    return (hue, lightness, saturation, -alpha)
+
+
+def sorted_palette(palette, key=hue_sort_key):
+    colors = [color for color in palette if color is not None]
+    empty = len(palette) - len(colors)
+    return sorted(colors, key=key) + [None] * empty
+
+
+def deduplicated_palette(palette):
+    seen = set()
+    result = []
+    for color in palette:
+        if color is not None:
+            if color in seen:
+                continue
+            seen.add(color)
+        result.append(color)
+    return result + [None] * (len(palette) - len(result))
@@ -19,6 +19,7 @@ class PalettePanel(QtWidgets.QWidget):
         super().__init__(*args, **kwargs)
 
         self.palette = []
+        self._document = None
         self._width = 10
         self._height = 10
         self._item_size = QtCore.QSize(10, 10)
@@ -124,21 +125,58 @@ class PalettePanel(QtWidgets.QWidget):
             leftover.hide()
             leftover.deleteLater()
 
+        self.update_usage()
+
         self.item_container.updateGeometry()
         self.updateGeometry()
         self.parent().updateGeometry()
 
+    def update_usage(self, *args):
+        if not self._document:
+            return
+
+        usage = self._document.color_usage
+        counts = usage.counts()
+        layout = self.item_container.layout()
+
+        for i, color in enumerate(self.palette):
+            item = layout.itemAt(i)
+            if not item:
+                break
+            palette_item = item.widget()
+            if color:
+                count = counts.get(color, 0)
+                layer_count = len(usage.layer_counts(color)) if count else 0
+                palette_item.usage = count
+                palette_item.setToolTip('#{}\n{} px in {} layers'.format(color, count, layer_count))
+            else:
+                palette_item.usage = None
+                palette_item.setToolTip('')
+
     @QtCore.Slot(DrawDocument)
     def document_changed(self, document):
+        if document is not self._document:
+            if self._document:
+                self._document.changed.disconnect(self.on_document_changed)
+                self._document.color_usage.usage_changed.disconnect(self.update_usage)
+            self._document = document
+            if document:
+                document.changed.connect(self.on_document_changed)
+                document.color_usage.usage_changed.connect(self.update_usage)
         if document:
             self.set_palette(document)
 
+    def on_document_changed(self, document, changes):
+        if changes.palette:
+            self.set_palette(document)
+
 
 class PaletteItem(QtWidgets.QWidget):
     def __init__(self, *args, color=QtCore.Qt.GlobalColor.white, size=QtCore.QSize(10, 10)):
         super().__init__(*args)
         self._color = color
         self._size = size
+        self._usage = None
         self.setSizePolicy(QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Minimum)
         self.setFixedSize(self._size)
         self.setContentsMargins(0, 0, 0, 0)
@@ -152,6 +190,16 @@ class PaletteItem(QtWidgets.QWidget):
         self._color = color
         self.update()
 
+    @property
+    def usage(self):
+        return self._usage
+
+    @usage.setter
+    def usage(self, usage):
+        if usage != self._usage:
+            self._usage = usage
+            self.update()
+
     def sizeHint(self):
         return self._size
 
@@ -163,6 +211,10 @@ class PaletteItem(QtWidgets.QWidget):
         painter = QtGui.QPainter(self)
         if self.color:
             painter.fillRect(cr, self.color)
+            if self.usage == 0:
+                # mark colors no layer uses
+                painter.setPen(QtGui.QColor('white') if self.color.lightness() < 128 else QtGui.QColor('black'))
+                painter.drawLine(cr.topRight(), cr.bottomLeft())
         else:
             painter.drawRect(self.rect())
 
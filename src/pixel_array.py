@@ -0,0 +1,56 @@
+import numpy as np
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+
+ARRAY_FORMATS = (
+    QtGui.QImage.Format_ARGB32,
+    QtGui.QImage.Format_ARGB32_Premultiplied,
+    QtGui.QImage.Format_RGB32,
+)
+
+
+class _ImageBuffer:
+    """Array interface that keeps the QImage owning the pixels alive"""
+
+    def __init__(self, image, array):
+        self.image = image
+        self.array = array
+        self.__array_interface__ = array.__array_interface__
+
+
+def image_array(image):
+    """View the pixels of a 32-bit QImage as a writable (height, width) uint32 array.
+
+    The view shares memory with the image and keeps it alive.
+    """
+    if image.format() not in ARRAY_FORMATS:
+        raise Exception('unsupported image format {}'.format(image.format()))
+
+    width, height = image.width(), image.height()
+    if width == 0 or height == 0:
+        return np.zeros((height, width), dtype=np.uint32)
+
+    array = np.frombuffer(image.bits(), dtype=np.uint32)
+    array = np.asarray(_ImageBuffer(image, array.reshape(height, image.bytesPerLine() // 4)))
+    return array[:, :width]
+
+
+def array_image(array, image_format=QtGui.QImage.Format_ARGB32):
+    """Copy a (height, width) uint32 array into a new QImage"""
+    array = np.ascontiguousarray(array, dtype=np.uint32)
+    height, width = array.shape
+    image = QtGui.QImage(array.data, width, height, width * 4, image_format)
+    return image.copy()
+
+
+def mask_bounds(mask):
+    """QRect around the True entries of a 2D boolean array, empty when there are none"""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return QtCore.QRect()
+    columns = np.flatnonzero(mask.any(axis=0))
+    return QtCore.QRect(
+        int(columns[0]), int(rows[0]), int(columns[-1] - columns[0] + 1), int(rows[-1] - rows[0] + 1)
+    )
@@ -0,0 +1,347 @@
+"""Pixel diff between two revisions of a .pyxel file.
+
+Layers are paired by name, falling back to their position for renamed or
+duplicate names. Layer PNGs whose zip CRCs match are known to be identical
+and never decoded; the others are compared pixel by pixel.
+
+    python src/pyxel_diff.py old.pyxel new.pyxel [--json diff.json] [--highlight diff.png] [--side-by-side]
+
+Exits with status 1 when the files differ, like diff(1).
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from draw_file import DrawFile
+from pixel_array import image_array, array_image, mask_bounds
+
+
+LAYER_PROPERTIES = ('hidden', 'soloed', 'muted', 'blendMode', 'alpha')
+
+HIGHLIGHT_COLOR = np.array([0, 255, 0])
+BOX_COLOR = QtGui.QColor(255, 0, 0)
+
+
+def pair_layers(old_names, new_names):
+    """(old index, new index) pairs, with None on the side a layer is missing from.
+
+    Names that are unique in both files pair up first; the remaining layers pair
+    in order, so a renamed layer still lines up with its previous revision.
+    """
+    def unique(names):
+        return {name for name in names if names.count(name) == 1}
+
+    shared = unique(old_names) & unique(new_names)
+    pairs = [(old_names.index(name), new_names.index(name)) for name in shared]
+    old_rest = [index for index, name in enumerate(old_names) if name not in shared]
+    new_rest = [index for index, name in enumerate(new_names) if name not in shared]
+    pairs += zip(old_rest, new_rest)
+    pairs += [(None, index) for index in new_rest[len(old_rest):]]
+    pairs += [(index, None) for index in old_rest[len(new_rest):]]
+    return sorted(pairs, key=lambda pair: (pair[1] is None, pair[1] if pair[1] is not None else pair[0]))
+
+
+def layer_pixels(draw_file, index, size):
+    """ARGB32 pixels of a layer as a (height, width) uint32 array, padded to `size`.
+
+    Fully transparent pixels are zeroed so that invisible color changes do not count.
+    """
+    pixels = np.zeros((size.height(), size.width()), dtype=np.uint32)
+    if index is None:
+        return pixels
+    with draw_file.get_layer_image_stream(index) as stream:
+        image = QtGui.QImage.fromData(QtCore.QByteArray(stream.read()))
+    data = image_array(image.convertToFormat(QtGui.QImage.Format_ARGB32))
+    height, width = min(data.shape[0], size.height()), min(data.shape[1], size.width())
+    pixels[:height, :width] = data[:height, :width]
+    pixels[(pixels >> 24) == 0] = 0
+    return pixels
+
+
+class LayerDiff:
+    """How one layer changed; `mask` is None when no pixel did"""
+
+    def __init__(self, name, old_index, new_index):
+        self.name = name
+        self.old_index = old_index
+        self.new_index = new_index
+        self.properties = {}
+        self.identical = False
+        self.mask = None
+        self.changed_pixels = 0
+        self.bounds = QtCore.QRect()
+
+    @property
+    def status(self):
+        if self.old_index is None:
+            return 'added'
+        if self.new_index is None:
+            return 'removed'
+        if self.mask is not None or self.properties:
+            return 'changed'
+        return 'unchanged'
+
+    def set_pixels(self, old, new):
+        mask = old != new
+        self.changed_pixels = int(np.count_nonzero(mask))
+        if self.changed_pixels:
+            self.mask = mask
+            self.bounds = mask_bounds(mask)
+
+    def to_json(self):
+        bounds = self.bounds
+        return {
+            'name': self.name,
+            'status': self.status,
+            'old_index': self.old_index,
+            'new_index': self.new_index,
+            'identical_data': self.identical,
+            'properties': {name: {'old': old, 'new': new} for name, (old, new) in self.properties.items()},
+            'changed_pixels': self.changed_pixels,
+            'bounds': [bounds.x(), bounds.y(), bounds.width(), bounds.height()] if not bounds.isEmpty() else None,
+        }
+
+
+class DocumentDiff:
+    """Differences between two DrawFiles, compared over the union of their canvases"""
+
+    def __init__(self, old_file, new_file):
+        self.old_file = old_file
+        self.new_file = new_file
+        self.size = QtCore.QSize(max(old_file.width, new_file.width), max(old_file.height, new_file.height))
+        self.properties = {}
+        self.palette = {}
+        self.animations = {}
+        self.layers = []
+        self._mask = None
+
+    @property
+    def old_path(self):
+        return self.old_file.file_path
+
+    @property
+    def new_path(self):
+        return self.new_file.file_path
+
+    def changed(self):
+        return bool(self.properties or self.palette or self.animations
+                    or any(layer.status != 'unchanged' for layer in self.layers))
+
+    def changed_layers(self):
+        return [layer for layer in self.layers if layer.mask is not None]
+
+    def mask(self):
+        """Pixels that changed in any layer"""
+        if self._mask is None:
+            self._mask = np.zeros((self.size.height(), self.size.width()), dtype=bool)
+            for layer in self.changed_layers():
+                self._mask |= layer.mask
+        return self._mask
+
+    def to_json(self):
+        return {
+            'old': self.old_path,
+            'new': self.new_path,
+            'changed': self.changed(),
+            'properties': {name: {'old': old, 'new': new} for name, (old, new) in self.properties.items()},
+            'palette': self.palette,
+            'animations': self.animations,
+            'layers': [layer.to_json() for layer in self.layers],
+        }
+
+
+def document_properties(draw_file):
+    return {
+        'name': draw_file.name,
+        'width': draw_file.width,
+        'height': draw_file.height,
+        'tileWidth': draw_file.tile_width,
+        'tileHeight': draw_file.tile_height,
+        'paletteWidth': draw_file.palette_width,
+    }
+
+
+def diff_palettes(old, new):
+    differences = {}
+    added = [color for color in new if color not in old]
+    removed = [color for color in old if color not in new]
+    if added:
+        differences['added'] = added
+    if removed:
+        differences['removed'] = removed
+    if not added and not removed and old != new:
+        differences['reordered'] = True
+    return differences
+
+
+def diff_animations(old, new):
+    old_by_name = {animation.get('name'): animation for animation in old}
+    new_by_name = {animation.get('name'): animation for animation in new}
+    differences = {}
+    for name in old_by_name.keys() | new_by_name.keys():
+        if name not in new_by_name:
+            differences[name] = 'removed'
+        elif name not in old_by_name:
+            differences[name] = 'added'
+        elif old_by_name[name] != new_by_name[name]:
+            differences[name] = 'changed'
+    return differences
+
+
+def diff_files(old_path, new_path):
+    old_file = DrawFile.from_path(old_path)
+    new_file = DrawFile.from_path(new_path)
+    diff = DocumentDiff(old_file, new_file)
+
+    old_properties = document_properties(old_file)
+    new_properties = document_properties(new_file)
+    diff.properties = {
+        name: (old_properties[name], new_properties[name])
+        for name in old_properties if old_properties[name] != new_properties[name]
+    }
+    diff.palette = diff_palettes(old_file.palette, new_file.palette)
+    diff.animations = diff_animations(old_file.animations, new_file.animations)
+
+    old_crcs = old_file.crcs()
+    new_crcs = new_file.crcs()
+    old_names = [data['name'] for data in old_file.layers]
+    new_names = [data['name'] for data in new_file.layers]
+
+    to_decode = []
+    for old_index, new_index in pair_layers(old_names, new_names):
+        layer = LayerDiff(new_names[new_index] if new_index is not None else old_names[old_index], old_index, new_index)
+        if old_index is not None and new_index is not None:
+            old_data = old_file.get_layer_data(old_index)
+            new_data = new_file.get_layer_data(new_index)
+            for name in ('name',) + LAYER_PROPERTIES:
+                if old_data.get(name) != new_data.get(name):
+                    layer.properties[name] = (old_data.get(name), new_data.get(name))
+            layer.identical = \
+                old_crcs['layer{}.png'.format(old_index)] == new_crcs['layer{}.png'.format(new_index)]
+        if not layer.identical:
+            to_decode.append(layer)
+        diff.layers.append(layer)
+
+    def compare(layer):
+        layer.set_pixels(
+            layer_pixels(old_file, layer.old_index, diff.size), layer_pixels(new_file, layer.new_index, diff.size)
+        )
+
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(compare, to_decode))
+    return diff
+
+
+def flatten(image, size):
+    """`image` over white as a (height, width, 3) float array of `size`"""
+    canvas = QtGui.QImage(size, QtGui.QImage.Format_ARGB32)
+    canvas.fill(QtCore.Qt.white)
+    painter = QtGui.QPainter(canvas)
+    painter.drawImage(0, 0, image)
+    painter.end()
+    pixels = image_array(canvas)
+    return np.stack([(pixels >> shift) & 0xff for shift in (16, 8, 0)], axis=2).astype(np.float32)
+
+
+def to_image(rgb):
+    rgb = np.rint(rgb).astype(np.uint32)
+    return array_image(np.uint32(0xff000000) | rgb[..., 0] << 16 | rgb[..., 1] << 8 | rgb[..., 2])
+
+
+def draw_boxes(image, boxes, offset=QtCore.QPoint()):
+    painter = QtGui.QPainter(image)
+    painter.setPen(BOX_COLOR)
+    for box in boxes:
+        painter.drawRect(box.translated(offset).adjusted(-1, -1, 0, 0))
+    painter.end()
+
+
+def highlight_image(composite, mask, boxes=()):
+    """`composite` faded, with the pixels of `mask` tinted and `boxes` outlined"""
+    rgb = flatten(composite, QtCore.QSize(mask.shape[1], mask.shape[0]))
+    highlighted = np.where(mask[..., None], rgb * 0.5 + HIGHLIGHT_COLOR * 0.5, rgb * 0.35 + 192 * 0.65)
+    image = to_image(highlighted)
+    draw_boxes(image, boxes)
+    return image
+
+
+def side_by_side_image(old_composite, new_composite, size, boxes=(), gap=8):
+    """Both revisions next to each other over `size` canvases, with `boxes` outlined in each"""
+    image = QtGui.QImage(size.width() * 2 + gap, size.height(), QtGui.QImage.Format_ARGB32)
+    image.fill(QtGui.QColor(128, 128, 128))
+    painter = QtGui.QPainter(image)
+    for x, composite in ((0, old_composite), (size.width() + gap, new_composite)):
+        painter.drawImage(x, 0, to_image(flatten(composite, size)))
+    painter.end()
+    draw_boxes(image, boxes)
+    draw_boxes(image, boxes, QtCore.QPoint(size.width() + gap, 0))
+    return image
+
+
+def render_file(path):
+    from draw_document import DrawDocument
+    from document_renderer import DocumentRenderer
+    return DocumentRenderer(DrawDocument(path)).render(parallel=True)
+
+
+def print_summary(diff):
+    for name, (old, new) in diff.properties.items():
+        print('document {}: {!r} -> {!r}'.format(name, old, new))
+    for kind, colors in diff.palette.items():
+        print('palette {}: {}'.format(kind, colors if colors is not True else ''))
+    for name, status in sorted(diff.animations.items()):
+        print('animation {}: {}'.format(name, status))
+    for layer in diff.layers:
+        if layer.status == 'unchanged':
+            continue
+        details = ['{} {!r} -> {!r}'.format(name, old, new) for name, (old, new) in layer.properties.items()]
+        if layer.changed_pixels:
+            bounds = layer.bounds
+            details.append('{} pixels in {}x{}+{}+{}'.format(
+                layer.changed_pixels, bounds.width(), bounds.height(), bounds.x(), bounds.y()
+            ))
+        print('layer {}: {} {}'.format(layer.name, layer.status, ', '.join(details)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the pixels, palette and metadata of two .pyxel files')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--json', help='write the differences to this file, - for stdout')
+    parser.add_argument('--highlight', help='write a PNG of the new revision with the changed pixels highlighted')
+    parser.add_argument('--side-by-side', action='store_true', help='show both revisions in the highlight PNG')
+    args = parser.parse_args()
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    application = QtGui.QGuiApplication(sys.argv[:1])
+
+    diff = diff_files(args.old, args.new)
+    if args.json == '-':
+        json.dump(diff.to_json(), sys.stdout, indent=2)
+        print()
+    else:
+        print_summary(diff)
+        if args.json:
+            with open(args.json, 'w') as output:
+                json.dump(diff.to_json(), output, indent=2)
+
+    if args.highlight:
+        boxes = [layer.bounds for layer in diff.changed_layers()]
+        if args.side_by_side:
+            image = side_by_side_image(render_file(args.old), render_file(args.new), diff.size, boxes)
+        else:
+            image = highlight_image(render_file(args.new), diff.mask(), boxes)
+        image.save(args.highlight, 'PNG')
+
+    sys.exit(1 if diff.changed() else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from PySide6 import QtCore
+
+
+class RecoveryJournal(QtCore.QObject):
+    """Append-only log of document edits, used to recover work after a crash.
+
+    Pixel edits are stored as compressed deltas of the rects reported by
+    pixels_changed, layer and palette edits as small JSON records. Records are
+    compressed, written and fsynced in batches on a background thread, so the
+    cost of an edit is proportional to the pixels it touched.
+    """
+
+    MAGIC = b'DRAWJRNL'
+    VERSION = 1
+    EXTENSION = '.recovery'
+    BATCH_SIZE = 32
+
+    PIXELS = 1
+    LAYER = 2
+    LAYER_ORDER = 3
+    PALETTE = 4
+    CANVAS = 5
+
+    BLANK_LAYER_STATE = {
+        'name': '', 'hidden': False, 'soloed': False, 'muted': False, 'alpha': 255, 'blend_mode': 'normal',
+    }
+
+    _record_header = struct.Struct('<BI')
+    _pixels_header = struct.Struct('<iiiii')
+
+    def __init__(self, document, append=False):
+        super().__init__()
+        self.document = document
+        self.path = self.path_for(document.file_path)
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._layers = list(document.layers)
+        self._layer_state = {layer: self.layer_state(layer) for layer in self._layers}
+        self._palette = list(document.palette)
+
+        mode = 'ab' if append and os.path.isfile(self.path) else 'wb'
+        if mode == 'wb':
+            self._queue.put(self.file_header(document.file_path))
+
+        self._thread = threading.Thread(target=self._write_records, args=(mode,), daemon=True)
+        self._thread.start()
+
+        document.pixels_changed.connect(self.record_pixels)
+        document.document_changed.connect(self.record_changes)
+        document.layer_order_changed.connect(self.record_changes)
+        document.canvas_changed.connect(self.record_canvas)
+
+    @classmethod
+    def path_for(cls, file_path):
+        return file_path + cls.EXTENSION
+
+    @classmethod
+    def file_header(cls, source_path):
+        stat = os.stat(source_path)
+        header = json.dumps({'source_size': stat.st_size, 'source_mtime': stat.st_mtime_ns}).encode()
+        return cls.MAGIC + struct.pack('<BI', cls.VERSION, len(header)) + header
+
+    @staticmethod
+    def layer_state(layer):
+        return {
+            'name': layer.name,
+            'hidden': layer.hidden,
+            'soloed': layer.soloed,
+            'muted': layer.muted,
+            'alpha': layer.alpha,
+            'blend_mode': layer.blend_mode,
+        }
+
+    def record_pixels(self, layer, rect):
+        if self._closed or rect.isEmpty():
+            return
+
+        self.record_changes()
+        if layer not in self._layer_state:
+            return
+
+        x, y, w, h = rect.x(), rect.y(), rect.width(), rect.height()
+        pixels = layer.read_pixels(rect).tobytes()
+        header = self._pixels_header.pack(self._layers.index(layer), x, y, w, h)
+        self._queue.put((self.PIXELS, header, pixels))
+
+    def record_canvas(self, document, rect):
+        if self._closed:
+            return
+        self.record_changes()
+        self._put_json(self.CANVAS, {'rect': [rect.x(), rect.y(), rect.width(), rect.height()]})
+
+    def record_changes(self, *args):
+        if self._closed:
+            return
+
+        layers = self.document.layers
+        if layers != self._layers:
+            order = [self._layers.index(layer) if layer in self._layer_state else -1 for layer in layers]
+            self._put_json(self.LAYER_ORDER, {'order': order})
+            self._layers = list(layers)
+            self._layer_state = {
+                layer: self._layer_state.get(layer) or self.BLANK_LAYER_STATE
+                for layer in layers
+            }
+
+        for index, layer in enumerate(layers):
+            state = self.layer_state(layer)
+            if state != self._layer_state[layer]:
+                self._layer_state[layer] = state
+                self._put_json(self.LAYER, dict(state, index=index))
+
+        if self.document.palette != self._palette:
+            self._palette = list(self.document.palette)
+            self._put_json(self.PALETTE, {'palette': self._palette})
+
+    def _put_json(self, kind, data):
+        self._queue.put((kind, b'', json.dumps(data).encode()))
+
+    def _write_records(self, mode):
+        with open(self.path, mode) as journal:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < self.BATCH_SIZE:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = None in batch
+                for record in batch:
+                    if record is None:
+                        continue
+                    if isinstance(record, bytes):
+                        journal.write(record)
+                        continue
+
+                    kind, header, payload = record
+                    if kind == self.PIXELS:
+                        payload = zlib.compress(payload, 1)
+                    journal.write(self._record_header.pack(kind, len(header) + len(payload)))
+                    journal.write(header)
+                    journal.write(payload)
+
+                journal.flush()
+                os.fsync(journal.fileno())
+
+                if stop:
+                    return
+
+    def close(self):
+        """Stop recording, keeping the journal on disk for the next launch"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def discard(self):
+        """Stop recording and delete the journal, e.g. when its window is closed"""
+        if self._closed:
+            return
+        self.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    @classmethod
+    def exists_for(cls, file_path):
+        return bool(file_path) and os.path.isfile(cls.path_for(file_path))
+
+    @classmethod
+    def matches_source(cls, file_path):
+        with open(cls.path_for(file_path), 'rb') as journal:
+            header = cls._read_file_header(journal)
+        if not header:
+            return False
+        stat = os.stat(file_path)
+        return header['source_size'] == stat.st_size and header['source_mtime'] == stat.st_mtime_ns
+
+    @classmethod
+    def _read_file_header(cls, journal):
+        prefix = journal.read(len(cls.MAGIC) + 5)
+        if len(prefix) < len(cls.MAGIC) + 5 or not prefix.startswith(cls.MAGIC):
+            return None
+        version, length = struct.unpack('<BI', prefix[len(cls.MAGIC):])
+        if version != cls.VERSION:
+            return None
+        return json.loads(journal.read(length))
+
+    @classmethod
+    def replay(cls, document, file_path=None):
+        """Apply the journal of `file_path` to a document freshly loaded from it.
+
+        A partially written record at the end of the journal (the crash itself)
+        is ignored. Returns the number of records applied.
+        """
+        file_path = file_path or document.file_path
+        applied = 0
+        dirty = []
+
+        with open(cls.path_for(file_path), 'rb') as journal:
+            if cls._read_file_header(journal) is None:
+                return 0
+
+            while True:
+                header = journal.read(cls._record_header.size)
+                if len(header) < cls._record_header.size:
+                    break
+                kind, length = cls._record_header.unpack(header)
+                payload = journal.read(length)
+                if len(payload) < length:
+                    break
+
+                try:
+                    cls._apply_record(document, kind, payload, dirty)
+                except (ValueError, IndexError, KeyError, zlib.error):
+                    break
+                applied += 1
+
+        with document.transaction():
+            for layer, rect in dirty:
+                if layer in document.layers:
+                    layer.pixels_changed.emit(layer, rect)
+            if applied:
+                document.note_changes(metadata=document.layers, structure=True, palette=True)
+
+        return applied
+
+    @classmethod
+    def _apply_record(cls, document, kind, payload, dirty):
+        if kind == cls.PIXELS:
+            index, x, y, w, h = cls._pixels_header.unpack_from(payload)
+            pixels = np.frombuffer(zlib.decompress(payload[cls._pixels_header.size:]), dtype=np.uint32)
+            layer = document.layers[index]
+            layer.write_pixels(pixels.reshape(h, w), QtCore.QPoint(x, y))
+            dirty.append((layer, QtCore.QRect(x, y, w, h)))
+        elif kind == cls.LAYER:
+            data = json.loads(payload)
+            layer = document.layers[data['index']]
+            layer.name = data['name']
+            layer.hidden = data['hidden']
+            layer.soloed = data.get('soloed', False)
+            layer.muted = data.get('muted', False)
+            layer.alpha = data['alpha']
+            layer.blend_mode = data['blend_mode']
+        elif kind == cls.LAYER_ORDER:
+            previous = list(document.layers)
+            document.layers.clear()
+            for index in json.loads(payload)['order']:
+                if index >= 0:
+                    document.layers.append(previous[index])
+                else:
+                    document.add_layer(document.create_layer())
+        elif kind == cls.PALETTE:
+            document.palette = json.loads(payload)['palette']
+        elif kind == cls.CANVAS:
+            document.resize_canvas(QtCore.QRect(*json.loads(payload)['rect']))
+        else:
+            raise ValueError('unknown journal record {}'.format(kind))
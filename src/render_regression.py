@@ -0,0 +1,181 @@
+"""Golden-image regression check for DocumentRenderer.
+
+Flattens every demo document plus synthetic documents covering each blend
+mode, layer alpha, hidden, soloed, muted and grouped layers, and compares the
+results against PNGs stored in demo/golden:
+
+    python src/render_regression.py            # check
+    python src/render_regression.py --update   # accept the current output
+"""
+import argparse
+import glob
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from draw_document import DrawDocument
+from document_renderer import DocumentRenderer
+from pixel_array import image_array
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEMO_DIR = os.path.join(ROOT, 'demo')
+GOLDEN_DIR = os.path.join(DEMO_DIR, 'golden')
+
+BLEND_MODES = [
+    'normal', 'darken', 'lighten', 'add', 'difference', 'multiply', 'screen',
+    'invert', 'overlay', 'hardlight', 'softlight', 'dodge', 'burn',
+]
+
+
+class Case:
+    def __init__(self, name, build, seconds=1.0, megabytes=64):
+        self.name = name
+        self.build = build
+        self.seconds = seconds
+        self.megabytes = megabytes
+
+
+def synthetic_layer(document, seed, opaque=False, noise=True):
+    """Layer with a gradient, a block of noise and a transparent border"""
+    width, height = document.size.width(), document.size.height()
+    y, x = np.mgrid[0:height, 0:width].astype(np.uint32)
+    pixels = (x * 255 // max(width - 1, 1)) << 16 | (y * 255 // max(height - 1, 1)) << 8 | (seed * 40 & 0xff)
+    pixels |= np.uint32(0xff000000) if opaque else (64 + (x // 8 * 7 + y // 8 * 3 + seed * 31) % 192) << 24
+    if noise:
+        rng = np.random.default_rng(seed)
+        block = rng.integers(0, 2 ** 32, size=(height // 2, width // 2), dtype=np.uint32) | 0x80000000
+        pixels[height // 4:height // 4 + height // 2, width // 4:width // 4 + width // 2] = block
+    if not opaque:
+        pixels[:2] = 0
+        pixels[:, -3:] = 0
+
+    layer = document.create_layer()
+    layer.write_pixels(pixels)
+    layer.mark_dirty()
+    layer.name = 'synthetic {}'.format(seed)
+    return layer
+
+
+def synthetic_document(top_layers, size=QtCore.QSize(64, 48), noise=True):
+    document = DrawDocument(size=size)
+    for seed, properties in enumerate(top_layers, start=1):
+        layer = synthetic_layer(document, seed, noise=noise)
+        for name, value in properties.items():
+            setattr(layer, name, value)
+        document.add_layer(layer)
+    document.add_layer(synthetic_layer(document, 0, opaque=True, noise=noise))
+    return document
+
+
+def grouped_document():
+    document = synthetic_document([{}, {'blend_mode': 'multiply'}, {'alpha': 200}, {}])
+    group = document.group_layers(document.layers[1:3], 'group')
+    group.blend_mode = 'screen'
+    group.alpha = 180
+    return document
+
+
+def cases():
+    for path in sorted(glob.glob(os.path.join(DEMO_DIR, '*.pyxel'))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        yield Case(name, lambda path=path: DrawDocument(path), seconds=2.0, megabytes=256)
+
+    for mode in BLEND_MODES:
+        yield Case('blend-' + mode, lambda mode=mode: synthetic_document([{'blend_mode': mode}]))
+    for alpha in (0, 1, 64, 128, 254):
+        yield Case('alpha-{}'.format(alpha), lambda alpha=alpha: synthetic_document([
+            {'alpha': alpha}, {'alpha': alpha, 'blend_mode': 'multiply'},
+        ]))
+    yield Case('hidden', lambda: synthetic_document([{'hidden': True}, {}]))
+    yield Case('muted', lambda: synthetic_document([{}, {'muted': True}]))
+    yield Case('soloed', lambda: synthetic_document([{}, {'soloed': True}, {}]))
+    yield Case('group', grouped_document)
+    yield Case('large', lambda: synthetic_document(
+        [{'blend_mode': mode} for mode in BLEND_MODES], size=QtCore.QSize(2048, 2048), noise=False
+    ), seconds=10.0, megabytes=1024)
+
+
+def max_rss_megabytes():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / (1024 * 1024) if sys.platform == 'darwin' else usage / 1024
+
+
+def straight_pixels(image):
+    return image_array(image.convertToFormat(QtGui.QImage.Format_ARGB32)).copy()
+
+
+def run_case(case, golden_dir, tolerance, update):
+    """Returns a list of problems, empty when the case passes"""
+    rss_before = max_rss_megabytes()
+    start = time.perf_counter()
+    try:
+        document = case.build()
+        composite = DocumentRenderer(document).render()
+    except Exception as error:
+        print('{:<6} {:<24} {}: {}'.format('FAIL', case.name, type(error).__name__, error))
+        return [str(error)]
+    seconds = time.perf_counter() - start
+    megabytes = max_rss_megabytes() - rss_before
+
+    problems = []
+    if seconds > case.seconds:
+        problems.append('took {:.2f}s, budget {:.2f}s'.format(seconds, case.seconds))
+    if megabytes > case.megabytes:
+        problems.append('peak memory grew {:.0f}MB, budget {}MB'.format(megabytes, case.megabytes))
+
+    parallel = DocumentRenderer(document).render(parallel=True)
+    if image_array(parallel).tobytes() != image_array(composite).tobytes():
+        problems.append('parallel render differs from serial render')
+
+    pixels = straight_pixels(composite)
+    golden_path = os.path.join(golden_dir, case.name + '.png')
+    if update:
+        os.makedirs(golden_dir, exist_ok=True)
+        composite.convertToFormat(QtGui.QImage.Format_ARGB32).save(golden_path, 'PNG')
+    elif not os.path.isfile(golden_path):
+        problems.append('no golden image, run with --update')
+    else:
+        golden = QtGui.QImage(golden_path)
+        if golden.size() != composite.size():
+            problems.append('size {}x{} does not match golden {}x{}'.format(
+                composite.width(), composite.height(), golden.width(), golden.height()
+            ))
+        else:
+            difference = np.abs(
+                pixels.view(np.uint8).astype(np.int16) - straight_pixels(golden).view(np.uint8).astype(np.int16)
+            ).reshape(pixels.shape + (4,)).max(axis=2)
+            wrong = int((difference > tolerance).sum())
+            if wrong:
+                problems.append('{} pixels off by up to {}'.format(wrong, int(difference.max())))
+
+    print('{:<6} {:<24} {:7.3f}s {:6.1f}MB {}'.format(
+        'FAIL' if problems else 'ok', case.name, seconds, megabytes, '; '.join(problems)
+    ))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare DocumentRenderer output against golden images')
+    parser.add_argument('--update', action='store_true', help='overwrite the golden images with the current output')
+    parser.add_argument('--golden-dir', default=GOLDEN_DIR)
+    parser.add_argument('--tolerance', type=int, default=1, help='allowed difference per channel')
+    parser.add_argument('-k', '--filter', default='', help='only run cases whose name contains this')
+    args = parser.parse_args()
+
+    failed = [
+        case.name for case in cases()
+        if args.filter in case.name and run_case(case, args.golden_dir, args.tolerance, args.update)
+    ]
+    if failed:
+        print('{} failing: {}'.format(len(failed), ', '.join(failed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import io
+import os
+import traceback
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+from PySide6 import QtWidgets
+
+from scripting import run_script
+
+
+class ScriptConsole(QtWidgets.QWidget):
+    """Runs scripts on the active document, see scripting.py for what they can use"""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._document = None
+        self.script_path = None
+
+        font = QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont)
+        self.editor = QtWidgets.QPlainTextEdit()
+        self.editor.setFont(font)
+        self.editor.setPlaceholderText("for l in layers:\n    with l.edit() as pixels:\n        ...")
+        self.output = QtWidgets.QPlainTextEdit()
+        self.output.setFont(font)
+        self.output.setReadOnly(True)
+        self.output.setStyleSheet('QPlainTextEdit { background: #444; color: #ccc }')
+
+        self.toolbar = QtWidgets.QToolBar()
+        self.toolbar.setIconSize(QtCore.QSize(16, 16))
+        run_action = self.toolbar.addAction('Run', self.run)
+        run_action.setShortcut(QtGui.QKeySequence.fromString('Ctrl+Return'))
+        run_action.setShortcutContext(QtCore.Qt.WidgetWithChildrenShortcut)
+        self.toolbar.addAction('Open...', self.open_script)
+        self.toolbar.addAction('Clear Output', self.output.clear)
+
+        splitter = QtWidgets.QSplitter(QtCore.Qt.Vertical)
+        splitter.addWidget(self.editor)
+        splitter.addWidget(self.output)
+
+        self.setLayout(QtWidgets.QVBoxLayout())
+        self.layout().setContentsMargins(0, 0, 0, 0)
+        self.layout().setSpacing(0)
+        self.layout().addWidget(self.toolbar)
+        self.layout().addWidget(splitter)
+
+        self.restore_settings()
+
+    def register_window(self, main_window):
+        main_window.document_changed.connect(self.document_changed)
+        main_window.destroyed.connect(self.save_settings)
+
+    def document_changed(self, document):
+        self._document = document
+
+    def save_settings(self):
+        settings = QtCore.QSettings()
+        settings.setValue('editor/script_console/source', self.editor.toPlainText())
+
+    def restore_settings(self):
+        settings = QtCore.QSettings()
+        self.editor.setPlainText(settings.value('editor/script_console/source') or '')
+
+    def open_script(self):
+        settings = QtCore.QSettings()
+        script_dir = settings.value('editor/script_location') or os.path.expanduser('~')
+
+        file_name, filter = QtWidgets.QFileDialog.getOpenFileName(self, 'Open Script', script_dir, 'Python (*.py)')
+
+        if file_name:
+            settings.setValue('editor/script_location', os.path.dirname(file_name))
+            with open(file_name) as script_file:
+                self.editor.setPlainText(script_file.read())
+            self.script_path = file_name
+
+    def run(self):
+        if self._document is None:
+            self.output.appendPlainText('no document to run the script on')
+            return
+
+        output = io.StringIO()
+        timer = QtCore.QElapsedTimer()
+        timer.start()
+        try:
+            run_script(self.editor.toPlainText(), self._document, self.script_path or 'console', output)
+        except Exception:
+            output.write(traceback.format_exc())
+        else:
+            output.write('done in {} ms\n'.format(timer.elapsed()))
+        self.output.appendPlainText(output.getvalue().rstrip())
@@ -0,0 +1,400 @@
+"""Scripting API for batch edits of DrawDocuments.
+
+A script is plain Python run with these names defined:
+
+    document                    the DrawDocument being edited
+    layers                      a ScriptLayer for every layer, top first
+    layer(name)                 the first ScriptLayer called `name`
+    add_layer(name, index=0)    a new empty ScriptLayer
+    remove_layer(layer)
+    color(name)                 uint32 ARGB value of a color like 'ff1a1c2c'
+    color_name(value)           the reverse
+    np, QtCore
+
+Layer pixels are (height, width) uint32 ARGB NumPy arrays, so edits are
+vectorized instead of going pixel by pixel:
+
+    black, ink = color('ff000000'), color('ff1a1c2c')
+    for l in layers:
+        with l.edit() as pixels:
+            pixels[pixels == black] = ink
+
+Palette operations are the document's own: document.replace_colors,
+swap_colors, merge_colors, sort_palette and deduplicate_palette.
+
+Whatever a script does is one transaction, so the document announces it with a
+single notification, and one step of `document.undo_stack`. A script that raises
+leaves the document as it found it. Edits made outside of scripts are not on the
+stack; undo() and redo() clear it rather than restore a state that would throw
+them away.
+
+    python src/scripting.py script.py file.pyxel [file.pyxel ...] [--export DIR]
+"""
+import argparse
+import copy
+import io
+import os
+import sys
+import time
+from contextlib import contextmanager, redirect_stdout
+
+import numpy as np
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from pixel_array import mask_bounds
+import palette_ops
+
+
+def _layer_property(name):
+    def get(self):
+        return getattr(self.layer, name)
+
+    def set(self, value):
+        setattr(self.layer, name, value)
+        self.layer.propagate_changes()
+
+    return property(get, set)
+
+
+class ScriptLayer:
+    """A DrawLayer as scripts see it: properties that notify, pixels as arrays"""
+
+    name = _layer_property('name')
+    hidden = _layer_property('hidden')
+    soloed = _layer_property('soloed')
+    muted = _layer_property('muted')
+    blend_mode = _layer_property('blend_mode')
+    alpha = _layer_property('alpha')
+
+    def __init__(self, document, layer):
+        self.document = document
+        self.layer = layer
+
+    def __repr__(self):
+        return '<ScriptLayer {!r}>'.format(self.layer.name)
+
+    @property
+    def width(self):
+        return self.layer.size.width()
+
+    @property
+    def height(self):
+        return self.layer.size.height()
+
+    @property
+    def pixels(self):
+        """Copy of every pixel of the layer; assign an array to write it back"""
+        return self.layer.read_pixels()
+
+    @pixels.setter
+    def pixels(self, pixels):
+        self.write(pixels)
+
+    def read(self, x, y, width, height):
+        return self.layer.read_pixels(QtCore.QRect(x, y, width, height))
+
+    def write(self, pixels, x=0, y=0):
+        """Write a uint32 array with its top left corner at (x, y).
+
+        Only tiles holding a changed pixel are touched, and only the bounds of
+        the changed pixels are reported dirty.
+        """
+        pixels = np.asarray(pixels, dtype=np.uint32)
+        rect = QtCore.QRect(x, y, pixels.shape[1], pixels.shape[0])
+        visible = rect.intersected(self.layer.rect())
+        if visible.isEmpty():
+            return
+        pixels = pixels[visible.top() - y:visible.bottom() + 1 - y, visible.left() - x:visible.right() + 1 - x]
+        changed = self.layer.read_pixels(visible) != pixels
+        dirty = mask_bounds(changed)
+        if dirty.isEmpty():
+            return
+
+        dirty.translate(visible.topLeft())
+        for key in self.layer.tiles.tile_keys(dirty):
+            part = self.layer.tiles.tile_rect(key).intersected(dirty)
+            rows = slice(part.top() - visible.top(), part.bottom() + 1 - visible.top())
+            columns = slice(part.left() - visible.left(), part.right() + 1 - visible.left())
+            if changed[rows, columns].any():
+                self.layer.write_pixels(pixels[rows, columns], part.topLeft())
+        self.layer.mark_dirty(dirty)
+
+    @contextmanager
+    def edit(self, x=0, y=0, width=None, height=None):
+        """Writable copy of a region, the whole layer by default, written back when the block ends"""
+        rect = QtCore.QRect(
+            x, y, self.width - x if width is None else width, self.height - y if height is None else height
+        )
+        pixels = self.layer.read_pixels(rect)
+        yield pixels
+        self.write(pixels, x, y)
+
+    def mask(self, color):
+        """Boolean array of the pixels that are `color`"""
+        return self.pixels == color_value(color)
+
+    def content_rect(self):
+        rect = self.layer.content_rect()
+        return rect.x(), rect.y(), rect.width(), rect.height()
+
+    def clear(self):
+        self.write(np.zeros((self.height, self.width), dtype=np.uint32))
+
+    def replace_colors(self, mapping):
+        self.document.replace_colors(mapping, [self.layer])
+
+
+def color_value(color):
+    return color if isinstance(color, (int, np.integer)) else palette_ops.color_value(palette_ops.normalize_color(color))
+
+
+def layer_state(layer):
+    return layer.name, layer.hidden, layer.soloed, layer.muted, layer.blend_mode, layer.alpha, layer.group
+
+
+def group_state(group):
+    return group.name, group.hidden, group.collapsed, group.blend_mode, group.alpha, group.group
+
+
+def document_groups(document):
+    groups = set()
+    for layer in document.layers:
+        groups.update(layer.groups())
+    return groups
+
+
+class DocumentState:
+    """Everything a script can change in a document.
+
+    Layer tiles are kept as shallow QImage copies that share memory with the
+    document until it writes to them, so a state costs little beyond the tiles
+    edited after it was taken.
+    """
+
+    def __init__(self, document):
+        self.name = document.name
+        self.size = QtCore.QSize(document.size)
+        self.tile_size = QtCore.QSize(document.tile_size)
+        self.palette = list(document.palette)
+        self.palette_width = document.palette_width
+        self.animations = copy.deepcopy(document.animations)
+        self.layers = [(layer, layer.version, layer.tiles.copy(), layer_state(layer)) for layer in document.layers]
+        self.groups = {group: group_state(group) for group in document_groups(document)}
+
+    def key(self):
+        return (
+            self.name, self.size, self.tile_size, self.palette, self.palette_width,
+            [vars(animation) for animation in self.animations],
+            [(layer, version, state) for layer, version, tiles, state in self.layers],
+            self.groups,
+        )
+
+    def matches(self, other):
+        return self.key() == other.key()
+
+    def restore(self, document):
+        """Put `document` back into this state, announced as one change"""
+        document.wake()
+        layers = [layer for layer, version, tiles, state in self.layers]
+        current_groups = document_groups(document)
+
+        with document.transaction():
+            for layer in list(document.layers):
+                if layer not in layers:
+                    document.remove_layer(layer)
+            for layer in layers:
+                if layer not in document.layers:
+                    document.add_layer(layer)
+            document.layers[:] = layers
+
+            for group in current_groups - self.groups.keys():
+                group.updated.disconnect(document.layer_updated)
+            for group in self.groups.keys() - current_groups:
+                group.updated.connect(document.layer_updated)
+            for group, state in self.groups.items():
+                group.name, group.hidden, group.collapsed, group.blend_mode, group.alpha, group.group = state
+
+            canvas = self.size != document.size
+            palette = self.palette != document.palette
+            document.name = self.name
+            document.size = QtCore.QSize(self.size)
+            document.tile_size = QtCore.QSize(self.tile_size)
+            document.palette = list(self.palette)
+            document.palette_width = self.palette_width
+            document.animations = copy.deepcopy(self.animations)
+
+            restored = []
+            for layer, version, tiles, state in self.layers:
+                layer.name, layer.hidden, layer.soloed, layer.muted, layer.blend_mode, layer.alpha, layer.group = state
+                if layer.version != version:
+                    layer.replace_tiles(tiles.copy())
+                    restored.append(layer)
+            # listeners of canvas_changed, like the color usage index, read the restored tiles
+            if canvas:
+                document.canvas_changed.emit(document, QtCore.QRect(QtCore.QPoint(0, 0), self.size))
+            for layer in restored:
+                layer.mark_dirty()
+
+            document.invalidate_visibility()
+            document.layer_order_changed.emit(document)
+            document.note_changes(
+                metadata=layers + list(self.groups), structure=True, palette=palette, canvas=canvas
+            )
+
+
+class ScriptCommand(QtGui.QUndoCommand):
+    """Undo step switching a document between the states before and after a script"""
+
+    def __init__(self, document, before, after, text):
+        super().__init__(text)
+        self.document = document
+        self.before = before
+        self.after = after
+        self._done = True
+
+    def undo(self):
+        self.before.restore(self.document)
+
+    def redo(self):
+        # the script itself did the first redo
+        if self._done:
+            self._done = False
+            return
+        self.after.restore(self.document)
+
+
+def undo(document):
+    """Undo the last script unless the document was edited since; returns whether it did"""
+    stack = document.undo_stack
+    command = stack.command(stack.index() - 1)
+    if command is None:
+        return False
+    if not DocumentState(document).matches(command.after):
+        stack.clear()
+        return False
+    stack.undo()
+    return True
+
+
+def redo(document):
+    """Redo the last undone script unless the document was edited since; returns whether it did"""
+    stack = document.undo_stack
+    command = stack.command(stack.index())
+    if command is None:
+        return False
+    if not DocumentState(document).matches(command.before):
+        stack.clear()
+        return False
+    stack.redo()
+    return True
+
+
+def script_namespace(document):
+    def layer(name):
+        for script_layer in layers:
+            if script_layer.name == name:
+                return script_layer
+        raise Exception('no layer called {}'.format(name))
+
+    def add_layer(name='', index=0):
+        new_layer = document.create_layer()
+        new_layer.name = name
+        document.add_layer(new_layer, index)
+        document.layer_order_changed.emit(document)
+        document.note_changes(structure=True)
+        script_layer = ScriptLayer(document, new_layer)
+        layers.insert(index, script_layer)
+        return script_layer
+
+    def remove_layer(script_layer):
+        document.remove_layer(script_layer.layer)
+        document.layer_order_changed.emit(document)
+        document.note_changes(structure=True)
+        layers.remove(script_layer)
+
+    layers = [ScriptLayer(document, draw_layer) for draw_layer in document.layers]
+    return {
+        '__name__': '__script__',
+        'document': document,
+        'layers': layers,
+        'layer': layer,
+        'add_layer': add_layer,
+        'remove_layer': remove_layer,
+        'color': color_value,
+        'color_name': palette_ops.color_name,
+        'np': np,
+        'QtCore': QtCore,
+    }
+
+
+def run_script(source, document, filename='<script>', output=None):
+    """Run `source` on `document` as one transaction and one undo step.
+
+    Returns the script's namespace. What the script prints goes to `output`,
+    stdout by default.
+    """
+    code = compile(source, filename, 'exec')
+    document.wake()
+    namespace = script_namespace(document)
+    before = DocumentState(document)
+
+    with document.transaction():
+        try:
+            with redirect_stdout(output or sys.stdout):
+                exec(code, namespace)
+        except BaseException:
+            if not DocumentState(document).matches(before):
+                before.restore(document)
+            raise
+
+        after = DocumentState(document)
+        if not after.matches(before):
+            document.undo_stack.push(ScriptCommand(document, before, after, os.path.basename(filename)))
+    return namespace
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a script on .pyxel files without the editor')
+    parser.add_argument('script')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--export', help='write the composite of every document to this directory as PNG')
+    args = parser.parse_args()
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    application = QtGui.QGuiApplication(sys.argv[:1])
+
+    from draw_document import DrawDocument
+    from document_renderer import DocumentRenderer
+
+    with open(args.script) as script_file:
+        source = script_file.read()
+
+    failed = False
+    for path in args.files:
+        document = DrawDocument(path)
+        output = io.StringIO()
+        start = time.perf_counter()
+        try:
+            run_script(source, document, args.script, output)
+        except Exception as error:
+            failed = True
+            print('{}: {}: {}'.format(path, type(error).__name__, error))
+            continue
+        finally:
+            for line in output.getvalue().splitlines():
+                print('{}: {}'.format(path, line))
+        print('{}: done in {:.3f}s'.format(path, time.perf_counter() - start))
+
+        if args.export:
+            os.makedirs(args.export, exist_ok=True)
+            name = os.path.splitext(os.path.basename(path))[0] + '.png'
+            composite = DocumentRenderer(document).render(parallel=True)
+            composite.convertToFormat(QtGui.QImage.Format_ARGB32).save(os.path.join(args.export, name), 'PNG')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
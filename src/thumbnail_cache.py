@@ -0,0 +1,78 @@
+import hashlib
+import os
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from draw_document import DrawDocument
+from document_renderer import DocumentRenderer
+
+
+class ThumbnailCache:
+    """Composited document thumbnails stored as PNG files.
+
+    Entries are keyed by the absolute path, modification time and byte size of
+    the source file, so an edited file gets a new entry and is rendered again.
+    Each file's entries live in a directory named after the path and thumbnail
+    size, and storing an entry deletes the older ones there, so edits never
+    pile up more than one thumbnail per file.
+    """
+
+    def __init__(self, directory=None, size=QtCore.QSize(128, 128)):
+        if directory is None:
+            directory = os.path.join(
+                QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.CacheLocation), 'thumbnails'
+            )
+        self.directory = directory
+        self.size = QtCore.QSize(size)
+
+    def entry_directory(self, path):
+        key = '{}|{}x{}'.format(os.path.abspath(path), self.size.width(), self.size.height())
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def entry_path(self, path):
+        stat = os.stat(path)
+        version = '{}|{}'.format(stat.st_mtime_ns, stat.st_size)
+        return os.path.join(self.entry_directory(path), hashlib.sha1(version.encode()).hexdigest() + '.png')
+
+    def cached(self, path):
+        """Cached thumbnail of `path`, or None if it has to be rendered"""
+        entry = self.entry_path(path)
+        if not os.path.isfile(entry):
+            return None
+        image = QtGui.QImage(entry)
+        return None if image.isNull() else image
+
+    def thumbnail(self, path):
+        """Thumbnail of `path`, rendered and stored if it is not cached yet"""
+        image = self.cached(path)
+        if image is None:
+            image = self.render(path)
+            self.store(path, image)
+        return image
+
+    def render(self, path):
+        document = DrawDocument(path)
+        composite = DocumentRenderer(document).render()
+        size = document.size.scaled(self.size, QtCore.Qt.KeepAspectRatio).expandedTo(QtCore.QSize(1, 1))
+        return composite.scaled(size, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.FastTransformation)
+
+    def store(self, path, image):
+        entry = self.entry_path(path)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # write next to the entry and rename so readers never see half a file
+        partial = entry + '.part'
+        if image.save(partial, 'PNG'):
+            os.replace(partial, entry)
+            self.remove_stale(entry)
+
+    @staticmethod
+    def remove_stale(entry):
+        """Delete the other entries next to `entry`, thumbnails of earlier versions of its file"""
+        directory = os.path.dirname(entry)
+        for name in os.listdir(directory):
+            if name != os.path.basename(entry) and name.endswith('.png'):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
@@ -0,0 +1,270 @@
+import zlib
+
+import numpy as np
+
+from PySide6 import QtCore
+from PySide6 import QtGui
+
+from pixel_array import image_array, array_image
+
+
+class TiledImage:
+    """Sparse ARGB32 image made of fixed size tiles.
+
+    Only tiles holding non-transparent pixels are allocated, so memory follows the
+    painted content instead of the canvas size. Tiles on the right and bottom edges
+    are clipped to the image size.
+
+    Files still store every layer as one canvas-sized PNG. load_image needs
+    that PNG decoded in full before it can pick out the non-empty tiles, so
+    loading briefly holds the dense image. Exports go through to_image, which
+    is dense as well. Nothing encodes or decodes PNGs tile by tile.
+    """
+
+    TILE_SIZE = 64
+    FORMAT = QtGui.QImage.Format_ARGB32
+
+    def __init__(self, size, tile_size=TILE_SIZE):
+        self.size = QtCore.QSize(size)
+        self.tile_size = tile_size
+        self.tiles = {}
+
+    def width(self):
+        return self.size.width()
+
+    def height(self):
+        return self.size.height()
+
+    def rect(self):
+        return QtCore.QRect(QtCore.QPoint(0, 0), self.size)
+
+    @property
+    def nbytes(self):
+        return sum(tile.sizeInBytes() for tile in self.tiles.values())
+
+    def copy(self):
+        """Copy sharing tile memory until either side writes to a tile"""
+        copy = TiledImage(self.size, self.tile_size)
+        copy.tiles = {key: QtGui.QImage(tile) for key, tile in self.tiles.items()}
+        return copy
+
+    def tile_rect(self, key):
+        ts = self.tile_size
+        return QtCore.QRect(key[0] * ts, key[1] * ts, ts, ts).intersected(self.rect())
+
+    def tile_keys(self, rect=None):
+        """Keys of every tile position (allocated or not) overlapping `rect`"""
+        rect = self.rect() if rect is None else rect.intersected(self.rect())
+        if rect.isEmpty():
+            return []
+        ts = self.tile_size
+        return [
+            (tx, ty)
+            for ty in range(rect.top() // ts, rect.bottom() // ts + 1)
+            for tx in range(rect.left() // ts, rect.right() // ts + 1)
+        ]
+
+    def chunks(self, rect=None):
+        """(tile rect, writable pixel view) for every allocated tile overlapping `rect`"""
+        keys = self.tiles.keys() if rect is None else [key for key in self.tile_keys(rect) if key in self.tiles]
+        for key in list(keys):
+            yield self.tile_rect(key), image_array(self.tiles[key])
+
+    def new_tile(self, key):
+        rect = self.tile_rect(key)
+        tile = QtGui.QImage(rect.size(), self.FORMAT)
+        tile.fill(0)
+        self.tiles[key] = tile
+        return tile
+
+    def read(self, rect=None):
+        """Copy of the pixels inside `rect` as a (height, width) uint32 array"""
+        rect = self.rect() if rect is None else rect
+        pixels = np.zeros((max(rect.height(), 0), max(rect.width(), 0)), dtype=np.uint32)
+        for tile_rect, tile in self.chunks(rect):
+            part = tile_rect.intersected(rect)
+            pixels[
+                part.top() - rect.top():part.bottom() + 1 - rect.top(),
+                part.left() - rect.left():part.right() + 1 - rect.left(),
+            ] = tile[
+                part.top() - tile_rect.top():part.bottom() + 1 - tile_rect.top(),
+                part.left() - tile_rect.left():part.right() + 1 - tile_rect.left(),
+            ]
+        return pixels
+
+    def write(self, pixels, point=QtCore.QPoint(0, 0)):
+        """Replace the pixels of the rect at `point` with a (height, width) uint32 array.
+
+        Tiles are allocated only for non-transparent pixels, and tiles that end up
+        fully transparent are released.
+        """
+        rect = QtCore.QRect(point, QtCore.QSize(pixels.shape[1], pixels.shape[0]))
+        for key in self.tile_keys(rect):
+            tile_rect = self.tile_rect(key)
+            part = tile_rect.intersected(rect)
+            source = pixels[
+                part.top() - rect.top():part.bottom() + 1 - rect.top(),
+                part.left() - rect.left():part.right() + 1 - rect.left(),
+            ]
+            tile = self.tiles.get(key)
+            if tile is None:
+                if not (source >> 24).any():
+                    continue
+                tile = self.new_tile(key)
+
+            view = image_array(tile)
+            view[
+                part.top() - tile_rect.top():part.bottom() + 1 - tile_rect.top(),
+                part.left() - tile_rect.left():part.right() + 1 - tile_rect.left(),
+            ] = source
+            if not (view >> 24).any():
+                del self.tiles[key]
+
+    def compact(self):
+        """Release tiles that became fully transparent through chunk views"""
+        for key, tile in list(self.tiles.items()):
+            if not (image_array(tile) >> 24).any():
+                del self.tiles[key]
+
+    def compressed_tiles(self):
+        """{key: (width, height, zlib data)} of every tile, see load_compressed_tiles"""
+        return {
+            key: (tile.width(), tile.height(), zlib.compress(image_array(tile).tobytes(), 1))
+            for key, tile in self.tiles.items()
+        }
+
+    def load_compressed_tiles(self, compressed):
+        self.tiles = {
+            key: array_image(np.frombuffer(zlib.decompress(data), dtype=np.uint32).reshape(height, width), self.FORMAT)
+            for key, (width, height, data) in compressed.items()
+        }
+
+    def load_image(self, image):
+        """Replace the contents with a QImage, keeping only its non-empty tiles.
+
+        `image` is a whole decoded layer; the tiles are copies, so it can be
+        released as soon as this returns.
+        """
+        image = image.convertToFormat(self.FORMAT)
+        self.tiles = {}
+        if image.width() < self.width() or image.height() < self.height():
+            padded = np.zeros((self.height(), self.width()), dtype=np.uint32)
+            pixels = image_array(image)[:self.height(), :self.width()]
+            padded[:pixels.shape[0], :pixels.shape[1]] = pixels
+            pixels = padded
+        else:
+            pixels = image_array(image)[:self.height(), :self.width()]
+
+        ts = self.tile_size
+        tiles_y, tiles_x = -(-self.height() // ts), -(-self.width() // ts)
+        alpha = np.zeros((tiles_y * ts, tiles_x * ts), dtype=bool)
+        alpha[:self.height(), :self.width()] = (pixels >> 24) != 0
+        occupied = alpha.reshape(tiles_y, ts, tiles_x, ts).any(axis=(1, 3))
+
+        for ty, tx in zip(*np.nonzero(occupied)):
+            key = (int(tx), int(ty))
+            rect = self.tile_rect(key)
+            self.tiles[key] = array_image(
+                pixels[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1], self.FORMAT
+            )
+
+    def content_rect(self, rect=None):
+        """Bounding rect of the non-transparent pixels, optionally only those inside `rect`"""
+        bounds = QtCore.QRect()
+        for tile_rect, pixels in self.chunks(rect):
+            part = tile_rect if rect is None else tile_rect.intersected(rect)
+            if bounds.contains(part):
+                continue
+            opaque = (pixels[
+                part.top() - tile_rect.top():part.bottom() + 1 - tile_rect.top(),
+                part.left() - tile_rect.left():part.right() + 1 - tile_rect.left(),
+            ] >> 24) != 0
+            rows = np.flatnonzero(opaque.any(axis=1))
+            if len(rows) == 0:
+                continue
+            columns = np.flatnonzero(opaque.any(axis=0))
+            bounds = bounds.united(QtCore.QRect(
+                part.left() + int(columns[0]), part.top() + int(rows[0]),
+                int(columns[-1] - columns[0]) + 1, int(rows[-1] - rows[0]) + 1,
+            ))
+        return bounds
+
+    def cropped(self, rect):
+        """New image of the area `rect`, which may extend past this image's edges"""
+        cropped = TiledImage(rect.size(), self.tile_size)
+        for tile_rect, pixels in self.chunks(rect):
+            part = tile_rect.intersected(rect)
+            cropped.write(
+                pixels[
+                    part.top() - tile_rect.top():part.bottom() + 1 - tile_rect.top(),
+                    part.left() - tile_rect.left():part.right() + 1 - tile_rect.left(),
+                ],
+                part.topLeft() - rect.topLeft(),
+            )
+        return cropped
+
+    def remapped(self, size, key_map, pixel_map):
+        """New image of `size` holding pixel_map(tile pixels) at key_map(key) for every tile.
+
+        Only valid when tiles stay whole, i.e. both sizes are multiples of the tile size.
+        """
+        image = TiledImage(size, self.tile_size)
+        for key, tile in self.tiles.items():
+            image.tiles[key_map(key)] = array_image(pixel_map(image_array(tile)), self.FORMAT)
+        return image
+
+    def to_image(self, rect=None):
+        """Dense QImage of the pixels inside `rect`, e.g. for PNG export"""
+        return array_image(self.read(rect), self.FORMAT)
+
+    def draw(self, painter, point, source_rect=None):
+        """Draw the part of the image inside `source_rect` with its top left at `point`"""
+        source_rect = self.rect() if source_rect is None else source_rect
+        for key in self.tile_keys(source_rect):
+            tile = self.tiles.get(key)
+            if tile is None:
+                continue
+            tile_rect = self.tile_rect(key)
+            part = tile_rect.intersected(source_rect)
+            painter.drawImage(
+                point + (part.topLeft() - source_rect.topLeft()),
+                tile,
+                part.translated(-tile_rect.topLeft()),
+            )
+
+    def sample(self, xs, ys):
+        """Nearest neighbor samples at integer columns `xs` and rows `ys`, e.g. for thumbnails"""
+        xs = np.asarray(xs, dtype=np.intp)
+        ys = np.asarray(ys, dtype=np.intp)
+        samples = np.zeros((len(ys), len(xs)), dtype=np.uint32)
+        ts = self.tile_size
+        column_tiles = xs // ts
+        row_tiles = ys // ts
+
+        for (tx, ty), tile in self.tiles.items():
+            columns = np.flatnonzero(column_tiles == tx)
+            rows = np.flatnonzero(row_tiles == ty)
+            if len(columns) and len(rows):
+                view = image_array(tile)
+                samples[np.ix_(rows, columns)] = view[np.ix_(ys[rows] - ty * ts, xs[columns] - tx * ts)]
+        return samples
+
+    def thumbnail(self, size, content_rect=None):
+        """Nearest neighbor scaled copy fitting in `size` while keeping the aspect ratio.
+
+        Only the pixels inside `content_rect` are sampled when it is given.
+        """
+        size = self.size.scaled(size, QtCore.Qt.KeepAspectRatio)
+        if size.isEmpty():
+            return QtGui.QImage()
+        xs = ((np.arange(size.width()) + 0.5) * self.width() / size.width()).astype(np.intp)
+        ys = ((np.arange(size.height()) + 0.5) * self.height() / size.height()).astype(np.intp)
+
+        content_rect = self.rect() if content_rect is None else content_rect
+        columns = np.flatnonzero((xs >= content_rect.left()) & (xs <= content_rect.right()))
+        rows = np.flatnonzero((ys >= content_rect.top()) & (ys <= content_rect.bottom()))
+
+        pixels = np.zeros((len(ys), len(xs)), dtype=np.uint32)
+        if len(columns) and len(rows):
+            pixels[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1] = self.sample(xs[columns], ys[rows])
+        return array_image(pixels, self.FORMAT)